@@ -1,217 +1,1919 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
 import json
 import time
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
+import contextlib
+import contextvars
+import fcntl
+import functools
+import hashlib
+import hmac
+import uuid
+import heapq
+import math
+import re
+import queue
+import random
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict, deque
+import multiprocessing
+import signal
+import socket
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from typing import List, Dict, Any, Optional, Tuple
 
+# Heavy dependencies (azure-ai-inference, aiohttp, langchain, pypdf, chromadb,
+# sentence-transformers) are imported where they are first used. The warm-up
+# thread touches them all at startup, off the request path, so a worker is
+# live within a fraction of a second and turns ready once warmed.
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='frontend/build', static_url_path='')
 CORS(app)  # Enable CORS for all routes
 
 # Constants
-GITHUB_TOKEN = "YOUR_GITHUB_TOKEN"
+GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN", "YOUR_GITHUB_TOKEN")
 PDF_DIR = "knowledge_base"
-USER_DATA_FILE = "user_profile.json"
-ENDPOINT = "https://models.inference.ai.azure.com"
+PROFILE_DB = os.environ.get("PROFILE_DB", "user_profiles.sqlite3")
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", 1000))
+PROFILE_WRITE_BATCH = int(os.environ.get("PROFILE_WRITE_BATCH", 256))
+# Bearer token for reading any profile and for /api/profiles/export, which
+# stays closed while it is unset
+PROFILE_API_TOKEN = os.environ.get("PROFILE_API_TOKEN")
+# Signs the per-user tokens handed out with new profile ids. Without it a
+# random key is used and tokens stop working when the server restarts.
+PROFILE_TOKEN_SECRET = os.environ.get("PROFILE_TOKEN_SECRET")
+ENDPOINT = os.environ.get("MODEL_ENDPOINT", "https://models.inference.ai.azure.com")
+CHROMA_DIR = "./chroma_db"
+PLAN_MODEL = "deepseek-r1"
+PLAN_MAX_TOKENS = 4000
+COLLECTION_NAME = "ayush_knowledge_base"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_POLL_INTERVAL = float(os.environ.get("INGEST_POLL_INTERVAL", 5))
+INGEST_PAGES_PER_TASK = int(os.environ.get("INGEST_PAGES_PER_TASK", 8))
+INGEST_BATCH_MIN = int(os.environ.get("INGEST_BATCH_MIN", 16))
+INGEST_BATCH_MAX = int(os.environ.get("INGEST_BATCH_MAX", 512))
+INGEST_BATCH_TARGET_SECONDS = float(os.environ.get("INGEST_BATCH_TARGET_SECONDS", 1.0))
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# torch (sentence-transformers), onnx (ONNX Runtime, fp32) or onnx-int8 (quantized)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_REPO = os.environ.get("EMBEDDING_ONNX_REPO", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_ONNX_FILES = {
+    "onnx": os.environ.get("EMBEDDING_ONNX_FILE", "onnx/model.onnx"),
+    "onnx-int8": os.environ.get("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+}
+EMBEDDING_MAX_LENGTH = 256
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+EMBED_MAX_WAIT = float(os.environ.get("EMBED_MAX_WAIT_MS", 10)) / 1000
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 3600))
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") != "0"
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.environ.get("RRF_K", 60))
+# Plan prompt context: chunks retrieved, token budgets and dedup thresholds
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", 6))
+CONTEXT_PROFILE_TOKENS = int(os.environ.get("CONTEXT_PROFILE_TOKENS", 800))
+CONTEXT_KNOWLEDGE_TOKENS = int(os.environ.get("CONTEXT_KNOWLEDGE_TOKENS", 1000))
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", 0.8))
+CONTEXT_MIN_REPEAT_CHARS = 30
+CONTEXT_MIN_CHUNK_TOKENS = 50
+# Per-facet retrieval queries built from the profile
+SUB_QUERY_TOKENS = int(os.environ.get("SUB_QUERY_TOKENS", 120))
+SUB_QUERY_CANDIDATES = int(os.environ.get("SUB_QUERY_CANDIDATES", 4))
+ROUTE_CONCURRENCY = {
+    "health": 64,
+    "collect-info": 16,
+    "submit-responses": 16,
+    "generate-plan": 4,
+    "ask-question": 16,
+    "generate-plans-batch": 2,
+    **json.loads(os.environ.get("ROUTE_CONCURRENCY", "{}"))
+}
+ROUTE_QUEUE_TIMEOUT = float(os.environ.get("ROUTE_QUEUE_TIMEOUT", 0.5))
+COMPLETION_CACHE_SIZE = int(os.environ.get("COMPLETION_CACHE_SIZE", 512))
+COMPLETION_CACHE_TTL = float(os.environ.get("COMPLETION_CACHE_TTL", 24 * 3600))
+COMPLETION_CACHE_DB = os.environ.get("COMPLETION_CACHE_DB")  # e.g. "completion_cache.sqlite3"
+COMPLETION_CACHE_MAX_ROWS = int(os.environ.get("COMPLETION_CACHE_MAX_ROWS", 10000))
+COMPLETION_CACHE_MAX_TEMPERATURE = float(os.environ.get("COMPLETION_CACHE_MAX_TEMPERATURE", 0.3))
+MODEL_TIMEOUTS = {
+    "default": 60,
+    "gpt-4o-mini": 30,
+    "deepseek-r1": 180,
+    **json.loads(os.environ.get("MODEL_TIMEOUTS", "{}"))
+}
+# Total seconds one model call may take, retries and backoff included, so a
+# slow upstream can't hold a route slot for MODEL_MAX_RETRIES + 1 timeouts
+MODEL_CALL_BUDGETS = {
+    "default": 90,
+    "gpt-4o-mini": 45,
+    "deepseek-r1": 240,
+    **json.loads(os.environ.get("MODEL_CALL_BUDGETS", "{}"))
+}
+# Models to try in order when the requested one fails
+MODEL_FALLBACK_CHAINS = {
+    "deepseek-r1": ["deepseek-r1", "gpt-4o-mini"],
+    "gpt-4o-mini": ["gpt-4o-mini"],
+    **json.loads(os.environ.get("MODEL_FALLBACK_CHAINS", "{}"))
+}
+MODEL_MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", 2))
+MODEL_RETRY_BASE_DELAY = float(os.environ.get("MODEL_RETRY_BASE_DELAY", 0.5))
+MODEL_RETRY_MAX_DELAY = float(os.environ.get("MODEL_RETRY_MAX_DELAY", 8))
+MODEL_BREAKER_THRESHOLD = int(os.environ.get("MODEL_BREAKER_THRESHOLD", 5))
+MODEL_BREAKER_RESET = float(os.environ.get("MODEL_BREAKER_RESET", 30))
+MODEL_POOL_SIZE = int(os.environ.get("MODEL_POOL_SIZE", 32))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 1000))
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 7 * 24 * 3600))
+SESSION_DB = os.environ.get("SESSION_DB")  # e.g. "sessions.sqlite3"
+# Token budgets for each piece of a follow-up question prompt
+SESSION_PROFILE_TOKENS = int(os.environ.get("SESSION_PROFILE_TOKENS", 400))
+SESSION_PLAN_TOKENS = int(os.environ.get("SESSION_PLAN_TOKENS", 1500))
+SESSION_SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", 300))
+SESSION_RECENT_TOKENS = int(os.environ.get("SESSION_RECENT_TOKENS", 500))
+# Semantic answer cache for ask-question: a paraphrase of an earlier question
+# about the same profile and plan gets the earlier answer when the question
+# embeddings' cosine similarity is at least SEMANTIC_CACHE_THRESHOLD
+SEMANTIC_CACHE = os.environ.get("SEMANTIC_CACHE", "1") != "0"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.9))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 5000))
+SEMANTIC_CACHE_PER_SCOPE = int(os.environ.get("SEMANTIC_CACHE_PER_SCOPE", 50))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", 24 * 3600))
+# Shorter questions ("why?", "and lunch?") depend on the conversation so far
+SEMANTIC_CACHE_MIN_WORDS = int(os.environ.get("SEMANTIC_CACHE_MIN_WORDS", 3))
+# Batch plan jobs: profiles per job, plan model calls in flight and started
+# per minute across all jobs, and how long finished jobs can be fetched
+BATCH_MAX_PROFILES = int(os.environ.get("BATCH_MAX_PROFILES", 200))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+BATCH_CALLS_PER_MINUTE = float(os.environ.get("BATCH_CALLS_PER_MINUTE", 60))
+BATCH_MAX_JOBS = int(os.environ.get("BATCH_MAX_JOBS", 100))
+BATCH_JOB_TTL = float(os.environ.get("BATCH_JOB_TTL", 24 * 3600))
+# Production serving: SERVE_WORKERS > 0 runs that many pre-forked query
+# workers plus one retrieval sidecar instead of the development server
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", 0))
+SERVE_HOST = os.environ.get("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.environ.get("SERVE_PORT", 5000))
+# SERVE_ASGI=1 serves the /api/* routes from asyncio handlers under uvicorn
+# (the rest of the Flask app is mounted behind them), alone or in each worker
+SERVE_ASGI = os.environ.get("SERVE_ASGI", "0") != "0"
+SERVE_WSGI_THREADS = int(os.environ.get("SERVE_WSGI_THREADS", 16))
+RETRIEVAL_SOCKET = os.environ.get(
+    "RETRIEVAL_SOCKET", os.path.join(tempfile.gettempdir(), f"ayush-retrieval-{SERVE_PORT}.sock")
+)
+RETRIEVAL_STATUS_INTERVAL = float(os.environ.get("RETRIEVAL_STATUS_INTERVAL", 1.0))
+# Requests slower than this log their span breakdown; PROFILE_SLOW_REQUESTS=1
+# also samples their stacks while they run
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", 5))
+PROFILE_SLOW_REQUESTS = os.environ.get("PROFILE_SLOW_REQUESTS", "0") != "0"
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.01))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Prometheus-style metrics, kept in process and rendered on /api/metrics
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
 
-# Initialize Azure AI Inference client
-github_client = ChatCompletionsClient(
-    endpoint=ENDPOINT,
-    credential=AzureKeyCredential(GITHUB_TOKEN),
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    lines.append(f"{self.name}_bucket{format_labels(names, labels + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(names, labels + ('+Inf',))} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {series['count']}")
+        return lines
+
+request_duration = Histogram(
+    "ayush_request_duration_seconds", "HTTP request duration, including streamed bodies", ("route", "method", "status")
+)
+stage_duration = Histogram(
+    "ayush_stage_duration_seconds", "Time spent per request path stage", ("stage",)
+)
+model_call_duration = Histogram(
+    "ayush_model_call_duration_seconds", "Upstream model call duration per attempt", ("model", "outcome")
+)
+model_first_token = Histogram(
+    "ayush_model_time_to_first_token_seconds", "Time to first streamed token", ("model",)
+)
+model_tokens = Counter(
+    "ayush_model_tokens_total", "Model tokens by kind (usage when reported, otherwise estimated)", ("model", "kind")
+)
+fallback_count = Counter(
+    "ayush_fallbacks_total", "Fallbacks to another model or to the local responder", ("kind",)
 )
 
-# Create vector database from PDFs - keeping your existing implementation
-def create_vector_db():
-    # Create directory for knowledge base if it doesn't exist
-    os.makedirs(PDF_DIR, exist_ok=True)
-    
-    # Check if we have PDFs to process
-    pdf_files = [f for f in os.listdir(PDF_DIR) if f.endswith('.pdf')]
-    
-    if not pdf_files:
-        print(f"No PDF files found in {PDF_DIR}. Please add your knowledge base PDFs.")
-        return None
-    
-    # Load and process PDFs
-    documents = []
-    for pdf in pdf_files:
-        loader = PyPDFLoader(os.path.join(PDF_DIR, pdf))
-        documents.extend(loader.load())
-    
-    # Split documents into chunks
+# Request traces. Each request gets a Trace in a context variable; spans add
+# their timing to it and to the stage histogram. Context variables follow the
+# request onto the model loop (run_coroutine_threadsafe copies the caller's
+# context) and into executors that are handed a copied context.
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+class Trace:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.start = time.time()
+        self.spans = []
+        self.samples = {}
+        self.thread_id = threading.get_ident()
+
+    def breakdown(self):
+        return ", ".join(f"{stage} {seconds:.3f}s" for stage, _, seconds in self.spans)
+
+def record_span(stage, seconds):
+    stage_duration.observe(seconds, stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append((stage, round(time.time() - seconds - trace.start, 4), round(seconds, 4)))
+
+@contextlib.contextmanager
+def span(stage):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(stage, time.time() - start)
+
+# Stack sampler for slow requests. Sampling starts once a request has been
+# running for SLOW_REQUEST_SECONDS, so fast requests cost nothing.
+class SamplingProfiler:
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start_request(self, trace):
+        with self._lock:
+            self._active[trace.thread_id] = trace
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+                self._thread.start()
+
+    def finish_request(self, trace):
+        with self._lock:
+            self._active.pop(trace.thread_id, None)
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                active = [trace for trace in self._active.values() if now - trace.start >= self.threshold]
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for trace in active:
+                frame = frames.get(trace.thread_id)
+                stack = []
+                while frame is not None and len(stack) < 40:
+                    stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    trace.samples[key] = trace.samples.get(key, 0) + 1
+
+sampling_profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL, SLOW_REQUEST_SECONDS)
+recent_slow_requests = deque(maxlen=20)
+
+# Default slow-request hook: log the span breakdown and the hottest stacks.
+# More hooks (e.g. shipping profiles elsewhere) can be appended to
+# slow_request_hooks; each gets the finished trace and its duration.
+def log_slow_request(trace, duration):
+    top_stacks = sorted(trace.samples.items(), key=lambda item: item[1], reverse=True)[:5]
+    print(f"Slow request {trace.method} {trace.path} took {duration:.2f}s: {trace.breakdown() or 'no spans'}")
+    for stack, count in top_stacks:
+        print(f"  {count} samples: {' <- '.join(reversed(stack.split(';')[-6:]))}")
+    recent_slow_requests.append({
+        "method": trace.method,
+        "path": trace.path,
+        "seconds": round(duration, 3),
+        "spans": trace.spans,
+        "stacks": [{"stack": stack.split(";"), "samples": count} for stack, count in top_stacks]
+    })
+
+slow_request_hooks = [log_slow_request]
+
+# Imports the heavy dependencies once, under a lock. langchain's package
+# init is not safe to run from two threads at once (warm-up and ingestion
+# start together), so every lazy import site calls this first.
+_imports_done = False
+_imports_lock = threading.Lock()
+
+def import_dependencies():
+    global _imports_done
+    if _imports_done:
+        return
+    with _imports_lock:
+        if not _imports_done:
+            import aiohttp  # noqa: F401
+            import pypdf  # noqa: F401
+            import azure.ai.inference.aio  # noqa: F401
+            import azure.core.pipeline.transport  # noqa: F401
+            import langchain.docstore.document  # noqa: F401
+            import langchain.text_splitter  # noqa: F401
+            _imports_done = True
+
+# Embedding backends all take a list of texts and return normalized float32
+# vectors as a numpy array, so they can be swapped without re-plumbing callers
+class TorchEmbeddingBackend:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts, batch_size):
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+# Runs the exported MiniLM graph with ONNX Runtime and reproduces the
+# sentence-transformers pipeline (mean pooling, then L2 normalization).
+# No torch import needed.
+class OnnxEmbeddingBackend:
+    def __init__(self, repo_id, filename):
+        import numpy as np
+        import onnxruntime
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+        self.np = np
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(repo_id, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            hf_hub_download(repo_id, filename), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(self, texts, batch_size):
+        np = self.np
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[i:i + batch_size])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feeds)[0]
+            
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            outputs.append(pooled / np.clip(norms, 1e-12, None))
+        return np.concatenate(outputs).astype(np.float32)
+
+def load_embedding_backend(backend, model_name):
+    if backend == "torch":
+        return TorchEmbeddingBackend(model_name)
+    if backend in EMBEDDING_ONNX_FILES:
+        return OnnxEmbeddingBackend(EMBEDDING_ONNX_REPO, EMBEDDING_ONNX_FILES[backend])
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected torch, onnx or onnx-int8")
+
+# Shared embedding service: the embedding backend is loaded once per process
+# and concurrent encode calls from request threads are batched together
+class EmbeddingService:
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBED_BATCH_SIZE, max_wait=EMBED_MAX_WAIT, backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.total_embeddings = 0
+        self.total_batches = 0
+        self.total_encode_seconds = 0.0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.time()
+                    self._model = load_embedding_backend(self.backend, self.model_name)
+                    print(f"Loaded embedding model {self.model_name} ({self.backend}) in {time.time() - start:.1f}s")
+        return self._model
+
+    def _encode_now(self, texts):
+        start = time.time()
+        embeddings = self.model.encode(texts, self.batch_size)
+        elapsed = time.time() - start
+        with self._stats_lock:
+            self.total_embeddings += len(texts)
+            self.total_batches += 1
+            self.total_encode_seconds += elapsed
+        return embeddings.tolist()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def _batch_loop(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.time() + self.max_wait
+            # Collect more requests until the batch is full or max_wait has passed
+            while size < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                embeddings = self._encode_now(texts)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for item_texts, future in pending:
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def encode(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        # Large inputs (e.g. ingestion) already fill a batch, so encode them directly
+        if len(texts) >= self.batch_size:
+            return self._encode_now(texts)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def stats(self):
+        with self._stats_lock:
+            rate = self.total_embeddings / self.total_encode_seconds if self.total_encode_seconds else 0.0
+            return {
+                "model": self.model_name,
+                "backend": self.backend,
+                "loaded": self._model is not None,
+                "embeddings": self.total_embeddings,
+                "batches": self.total_batches,
+                "embeddings_per_second": round(rate, 1)
+            }
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+def get_embedding_service():
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService()
+    return _embedding_service
+
+# Embedding function compatible with Chroma, backed by the shared embedding service
+class CustomEmbeddingFunction:
+    def __init__(self, service=None):
+        self.service = service or get_embedding_service()
+
+    def __call__(self, input):
+        # This matches the expected signature for Chroma's EmbeddingFunction
+        return self.service.encode(input)
+
+# Bounded LRU cache whose entries also expire after a TTL
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+# Query embeddings depend only on the text; retrieval results are cleared
+# whenever ingestion changes the collection
+query_embedding_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+retrieval_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+# Ingestion manifest: records which PDFs (by content hash) and which chunker
+# and embedding settings produced the chunks currently stored in the collection
+INGEST_MANIFEST_FILE = os.path.join(CHROMA_DIR, "ingest_manifest.json")
+KEYWORD_INDEX_FILE = os.path.join(CHROMA_DIR, "keyword_index.json")
+INGEST_LOCK_FILE = os.path.join(CHROMA_DIR, "ingest.lock")
+
+def load_ingest_manifest():
+    try:
+        with open(INGEST_MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"settings": None, "files": {}}
+
+def save_ingest_manifest(manifest):
+    # Write to a temp file and rename so a crash never leaves a half-written manifest
+    tmp_path = INGEST_MANIFEST_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, INGEST_MANIFEST_FILE)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def make_chunk_id(file_hash, page, index):
+    # Stable, content-derived id: the same file content always maps to the same ids
+    key = f"{file_hash}:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{page}:{index}"
+    return "chunk_" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+# Extract the text of pages [start, end) of a PDF. Runs in worker processes.
+def extract_pdf_pages(pdf_path, start, end):
+    from pypdf import PdfReader
+    reader = PdfReader(pdf_path)
+    return [(page, reader.pages[page].extract_text()) for page in range(start, end)]
+
+# Parse page ranges of the changed PDFs across a process pool and yield them
+# as they finish. Only a bounded number of ranges is in flight at once, so
+# parsed text never piles up faster than it is embedded. A spawn context
+# keeps the workers clear of this process's threads.
+def iter_pdf_page_batches(tasks):
+    if len(tasks) <= 1 or INGEST_WORKERS <= 1:
+        for item, start, end in tasks:
+            yield item, extract_pdf_pages(item[1], start, end)
+        return
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=context) as pool:
+        task_iter = iter(tasks)
+        pending = {}
+        
+        def submit_next():
+            for item, start, end in task_iter:
+                pending[pool.submit(extract_pdf_pages, item[1], start, end)] = item
+                return
+        
+        for _ in range(INGEST_WORKERS * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                submit_next()
+                yield item, future.result()
+
+# Chunk pages as they arrive, yielding (pdf, chunk_id, text, metadata)
+def iter_pdf_chunks(changed):
+    import_dependencies()
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from pypdf import PdfReader
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len
     )
-    chunks = text_splitter.split_documents(documents)
+    tasks = []
+    remaining = {}
+    for item in changed:
+        page_count = len(PdfReader(item[1]).pages)
+        ranges = [(item, start, min(start + INGEST_PAGES_PER_TASK, page_count))
+                  for start in range(0, page_count, INGEST_PAGES_PER_TASK)]
+        remaining[item[0]] = len(ranges)
+        if not ranges:
+            ingest_status.increment("files_done")
+        tasks.extend(ranges)
+    ingest_status.update(pages_total=sum(end - start for _, start, end in tasks))
     
-    # Create a custom embedding function compatible with Chroma
-    from sentence_transformers import SentenceTransformer
-    import numpy as np
-    
-    class CustomEmbeddingFunction:
-        def __init__(self, model_name="all-MiniLM-L6-v2"):
-            self.model = SentenceTransformer(model_name)
-            
-        def __call__(self, input):
-            # This matches the expected signature for Chroma's EmbeddingFunction
-            embeddings = self.model.encode(input, convert_to_numpy=True)
-            return embeddings.tolist()
+    for (pdf, pdf_path, file_hash, stat), pages in iter_pdf_page_batches(tasks):
+        for page, text in pages:
+            for index, chunk in enumerate(text_splitter.split_text(text)):
+                metadata = {"source": pdf_path, "page": page, "file_hash": file_hash}
+                yield pdf, make_chunk_id(file_hash, page, index), chunk, metadata
+        ingest_status.increment("pages_done", len(pages))
+        remaining[pdf] -= 1
+        if remaining[pdf] == 0:
+            ingest_status.increment("files_done")
+
+# Batch size for embedding and writing chunks, adjusted after every batch so
+# that one batch takes roughly INGEST_BATCH_TARGET_SECONDS
+class AdaptiveBatchSize:
+    def __init__(self, initial, minimum, maximum, target_seconds):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+
+    def record(self, count, elapsed):
+        if count < self.size or elapsed <= 0:
+            return
+        ideal = count / elapsed * self.target_seconds
+        # Move halfway towards the ideal size to avoid oscillating
+        self.size = int(max(self.minimum, min(self.maximum, (self.size + ideal) / 2)))
+
+# Stream chunks of the changed PDFs into the collection: embed in adaptive
+# batches and write each batch before parsing further ahead. Returns the
+# chunk ids written for each PDF.
+def ingest_changed_pdfs(collection, changed, keyword_index=None):
+    service = get_embedding_service()
+    batch_size = AdaptiveBatchSize(INGEST_BATCH_MIN * 4, INGEST_BATCH_MIN, INGEST_BATCH_MAX, INGEST_BATCH_TARGET_SECONDS)
+    chunk_ids = {item[0]: [] for item in changed}
+    batch = []
     
-    # Initialize Chroma directly
-    import chromadb
-    from chromadb.config import Settings
+    def flush():
+        start = time.time()
+        embeddings = service.encode([text for _, _, text, _ in batch])
+        encoded = time.time()
+        record_span("ingest_encode", encoded - start)
+        collection.upsert(
+            ids=[chunk_id for _, chunk_id, _, _ in batch],
+            documents=[text for _, _, text, _ in batch],
+            metadatas=[metadata for _, _, _, metadata in batch],
+            embeddings=embeddings
+        )
+        if keyword_index is not None:
+            keyword_index.add(
+                [chunk_id for _, chunk_id, _, _ in batch],
+                [text for _, _, text, _ in batch],
+                [metadata for _, _, _, metadata in batch]
+            )
+        record_span("ingest_upsert", time.time() - encoded)
+        batch_size.record(len(batch), time.time() - start)
+        ingest_status.increment("chunks_added", len(batch))
+        batch.clear()
     
-    # Create a persistent client
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
+    for pdf, chunk_id, text, metadata in iter_pdf_chunks(changed):
+        chunk_ids[pdf].append(chunk_id)
+        batch.append((pdf, chunk_id, text, metadata))
+        if len(batch) >= batch_size.size:
+            flush()
+    if batch:
+        flush()
+    return chunk_ids
+
+# Progress of the current (or last) ingestion run, shown on /api/ingest/status
+class IngestStatus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {
+            "state": "idle",
+            "runs": 0,
+            "files_total": 0,
+            "files_done": 0,
+            "pages_total": 0,
+            "pages_done": 0,
+            "chunks_added": 0,
+            "chunks_removed": 0,
+            "started_at": None,
+            "finished_at": None,
+            "last_error": None
+        }
+
+    def update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+
+    def increment(self, field, amount=1):
+        with self._lock:
+            self._state[field] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._state)
+
+ingest_status = IngestStatus()
+
+# Running latency figures per retrieval stage, shown on /api/health
+class LatencyStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, seconds):
+        record_span(stage, seconds)
+        with self._lock:
+            count, total, worst, _ = self._stages.get(stage, (0, 0.0, 0.0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds, max(worst, seconds), seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 2),
+                    "max_ms": round(worst * 1000, 2),
+                    "last_ms": round(last * 1000, 2)
+                }
+                for stage, (count, total, worst, last) in self._stages.items()
+            }
+
+retrieval_latency = LatencyStats()
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it its my of on or that the this to was "
+    "were will with you your what which who how when do does not no yes none any per".split()
+)
+
+def tokenize(text):
+    return [token for token in re.findall(r"\w+", text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+# BM25 keyword index over the same chunks as the Chroma collection. Exact
+# terms like herb, asana and Sanskrit names are often poorly represented by
+# the MiniLM embeddings, so this catches what dense search misses.
+class KeywordIndex:
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        for chunk_id, (text, metadata, term_counts) in data["docs"].items():
+            index._add(chunk_id, text, metadata, term_counts)
+        return index
+
+    def save(self):
+        with self._lock:
+            data = {"docs": {
+                chunk_id: [doc["text"], doc["metadata"], doc["terms"]]
+                for chunk_id, doc in self.docs.items()
+            }}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _add(self, chunk_id, text, metadata, term_counts):
+        self.docs[chunk_id] = {
+            "text": text,
+            "metadata": metadata,
+            "terms": term_counts,
+            "length": sum(term_counts.values())
+        }
+        self.total_length += self.docs[chunk_id]["length"]
+        for term, count in term_counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = count
+
+    def add(self, chunk_ids, texts, metadatas):
+        with self._lock:
+            for chunk_id, text, metadata in zip(chunk_ids, texts, metadatas):
+                if chunk_id in self.docs:
+                    self._remove(chunk_id)
+                term_counts = {}
+                for token in tokenize(text):
+                    term_counts[token] = term_counts.get(token, 0) + 1
+                self._add(chunk_id, text, metadata, term_counts)
+
+    def _remove(self, chunk_id):
+        doc = self.docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        self.total_length -= doc["length"]
+        for term in doc["terms"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove(chunk_id)
+
+    def rebuild(self, collection, page_size=1000):
+        # Rebuild from the collection, e.g. when the index file is missing
+        with self._lock:
+            self.docs, self.postings, self.total_length = {}, {}, 0
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    break
+                self.add(page["ids"], page["documents"], page["metadatas"])
+                offset += len(page["ids"])
+
+    def search(self, query, k):
+        with self._lock:
+            if not self.docs:
+                return []
+            doc_count = len(self.docs)
+            avg_length = self.total_length / doc_count or 1
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, count in postings.items():
+                    length = self.docs[chunk_id]["length"]
+                    norm = count + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / norm
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(chunk_id, self.docs[chunk_id]["text"], self.docs[chunk_id]["metadata"], score) for chunk_id, score in top]
+
+# Reciprocal rank fusion of several ranked lists of (id, text, metadata, score)
+def reciprocal_rank_fusion(result_lists, k):
+    scores = {}
+    entries = {}
+    for results in result_lists:
+        for rank, (chunk_id, text, metadata, _) in enumerate(results):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            entries.setdefault(chunk_id, (text, metadata))
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [(chunk_id, entries[chunk_id][0], entries[chunk_id][1], scores[chunk_id]) for chunk_id in ranked]
+
+# (Document, score) pairs from cached (text, metadata, score) tuples
+def make_documents(cached):
+    import_dependencies()
+    from langchain.docstore.document import Document
+    return [(Document(page_content=text, metadata=dict(metadata)), score) for text, metadata, score in cached]
+
+# Custom wrapper for LangChain compatibility. It provides the VectorStore
+# methods the app uses (similarity_search, as_retriever) without subclassing,
+# so langchain is only imported when Documents are first built.
+class ChromaWrapper:
+    def __init__(self, client, collection_name, embedding_function, keyword_index=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.collection = client.get_collection(collection_name, embedding_function=embedding_function)
+        self.embedding_function = embedding_function
+        self.keyword_index = keyword_index
     
-    # Create or get collection
-    embedding_function = CustomEmbeddingFunction()
-    collection = chroma_client.get_or_create_collection(
-        name="ayush_knowledge_base",
-        embedding_function=embedding_function
-    )
+    def add_documents(self, documents: List["Document"]):
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        ids = [f"langchain_{i}" for i in range(len(documents))]
+        self.collection.add(
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
+        )
+        if self.keyword_index is not None:
+            self.keyword_index.add(ids, texts, metadatas)
+        retrieval_cache.clear()
     
-    # Add documents to collection
-    texts = [doc.page_content for doc in chunks]
-    metadatas = [doc.metadata for doc in chunks]
-    ids = [f"doc_{i}" for i in range(len(chunks))]
-    
-    # Add in batches to avoid memory issues
-    batch_size = 100
-    for i in range(0, len(texts), batch_size):
-        end_idx = min(i + batch_size, len(texts))
-        collection.add(
-            documents=texts[i:end_idx],
-            metadatas=metadatas[i:end_idx],
-            ids=ids[i:end_idx]
+    def add_texts(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        """Add texts to the vectorstore."""
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        ids = [f"langchain_text_{i}" for i in range(len(texts))]
+        self.collection.add(
+            documents=texts,
+            metadatas=metadatas,
+            ids=ids
         )
+        if self.keyword_index is not None:
+            self.keyword_index.add(ids, texts, metadatas)
+        retrieval_cache.clear()
+        return ids
     
-    # Create a custom wrapper for LangChain compatibility
-    from langchain.vectorstores.base import VectorStore
-    from langchain.docstore.document import Document
+    def embed_query(self, query: str) -> List[float]:
+        return self.embed_queries([query])[0]
     
-    class ChromaWrapper(VectorStore):
-        def __init__(self, client, collection_name, embedding_function):
-            self.client = client
-            self.collection_name = collection_name
-            self.collection = client.get_collection(collection_name)
-            self.embedding_function = embedding_function
+    # Embeds any queries not already cached in a single batch
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        keys = [normalize_query(query) for query in queries]
+        embeddings = [query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(missing, self.embedding_function([queries[i] for i in missing])):
+                embeddings[i] = embedding
+                query_embedding_cache.set(keys[i], embedding)
+        return embeddings
+    
+    def dense_search(self, query: str, k: int) -> List[Tuple[str, str, Dict[str, Any], float]]:
+        start = time.time()
+        embedding = self.embed_query(query)
+        retrieval_latency.record("embed", time.time() - start)
         
-        def add_documents(self, documents: List[Document]):
-            texts = [doc.page_content for doc in documents]
-            metadatas = [doc.metadata for doc in documents]
-            ids = [f"langchain_{i}" for i in range(len(documents))]
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+        start = time.time()
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=k
+        )
+        retrieval_latency.record("dense", time.time() - start)
         
-        def add_texts(self, texts: List[str], metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
-            """Add texts to the vectorstore."""
-            if metadatas is None:
-                metadatas = [{} for _ in texts]
-            ids = [f"langchain_text_{i}" for i in range(len(texts))]
-            self.collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+        # Turn distances into a relevance score where higher is better
+        return [
+            (
+                results['ids'][0][i],
+                results['documents'][0][i],
+                results['metadatas'][0][i] if results['metadatas'][0] else {},
+                1.0 / (1.0 + results['distances'][0][i])
             )
-            return ids
+            for i in range(len(results['documents'][0]))
+        ]
+    
+    def keyword_search(self, query: str, k: int) -> List[Tuple[str, str, Dict[str, Any], float]]:
+        start = time.time()
+        results = self.keyword_index.search(query, k)
+        retrieval_latency.record("keyword", time.time() - start)
+        return results
+    
+    # Cached (text, metadata, score) results; plain data so they can also be
+    # sent to query workers by the retrieval sidecar
+    def search(self, query: str, k: int) -> List[Tuple[str, Dict[str, Any], float]]:
+        key = (normalize_query(query), k)
+        cached = retrieval_cache.get(key)
+        if cached is None:
+            start = time.time()
+            if HYBRID_SEARCH and self.keyword_index is not None and len(self.keyword_index):
+                # Run the keyword leg on its own thread while dense search runs here
+                candidates = max(k, HYBRID_CANDIDATES)
+                keyword_future = hybrid_executor.submit(
+                    contextvars.copy_context().run, self.keyword_search, query, candidates
+                )
+                dense_results = self.dense_search(query, candidates)
+                keyword_results = keyword_future.result()
+                
+                fusion_start = time.time()
+                fused = reciprocal_rank_fusion([dense_results, keyword_results], k)
+                retrieval_latency.record("fusion", time.time() - fusion_start)
+                cached = [(text, metadata, score) for _, text, metadata, score in fused]
+            else:
+                cached = [(text, metadata, score) for _, text, metadata, score in self.dense_search(query, k)]
+            retrieval_latency.record("retrieval", time.time() - start)
+            retrieval_cache.set(key, cached)
+        return cached
+    
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple["Document", float]]:
+        # Build fresh Documents so callers can't mutate the cached results
+        return make_documents(self.search(query, k))
+    
+    def similarity_search(self, query: str, k: int = 4) -> List["Document"]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+    
+    # Several focused queries in one round trip: one embedding batch, one
+    # multi-query Chroma call, keyword legs alongside, fused with RRF
+    def multi_search(self, queries: List[str], k: int, k_per_query: int) -> List[Tuple[str, Dict[str, Any], float]]:
+        return self.batch_multi_search([queries], k, k_per_query)[0]
+    
+    # multi_search for many query groups (one per profile in a batch job). The
+    # uncached groups share the embedding batch and the Chroma call, then each
+    # group is fused and cached on its own.
+    def batch_multi_search(self, query_groups: List[List[str]], k: int, k_per_query: int) -> List[List[Tuple[str, Dict[str, Any], float]]]:
+        keys = [(tuple(normalize_query(query) for query in queries), k, k_per_query) for queries in query_groups]
+        results = [retrieval_cache.get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if not missing:
+            return results
+        
+        start = time.time()
+        queries = [query for i in missing for query in query_groups[i]]
+        use_keywords = HYBRID_SEARCH and self.keyword_index is not None and len(self.keyword_index)
+        keyword_futures = [
+            hybrid_executor.submit(contextvars.copy_context().run, self.keyword_search, query, k_per_query)
+            for query in queries
+        ] if use_keywords else []
+        
+        embed_start = time.time()
+        embeddings = self.embed_queries(queries)
+        retrieval_latency.record("embed", time.time() - embed_start)
+        
+        dense_start = time.time()
+        dense = self.collection.query(query_embeddings=embeddings, n_results=k_per_query)
+        retrieval_latency.record("dense", time.time() - dense_start)
         
-        @classmethod
-        def from_texts(cls, texts: List[str], embedding: Any, metadatas: Optional[List[Dict[str, Any]]] = None, **kwargs):
-            """Create a ChromaWrapper from texts."""
-            # This is just a placeholder implementation to satisfy the abstract method
-            raise NotImplementedError("This method is implemented only to satisfy the abstract class requirement")
+        fusion_start = time.time()
+        offset = 0
+        for i in missing:
+            result_lists = []
+            group = range(offset, offset + len(query_groups[i]))
+            for q in group:
+                metadatas = dense['metadatas'][q] or [{}] * len(dense['ids'][q])
+                result_lists.append([
+                    (chunk_id, text, metadata or {}, 1.0 / (1.0 + distance))
+                    for chunk_id, text, metadata, distance in zip(
+                        dense['ids'][q], dense['documents'][q], metadatas, dense['distances'][q]
+                    )
+                ])
+            if keyword_futures:
+                result_lists.extend(keyword_futures[q].result() for q in group)
+            fused = reciprocal_rank_fusion(result_lists, k)
+            results[i] = [(text, metadata, score) for _, text, metadata, score in fused]
+            retrieval_cache.set(keys[i], results[i])
+            offset += len(query_groups[i])
+        retrieval_latency.record("fusion", time.time() - fusion_start)
+        retrieval_latency.record("multi_query", time.time() - start)
+        return results
+    
+    def multi_query_search_with_score(self, queries: List[str], k: int = 4, k_per_query: int = 4) -> List[Tuple["Document", float]]:
+        return make_documents(self.multi_search(queries, k, k_per_query))
+    
+    def as_retriever(self, search_kwargs=None):
+        search_kwargs = search_kwargs or {}
         
-        def similarity_search(self, query: str, k: int = 4) -> List[Document]:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=k
+        # Create a direct retriever function that bypasses validation
+        def get_relevant_documents(query):
+            return self.similarity_search(
+                query, 
+                k=search_kwargs.get("k", 4)
             )
-            
-            documents = []
-            for i in range(len(results['documents'][0])):
-                doc = Document(
-                    page_content=results['documents'][0][i],
-                    metadata=results['metadatas'][0][i] if results['metadatas'][0] else {}
-                )
-                documents.append(doc)
-            
-            return documents
         
-        def as_retriever(self, search_kwargs=None):
-            search_kwargs = search_kwargs or {}
-            
-            # Create a direct retriever function that bypasses validation
-            def get_relevant_documents(query):
-                return self.similarity_search(
-                    query, 
-                    k=search_kwargs.get("k", 4)
-                )
-            
-            # Create a simple object with the get_relevant_documents method
-            class CustomRetriever:
-                def __init__(self, func):
-                    self.get_relevant_documents = func
-            
-            return CustomRetriever(get_relevant_documents)
+        # Create a simple object with the get_relevant_documents method
+        class CustomRetriever:
+            def __init__(self, func):
+                self.get_relevant_documents = func
+        
+        return CustomRetriever(get_relevant_documents)
+
+# Name of the Chroma collection the manifest says is complete and live
+def live_collection_name():
+    return load_ingest_manifest().get("collection", COLLECTION_NAME)
+
+# Create vector database from PDFs, only embedding PDFs that are new or changed.
+# Changes are built into a fresh staging collection: chunks of unchanged PDFs
+# are copied over with their stored embeddings and new or changed PDFs are
+# embedded into it. Only once it is complete does the manifest point at it, and
+# the current store keeps serving the previous collection until the caller
+# swaps in the returned wrapper, so queries never see a partial run.
+#
+# Runs hold an exclusive flock on INGEST_LOCK_FILE. Every server worker process
+# runs its own ingestion worker, and a run deletes the collections it isn't
+# serving, which would include another process's staging collection mid-run.
+# A process waiting on the lock finds the other's finished collection in the
+# manifest and usually has nothing left to embed.
+def create_vector_db():
+    os.makedirs(CHROMA_DIR, exist_ok=True)
+    with open(INGEST_LOCK_FILE, "a") as lock_file:
+        # Released when the file is closed, or by the OS if the process dies
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return build_vector_db()
+
+def build_vector_db():
+    # Create directory for knowledge base if it doesn't exist
+    os.makedirs(PDF_DIR, exist_ok=True)
+    
+    pdf_files = sorted(f for f in os.listdir(PDF_DIR) if f.endswith('.pdf'))
+    
+    # Initialize Chroma directly. Stage spans go to the stage histogram and to
+    # the current trace when there is one (see benchmark.py suite).
+    stage_start = time.time()
+    import_dependencies()
+    import chromadb
+    
+    # Create a persistent client
+    chroma_client = chromadb.PersistentClient(path=CHROMA_DIR)
+    embedding_function = CustomEmbeddingFunction(get_embedding_service())
+    
+    # Work out which PDFs changed since the last run
+    manifest = load_ingest_manifest()
+    live_name = manifest.get("collection", COLLECTION_NAME)
+    settings = {
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_backend": EMBEDDING_BACKEND
+    }
+    old_settings = manifest.get("settings")
+    if old_settings is not None:
+        # Manifests written before the embedding backend was recorded used torch
+        old_settings = dict({"embedding_model": EMBEDDING_MODEL, "embedding_backend": "torch"}, **old_settings)
+    if old_settings != settings:
+        # Chunker or embedding settings changed (or first run), so every file must be re-embedded
+        manifest = {"settings": settings, "files": {}}
+    
+    # Drop collections left over from earlier runs: the one the previous run
+    # replaced (its requests finished long ago) and staging from a failed run
+    live = None
+    for collection in chroma_client.list_collections():
+        if collection.name == live_name:
+            live = chroma_client.get_collection(live_name, embedding_function=embedding_function)
+        elif collection.name == COLLECTION_NAME or collection.name.startswith(COLLECTION_NAME + "_"):
+            chroma_client.delete_collection(collection.name)
+    
+    # Identical PDFs share chunk ids, so count unique ids
+    expected_chunks = len({chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunk_ids"]})
+    if live is None or (expected_chunks and live.count() != expected_chunks):
+        if manifest["files"]:
+            # The collection no longer matches the manifest (e.g. chroma_db was reset)
+            print("Ingestion manifest is out of sync with the collection, re-ingesting all PDFs")
+        manifest["files"] = {}
+    
+    # The keyword index is loaded fresh for every run, so the live store keeps
+    # using its own copy until the new one is swapped in
+    keyword_index = KeywordIndex.load(KEYWORD_INDEX_FILE)
+    record_span("ingest_open", time.time() - stage_start)
+    
+    if not pdf_files:
+        # An empty knowledge base has nothing to serve; the caller drops the
+        # live store and the next run deletes its collection
+        if manifest["files"] or live is not None:
+            print(f"No PDF files found in {PDF_DIR}, clearing the vector database")
+            KeywordIndex(KEYWORD_INDEX_FILE).save()
+            save_ingest_manifest({"settings": settings, "files": {}, "collection": None})
+        else:
+            print(f"No PDF files found in {PDF_DIR}. Please add your knowledge base PDFs.")
+        return None
+    
+    stage_start = time.time()
+    old_files = manifest["files"]
+    new_files = {}
+    stale_ids = []
+    changed = []
+    
+    for pdf in pdf_files:
+        pdf_path = os.path.join(PDF_DIR, pdf)
+        stat = os.stat(pdf_path)
+        entry = old_files.get(pdf)
+        # Size and mtime unchanged means we can skip hashing the file
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            new_files[pdf] = entry
+            continue
+        file_hash = file_sha256(pdf_path)
+        if entry and entry["sha256"] == file_hash:
+            new_files[pdf] = dict(entry, size=stat.st_size, mtime=stat.st_mtime)
+            continue
+        if entry:
+            stale_ids.extend(entry["chunk_ids"])
+        changed.append((pdf, pdf_path, file_hash, stat))
+    
+    # Files that disappeared from the knowledge base
+    for pdf, entry in old_files.items():
+        if pdf not in pdf_files:
+            stale_ids.extend(entry["chunk_ids"])
+    record_span("ingest_scan", time.time() - stage_start)
+    
+    if not changed and not stale_ids:
+        # Nothing to rebuild; keep serving the live collection
+        if len(keyword_index) != live.count():
+            print("Keyword index is out of sync with the collection, rebuilding it")
+            keyword_index.rebuild(live)
+            keyword_index.save()
+        if new_files != old_files:
+            manifest["files"] = new_files
+            save_ingest_manifest(dict(manifest, collection=live_name))
+        print(f"Vector database ready: {live.count()} chunks from {len(pdf_files)} PDFs (no changes)")
+        return ChromaWrapper(
+            client=chroma_client,
+            collection_name=live_name,
+            embedding_function=embedding_function,
+            keyword_index=keyword_index
+        )
+    
+    # Copy the chunks of unchanged PDFs into the staging collection
+    stage_start = time.time()
+    staging_name = f"{COLLECTION_NAME}_{uuid.uuid4().hex[:12]}"
+    staging = chroma_client.create_collection(staging_name, embedding_function=embedding_function)
+    kept_ids = list(dict.fromkeys(chunk_id for entry in new_files.values() for chunk_id in entry["chunk_ids"]))
+    for i in range(0, len(kept_ids), 500):
+        page = live.get(ids=kept_ids[i:i + 500], include=["embeddings", "documents", "metadatas"])
+        staging.upsert(
+            ids=page["ids"],
+            embeddings=page["embeddings"],
+            documents=page["documents"],
+            metadatas=page["metadatas"]
+        )
+    record_span("ingest_copy", time.time() - stage_start)
+    stage_start = time.time()
+    
+    ingest_status.update(files_total=len(changed), files_done=0, pages_total=0, pages_done=0,
+                         chunks_added=0, chunks_removed=0)
+    chunk_ids = ingest_changed_pdfs(staging, changed, keyword_index)
+    record_span("ingest_chunks", time.time() - stage_start)
+    stage_start = time.time()
+    total_added = sum(len(ids) for ids in chunk_ids.values())
+    for pdf, pdf_path, file_hash, stat in changed:
+        new_files[pdf] = {
+            "sha256": file_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunk_ids": chunk_ids[pdf]
+        }
+        print(f"Embedded {len(chunk_ids[pdf])} chunks from {pdf}")
+    
+    # Chunks of deleted or changed files were never copied into staging; drop
+    # them from the keyword index too
+    live_ids = {chunk_id for entry in new_files.values() for chunk_id in entry["chunk_ids"]}
+    stale_ids = [i for i in set(stale_ids) if i not in live_ids]
+    keyword_index.remove(stale_ids)
+    ingest_status.update(chunks_removed=len(stale_ids))
+    record_span("ingest_cleanup", time.time() - stage_start)
+    stage_start = time.time()
+    
+    if len(keyword_index) != staging.count():
+        print("Keyword index is out of sync with the collection, rebuilding it")
+        keyword_index.rebuild(staging)
+    keyword_index.save()
+    record_span("ingest_keyword_index", time.time() - stage_start)
+    
+    # Staging is complete: from here on it is the live collection
+    manifest["files"] = new_files
+    manifest["collection"] = staging_name
+    save_ingest_manifest(manifest)
     
     # Create our custom wrapper
     vector_store = ChromaWrapper(
         client=chroma_client,
-        collection_name="ayush_knowledge_base",
-        embedding_function=embedding_function
+        collection_name=staging_name,
+        embedding_function=embedding_function,
+        keyword_index=keyword_index
     )
     
-    print(f"Created vector database with {len(chunks)} chunks from {len(pdf_files)} PDFs")
+    print(f"Vector database ready: {len(live_ids)} chunks from {len(pdf_files)} PDFs "
+          f"({len(changed)} PDFs embedded, {total_added} chunks added, {len(stale_ids)} stale chunks removed)")
     return vector_store
 
-# Function to call GitHub models with Azure AI Inference SDK
-def call_github_model(messages, model_name="gpt-4o-mini", temperature=0.7, max_tokens=1000):
-    try:
-        # Convert messages to the format expected by Azure AI Inference SDK
-        azure_messages = []
-        for msg in messages:
-            if msg["role"] == "system":
-                azure_messages.append(SystemMessage(content=msg["content"]))
-            elif msg["role"] == "user":
-                azure_messages.append(UserMessage(content=msg["content"]))
-        
-        response = github_client.complete(
-            messages=azure_messages,
-            model=model_name,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=1
+# Convert messages to the format expected by Azure AI Inference SDK
+def to_azure_messages(messages):
+    import_dependencies()
+    from azure.ai.inference.models import SystemMessage, UserMessage
+    azure_messages = []
+    for msg in messages:
+        if msg["role"] == "system":
+            azure_messages.append(SystemMessage(content=msg["content"]))
+        elif msg["role"] == "user":
+            azure_messages.append(UserMessage(content=msg["content"]))
+    return azure_messages
+
+# Upstream model calls run on one asyncio loop with the async client. Under
+# Flask, request threads hand their calls to a background loop and wait for
+# the result; under ASGI (SERVE_ASGI=1) the server's own loop is used and
+# handlers await the calls, so no thread is held while a completion runs.
+_async_loop = None
+_async_loop_lock = threading.Lock()
+_async_github_client = None
+
+def get_async_loop():
+    global _async_loop
+    if _async_loop is None:
+        with _async_loop_lock:
+            if _async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="model-io-loop", daemon=True).start()
+                _async_loop = loop
+    return _async_loop
+
+# The ASGI server makes its own loop the model loop, so its handlers await
+# model calls directly. Must run before anything has used get_async_loop().
+def use_async_loop(loop):
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is not None and _async_loop is not loop:
+            raise RuntimeError("the model loop is already running")
+        _async_loop = loop
+
+def run_async(coro, timeout=None):
+    return asyncio.run_coroutine_threadsafe(coro, get_async_loop()).result(timeout)
+
+# Run blocking work (retrieval, SQLite, the sidecar socket) off the event loop,
+# in a copy of the caller's context so its spans land on the request's trace
+async def in_thread(func, *args, executor=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+def get_async_github_client():
+    # Only called from the model loop, so no lock is needed. One aiohttp
+    # session keeps a bounded pool of keep-alive connections to the endpoint.
+    global _async_github_client
+    if _async_github_client is None:
+        import_dependencies()
+        import aiohttp
+        from azure.ai.inference.aio import ChatCompletionsClient as AsyncChatCompletionsClient
+        from azure.core.credentials import AzureKeyCredential
+        from azure.core.pipeline.transport import AioHttpTransport
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MODEL_POOL_SIZE))
+        # ModelClient does the retrying (jittered, honouring Retry-After and
+        # the circuit breakers), so the SDK's own retry policy is turned off
+        _async_github_client = AsyncChatCompletionsClient(
+            endpoint=ENDPOINT,
+            credential=AzureKeyCredential(GITHUB_TOKEN),
+            transport=AioHttpTransport(session=session, session_owner=False),
+            retry_total=0,
         )
+    return _async_github_client
+
+def model_timeout(model_name):
+    return MODEL_TIMEOUTS.get(model_name, MODEL_TIMEOUTS["default"])
+
+def model_call_budget(model_name):
+    return MODEL_CALL_BUDGETS.get(model_name, MODEL_CALL_BUDGETS["default"])
+
+def model_fallback_chain(model_name):
+    chain = MODEL_FALLBACK_CHAINS.get(model_name, [model_name, "gpt-4o-mini"])
+    if model_name not in chain:
+        chain = [model_name] + chain
+    # Drop duplicates while keeping the configured order
+    return list(dict.fromkeys(chain))
+
+def is_auth_error(e):
+    from azure.core.exceptions import ClientAuthenticationError
+    if isinstance(e, ClientAuthenticationError) or getattr(e, "status_code", None) == 401:
+        return True
+    error_str = str(e)
+    return "401" in error_str or "authentication" in error_str.lower()
+
+def is_retryable_error(e):
+    # Timeouts, connection problems, throttling and server errors are worth
+    # retrying; other client errors (bad request, auth) will fail again
+    import aiohttp
+    from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+    if isinstance(e, (asyncio.TimeoutError, ServiceRequestError, ServiceResponseError, aiohttp.ClientError)):
+        return True
+    status = getattr(e, "status_code", None)
+    return status in (408, 429) or (status is not None and status >= 500)
+
+# Circuit breaker per model. After MODEL_BREAKER_THRESHOLD consecutive upstream
+# failures the circuit opens and calls skip that model; after
+# MODEL_BREAKER_RESET seconds a single probe call is let through (half-open).
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return "probe"
+            return False
+
+    # Hands back a probe whose call ended without an outcome (cancelled, or
+    # the client disconnected), so the next call can probe instead
+    def release_probe(self):
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    print(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "times_opened": self.times_opened}
+
+# Resilient model client: per-model timeouts, jittered exponential retries
+# and circuit breakers on top of the pooled async client
+class ModelClient:
+    def __init__(self):
+        self.breakers = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.fallbacks = 0
+        self.local_fallbacks = 0
+        self.throttled = 0
+        # Until when the upstream asked us to back off (429), so batch jobs
+        # can hold new calls instead of adding to the pile of retries
+        self.throttled_until = 0.0
+
+    def breaker(self, model_name):
+        with self._lock:
+            if model_name not in self.breakers:
+                self.breakers[model_name] = CircuitBreaker(model_name, MODEL_BREAKER_THRESHOLD, MODEL_BREAKER_RESET)
+            return self.breakers[model_name]
+
+    def retry_delay(self, attempt, e):
+        # Honour Retry-After on throttling, otherwise full-jitter exponential backoff
+        retry_after = None
+        response = getattr(e, "response", None)
+        if response is not None and getattr(response, "headers", None):
+            retry_after = response.headers.get("Retry-After")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), MODEL_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+        return random.uniform(0, min(MODEL_RETRY_MAX_DELAY, MODEL_RETRY_BASE_DELAY * (2 ** attempt)))
+
+    async def complete(self, messages, model_name, temperature, max_tokens):
+        breaker = self.breaker(model_name)
+        allowed = breaker.allow()
+        if not allowed:
+            raise CircuitOpenError(f"circuit for {model_name} is open")
+        try:
+            return await self._complete(breaker, messages, model_name, temperature, max_tokens)
+        finally:
+            # Outcomes are recorded without awaiting in between, so a probe
+            # still held here belongs to this call
+            if allowed == "probe":
+                breaker.release_probe()
+
+    async def _complete(self, breaker, messages, model_name, temperature, max_tokens):
+        attempt = 0
+        deadline = time.time() + model_call_budget(model_name)
+        while True:
+            self.calls += 1
+            start = time.time()
+            try:
+                content = await asyncio.wait_for(
+                    acomplete(messages, model_name, temperature, max_tokens),
+                    timeout=min(model_timeout(model_name), max(0.0, deadline - start))
+                )
+                model_call_duration.observe(time.time() - start, model_name, "ok")
+                record_span(f"model:{model_name}", time.time() - start)
+                breaker.record_success()
+                return content
+            except Exception as e:
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                model_call_duration.observe(time.time() - start, model_name, outcome)
+                record_span(f"model:{model_name}", time.time() - start)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                if not is_retryable_error(e):
+                    # The upstream answered (e.g. bad request or auth), so it is reachable
+                    breaker.record_success()
+                    raise
+                delay = self.retry_delay(attempt, e)
+                if getattr(e, "status_code", None) == 429:
+                    self.throttled += 1
+                    self.throttled_until = max(self.throttled_until, time.time() + delay)
+                if attempt >= MODEL_MAX_RETRIES or time.time() + delay >= deadline:
+                    # Out of attempts, or the next one couldn't start within the budget
+                    breaker.record_failure()
+                    raise
+                attempt += 1
+                self.retries += 1
+                print(f"Retrying {model_name} in {delay:.2f}s (attempt {attempt}/{MODEL_MAX_RETRIES}): {e!r}")
+                await asyncio.sleep(delay)
+
+    # Streams a completion under the same breaker, call counting and timeouts
+    # as complete(). The response must start within the model's timeout and
+    # finish within its call budget. A started stream can't be retried; callers
+    # fall back to complete() if it fails before the first token.
+    async def stream(self, messages, model_name, temperature, max_tokens):
+        breaker = self.breaker(model_name)
+        allowed = breaker.allow()
+        if not allowed:
+            raise CircuitOpenError(f"circuit for {model_name} is open")
+        self.calls += 1
+        start = time.time()
+        deadline = start + model_call_budget(model_name)
+        received = False
+        try:
+            response = await asyncio.wait_for(
+                get_async_github_client().complete(
+                    stream=True,
+                    messages=to_azure_messages(messages),
+                    model=model_name,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    top_p=1,
+                    connection_timeout=10,
+                    read_timeout=model_timeout(model_name)
+                ),
+                timeout=min(model_timeout(model_name), deadline - start)
+            )
+            try:
+                updates = response.__aiter__()
+                while True:
+                    try:
+                        update = await asyncio.wait_for(updates.__anext__(), timeout=max(0.0, deadline - time.time()))
+                    except StopAsyncIteration:
+                        break
+                    if not update.choices or not update.choices[0].delta.content:
+                        continue
+                    received = True
+                    yield update.choices[0].delta.content
+            finally:
+                await response.aclose()
+            model_call_duration.observe(time.time() - start, model_name, "ok")
+            breaker.record_success()
+        except (GeneratorExit, asyncio.CancelledError):
+            # The client went away. Tokens already arriving show the upstream
+            # is fine; otherwise there is no outcome to record.
+            if received:
+                breaker.record_success()
+            raise
+        except Exception as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            model_call_duration.observe(time.time() - start, model_name, "timeout" if timed_out else "error")
+            if timed_out:
+                self.timeouts += 1
+            if is_retryable_error(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        finally:
+            if allowed == "probe":
+                breaker.release_probe()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "fallbacks": self.fallbacks,
+            "local_fallbacks": self.local_fallbacks,
+            "throttled": self.throttled,
+            "breakers": {name: breaker.stats() for name, breaker in breakers.items()}
+        }
+
+model_client = ModelClient()
+
+# Optional on-disk backend for the completion cache
+class SQLiteCache:
+    def __init__(self, path, max_rows, ttl):
+        self.path = path
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = None
+        self._pid = None
+
+    def _db(self):
+        # Caller holds the lock. The connection is opened on first use in each
+        # process, so forked query workers never share one.
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM completions WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now + self.ttl)
+            )
+            self._writes += 1
+            # Prune expired and oldest rows every so often rather than on every write
+            if self._writes % 100 == 0:
+                conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+            conn.commit()
+
+# Cache for deterministic completions. Identical requests that are already in
+# flight share one upstream call. All model calls run on the background loop,
+# so the in-flight table is only touched from that thread.
+class CompletionCache:
+    def __init__(self, maxsize, ttl, db_path=None, max_rows=10000):
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = SQLiteCache(db_path, max_rows, ttl) if db_path else None
+        self._in_flight = {}
+        self.disk_hits = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(model_name, messages, temperature, max_tokens, top_p=1):
+        payload = json.dumps({
+            "model": model_name,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get_or_call(self, key, call):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
         
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error calling {model_name}: {e}")
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
         
-        # Check if it's an authentication error
-        error_str = str(e)
-        if "401" in error_str or "authentication" in error_str.lower():
-            print("Authentication error detected. Using local fallback mode...")
-            # Generate a reasonable response based on the messages without API
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.disk:
+                value = await asyncio.get_running_loop().run_in_executor(None, self.disk.get, key)
+                if value is not None:
+                    self.disk_hits += 1
+            if value is None:
+                value = await call()
+                if self.disk:
+                    await asyncio.get_running_loop().run_in_executor(None, self.disk.set, key, value)
+            self.memory.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            # Also on cancellation, or coalesced waiters would wait forever
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved when nobody else was waiting on it
+                future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self):
+        return dict(
+            self.memory.stats(),
+            disk=self.disk is not None,
+            disk_hits=self.disk_hits,
+            coalesced=self.coalesced
+        )
+
+completion_cache = CompletionCache(
+    COMPLETION_CACHE_SIZE,
+    COMPLETION_CACHE_TTL,
+    db_path=COMPLETION_CACHE_DB,
+    max_rows=COMPLETION_CACHE_MAX_ROWS
+)
+
+# Single upstream completion; raises on any error
+async def acomplete(messages, model_name, temperature, max_tokens):
+    response = await get_async_github_client().complete(
+        messages=to_azure_messages(messages),
+        model=model_name,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=1
+    )
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        model_tokens.inc(model_name, "prompt", amount=usage.prompt_tokens or 0)
+        model_tokens.inc(model_name, "completion", amount=usage.completion_tokens or 0)
+    return response.choices[0].message.content
+
+# Low-temperature prompts are close to deterministic, so their completions
+# are served from the cache and identical in-flight requests are coalesced
+async def acomplete_cached(messages, model_name, temperature, max_tokens):
+    if temperature > COMPLETION_CACHE_MAX_TEMPERATURE:
+        return await model_client.complete(messages, model_name, temperature, max_tokens)
+    key = CompletionCache.make_key(model_name, messages, temperature, max_tokens)
+    return await completion_cache.get_or_call(
+        key, lambda: model_client.complete(messages, model_name, temperature, max_tokens)
+    )
+
+MODEL_ERROR_RESPONSE = "I apologize, but I encountered an error processing your request. Please try again."
+
+# Set when acall_github_model answers with generate_local_response. Each task
+# has its own copy, so concurrent callers on the model loop (batch jobs) can
+# tell their own fallbacks apart, which the local_fallbacks counter can't.
+answered_locally = contextvars.ContextVar("answered_locally", default=False)
+
+# Function to call GitHub models with Azure AI Inference SDK. Walks the
+# model's fallback chain, skipping models whose circuit is open, and answers
+# locally when the upstream is unhealthy.
+async def acall_github_model(messages, model_name="gpt-4o-mini", temperature=0.7, max_tokens=1000):
+    chain = model_fallback_chain(model_name)
+    for i, model in enumerate(chain):
+        if i > 0:
+            model_client.fallbacks += 1
+            fallback_count.inc("model")
+            print(f"Falling back to {model}...")
+        try:
+            # Cache hits are served before the breaker is consulted; only real
+            # upstream calls take the half-open probe
+            return await acomplete_cached(messages, model, temperature, max_tokens)
+        except CircuitOpenError:
+            print(f"Circuit for {model} is open, skipping it")
+            continue
+        except Exception as e:
+            print(f"Error calling {model}: {e}")
+            
+            # Check if it's an authentication error
+            if is_auth_error(e):
+                print("Authentication error detected. Using local fallback mode...")
+                model_client.local_fallbacks += 1
+                fallback_count.inc("local")
+                answered_locally.set(True)
+                # Generate a reasonable response based on the messages without API
+                with span("local_fallback"):
+                    return generate_local_response(messages)
+    
+    if any(model_client.breaker(model).state != "closed" for model in chain):
+        print("Upstream models are unhealthy. Using local fallback mode...")
+        model_client.local_fallbacks += 1
+        fallback_count.inc("local")
+        answered_locally.set(True)
+        with span("local_fallback"):
             return generate_local_response(messages)
-        
-        # Fallback to gpt-4o-mini if another model fails
-        if model_name != "gpt-4o-mini":
-            print(f"Falling back to gpt-4o-mini...")
-            return call_github_model(messages, "gpt-4o-mini", temperature, max_tokens)
-        else:
-            return "I apologize, but I encountered an error processing your request. Please try again."
+    return MODEL_ERROR_RESPONSE
+
+# Blocking wrapper for request threads
+def call_github_model(messages, model_name="gpt-4o-mini", temperature=0.7, max_tokens=1000):
+    return run_async(acall_github_model(messages, model_name, temperature, max_tokens))
+
+# Stream a completion token by token. If the stream fails before anything was
+# sent, fall back to the regular (non-streaming) call and its fallbacks.
+async def astream_github_model(messages, model_name="gpt-4o-mini", temperature=0.7, max_tokens=1000, label=""):
+    start = time.time()
+    first_token_at = None
+    chunks = 0
+    streamed_chars = 0
+    try:
+        async with contextlib.aclosing(model_client.stream(messages, model_name, temperature, max_tokens)) as tokens:
+            async for content in tokens:
+                if first_token_at is None:
+                    first_token_at = time.time()
+                    model_first_token.observe(first_token_at - start, model_name)
+                    print(f"[{label or model_name}] time to first token: {first_token_at - start:.2f}s")
+                chunks += 1
+                streamed_chars += len(content)
+                yield content
+    except Exception as e:
+        if first_token_at is not None:
+            # Part of the answer already reached the client, so we can't start over
+            raise
+        print(f"Streaming from {model_name} failed ({e!r}), falling back to a regular completion")
+        content = await acall_github_model(messages, model_name, temperature, max_tokens)
+        first_token_at = time.time()
+        chunks = 1
+        print(f"[{label or model_name}] time to first token: {first_token_at - start:.2f}s (fallback)")
+        yield content
+    if streamed_chars:
+        # Streams don't report usage, so token counts are estimated
+        model_tokens.inc(model_name, "prompt", amount=sum(estimate_tokens(msg["content"]) for msg in messages))
+        model_tokens.inc(model_name, "completion", amount=(streamed_chars + 3) // 4)
+    record_span(f"model_stream:{model_name}", time.time() - start)
+    print(f"[{label or model_name}] streamed {chunks} chunks in {time.time() - start:.2f}s")
+
+# Iterate an async generator from a request thread, one item at a time on the
+# model loop. Closing the iterator early closes the generator there too.
+def iterate_on_model_loop(agen):
+    try:
+        while True:
+            try:
+                item = run_async(agen.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        run_async(agen.aclose())
+
+# Server-sent events for a token stream: one event per token, then a final
+# "done" event, or an "error" event if the stream breaks part way
+def sse_frame(payload, event=None):
+    frame = f"data: {json.dumps(payload)}\n\n"
+    return f"event: {event}\n{frame}" if event else frame
+
+def sse_response(tokens, done=None):
+    def events():
+        try:
+            for token in tokens:
+                yield sse_frame({'token': token})
+            yield sse_frame(dict(done or {}, success=True), "done")
+        except Exception as e:
+            yield sse_frame({'success': False, 'error': str(e)}, "error")
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+async def asse_events(tokens, done=None):
+    try:
+        async with contextlib.aclosing(tokens):
+            async for token in tokens:
+                yield sse_frame({'token': token})
+        yield sse_frame(dict(done or {}, success=True), "done")
+    except Exception as e:
+        yield sse_frame({'success': False, 'error': str(e)}, "error")
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def wants_stream(data, accept=None):
+    accept = request.accept_mimetypes if accept is None else accept
+    return bool(data.get('stream')) or accept.best == 'text/event-stream'
 
 # Generate responses locally when API is unavailable
 def generate_local_response(messages):
@@ -296,20 +1998,203 @@ This plan is based on general AYUSH principles. For more personalized recommenda
     else:
         return "I'm currently operating in offline mode. I can help with basic AYUSH lifestyle recommendations, but for more personalized advice, please check your API connection or consult with an AYUSH practitioner."
 
-# Generate lifestyle plan using LLM and RAG
-def generate_lifestyle_plan(user_data, vector_store):
-    # Create retriever from vector store
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
+# Rough token count; about four characters per token for English text
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, budget):
+    if estimate_tokens(text) <= budget:
+        return text
+    # Leave room for the marker so the result stays within the budget
+    return text[:budget * 4 - 4].rsplit(' ', 1)[0] + " ..."
+
+def compact_profile(user_data):
+    return json.dumps(user_data, separators=(',', ':'), ensure_ascii=False)
+
+# Drop empty fields the profile extraction tends to leave behind
+def prune_profile(value):
+    if isinstance(value, dict):
+        pruned = {key: prune_profile(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [prune_profile(item) for item in value if item not in (None, "", [], {})]
+    return value
+
+def normalize_passage(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def shingles(words, size=5):
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+class ContextStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.chunks_dropped = 0
+
+    def record(self, report):
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += report["tokens_before"]
+            self.tokens_after += report["tokens_after"]
+            self.chunks_dropped += report["chunks_dropped"]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+                "chunks_dropped": self.chunks_dropped
+            }
+
+context_stats = ContextStats()
+
+# Builds the knowledge base section for the plan prompt from scored chunks:
+# near-duplicate chunks are dropped, text repeated through chunk overlap is
+# cut, and chunks are added by relevance until the token budget runs out.
+# The separators between chunks count against the budget too.
+def build_knowledge_context(scored_docs, budget):
+    kept_shingles = []
+    seen_text = ""
+    sections = []
+    used = 0
+    dropped = 0
+    for doc, _ in sorted(scored_docs, key=lambda item: item[1], reverse=True):
+        words = normalize_passage(doc.page_content).split()
+        doc_shingles = shingles(words)
+        if any(len(doc_shingles & other) / len(doc_shingles | other) >= CONTEXT_DEDUP_THRESHOLD for other in kept_shingles):
+            dropped += 1
+            continue
+        
+        # Skip lines already included via an earlier chunk's overlap
+        lines = []
+        for line in doc.page_content.split("\n"):
+            normalized = normalize_passage(line)
+            if len(normalized) >= CONTEXT_MIN_REPEAT_CHARS and normalized in seen_text:
+                continue
+            if line.strip():
+                lines.append(line.strip())
+                seen_text += normalized + " "
+        text = "\n".join(lines)
+        if not text:
+            dropped += 1
+            continue
+        
+        separator = estimate_tokens("\n\n") if sections else 0
+        remaining = budget - used - separator
+        if estimate_tokens(text) > remaining:
+            if remaining < CONTEXT_MIN_CHUNK_TOKENS:
+                dropped += 1
+                continue
+            text = truncate_to_tokens(text, remaining)
+        sections.append(text)
+        kept_shingles.append(doc_shingles)
+        used += separator + estimate_tokens(text)
+    return "\n\n".join(sections), dropped
+
+# Profile fields are routed to a sub-query by keywords in their path
+# Matched as whole words (or phrases) of a field's key path and value, with
+# camelCase and snake_case keys split into words, so "rest" doesn't pick up
+# dietary_restrictions and "eat" doesn't pick up body_heat
+PROFILE_FACETS = {
+    "dosha": ("dosha", "doshas", "prakriti", "vikriti", "imbalance", "imbalances", "constitution",
+              "vata", "pitta", "kapha", "body type"),
+    "diet": ("diet", "dietary", "food", "foods", "meal", "meals", "eat", "eating", "appetite", "digestion",
+             "digestive", "craving", "cravings", "allergy", "allergies", "drink", "drinks"),
+    "sleep": ("sleep", "sleeping", "insomnia", "wake", "waking", "bed", "bedtime", "rest", "energy", "fatigue"),
+    "stress": ("stress", "stressors", "anxiety", "mood", "mental", "emotion", "emotional", "mind", "worry", "work"),
+    "exercise": ("exercise", "activity", "yoga", "fitness", "workout", "physical", "sport", "sports",
+                 "walk", "walking")
+}
+FACET_QUERIES = {
+    "dosha": "Ayurvedic recommendations to balance dosha",
+    "diet": "Ayurvedic diet foods to favour and avoid",
+    "sleep": "AYUSH practices for healthy sleep",
+    "stress": "AYUSH techniques for stress management",
+    "exercise": "Yoga asanas and exercise suited to",
+    # Fields no facet matched, e.g. health concerns, conditions and age
+    "general": "AYUSH lifestyle recommendations for"
+}
+# Fields that identify the person rather than describe them; never sent to retrieval
+PROFILE_IDENTITY_WORDS = ("name", "email", "phone", "id")
+
+def flatten_profile(value, path=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten_profile(item, f"{path} {key}".strip())
+    elif isinstance(value, list):
+        for item in value:
+            yield from flatten_profile(item, path)
+    elif value not in (None, ""):
+        yield path, str(value)
+
+def profile_words(text):
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return f" {' '.join(re.findall(r'[a-z0-9]+', text.lower()))} "
+
+# Splits the profile into short, focused retrieval queries. MiniLM truncates
+# its input at 256 word pieces, so one query holding the whole profile only
+# sees its first few fields. Fields no facet matches share one catch-all
+# query, so they still reach retrieval.
+def profile_sub_queries(user_data):
+    facts = {facet: [] for facet in FACET_QUERIES}
+    for path, value in flatten_profile(user_data):
+        if profile_words(path).rsplit(" ", 2)[-2] in PROFILE_IDENTITY_WORDS:
+            continue
+        words = profile_words(f"{path} {value}")
+        matched = False
+        for facet, keywords in PROFILE_FACETS.items():
+            if any(f" {keyword} " in words for keyword in keywords):
+                facts[facet].append(f"{path}: {value}")
+                matched = True
+        if not matched:
+            facts["general"].append(f"{path}: {value}")
+    
+    queries = []
+    for facet, facet_facts in facts.items():
+        if facet_facts:
+            queries.append(truncate_to_tokens(f"{FACET_QUERIES[facet]}: " + "; ".join(facet_facts), SUB_QUERY_TOKENS))
+    return queries
+
+# scored_docs can be passed in when retrieval was already done for a whole batch
+def build_plan_messages(user_data, vector_store, scored_docs=None):
+    # Compact profile for the prompt
+    user_profile = truncate_to_tokens(compact_profile(prune_profile(user_data)), CONTEXT_PROFILE_TOKENS)
     
-    # Create user profile summary
-    user_profile = json.dumps(user_data, indent=2)
+    if scored_docs is None:
+        # Query the knowledge base with one focused sub-query per profile facet
+        queries = profile_sub_queries(user_data)
+        if queries:
+            scored_docs = vector_store.multi_query_search_with_score(
+                queries, k=CONTEXT_CANDIDATES, k_per_query=SUB_QUERY_CANDIDATES
+            )
+        else:
+            query = f"AYUSH lifestyle recommendations for a person with the following profile: {user_profile}"
+            scored_docs = vector_store.similarity_search_with_score(query, k=CONTEXT_CANDIDATES)
     
-    # Query the knowledge base for relevant information
-    query = f"AYUSH lifestyle recommendations for a person with the following profile: {user_profile}"
-    retrieved_docs = retriever.get_relevant_documents(query)
+    # The previous prompt for the same candidates: the pretty-printed profile
+    # and every chunk verbatim. The knowledge section is capped so the new
+    # prompt is never the larger of the two.
+    tokens_before = (
+        estimate_tokens(json.dumps(user_data, indent=2))
+        + estimate_tokens("\n\n".join(doc.page_content for doc, _ in scored_docs))
+    )
+    knowledge_budget = min(CONTEXT_KNOWLEDGE_TOKENS, tokens_before - estimate_tokens(user_profile))
+    with span("prompt_assembly"):
+        knowledge_context, dropped = build_knowledge_context(scored_docs, knowledge_budget)
     
-    # Extract relevant content from retrieved documents
-    knowledge_context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+    report = {
+        "tokens_before": tokens_before,
+        "tokens_after": estimate_tokens(user_profile) + estimate_tokens(knowledge_context),
+        "chunks_dropped": dropped
+    }
+    context_stats.record(report)
+    print(f"Plan context: {report['tokens_after']} tokens, "
+          f"{report['tokens_before'] - report['tokens_after']} saved, {dropped} chunks dropped")
     
     # Create prompt for LLM
     system_prompt = """You are an expert AYUSH lifestyle coach with deep knowledge of Ayurveda, Yoga, Unani, Siddha, and Homeopathy.
@@ -337,35 +2222,1325 @@ RELEVANT KNOWLEDGE BASE INFORMATION:
 Based on this information, create a comprehensive, personalized AYUSH lifestyle plan for this individual.
 Be specific, practical, and thorough in your recommendations."""
 
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+# Generate lifestyle plan using LLM and RAG
+async def agenerate_lifestyle_plan(user_data, vector_store):
+    # Retrieval is blocking (embedding + Chroma), so keep it off the event loop
+    messages = await in_thread(build_plan_messages, user_data, vector_store, executor=retrieval_executor)
+    
     # Generate lifestyle plan using LLM
-    lifestyle_plan = call_github_model(
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        model_name="deepseek-r1",
+    lifestyle_plan = await acall_github_model(
+        messages=messages,
+        model_name=PLAN_MODEL,
         temperature=0.7,
-        max_tokens=4000
+        max_tokens=PLAN_MAX_TOKENS
     )
     
     return lifestyle_plan
 
-# Initialize vector store at startup
+def generate_lifestyle_plan(user_data, vector_store):
+    return run_async(agenerate_lifestyle_plan(user_data, vector_store))
+
+# Plan prompts for many profiles: one batched retrieval for every profile with
+# facet sub-queries, then the prompts are assembled one by one. A profile
+# whose prompt can't be built gets its exception in place of the messages.
+def build_plan_messages_batch(profiles, vector_store):
+    query_groups = [profile_sub_queries(user_data) for user_data in profiles]
+    batched = [i for i, queries in enumerate(query_groups) if queries]
+    scored = {}
+    if batched:
+        results = vector_store.batch_multi_search(
+            [query_groups[i] for i in batched], CONTEXT_CANDIDATES, SUB_QUERY_CANDIDATES
+        )
+        scored = {i: make_documents(cached) for i, cached in zip(batched, results)}
+    
+    message_lists = []
+    for i, user_data in enumerate(profiles):
+        try:
+            message_lists.append(build_plan_messages(user_data, vector_store, scored_docs=scored.get(i)))
+        except Exception as e:
+            message_lists.append(e)
+    return message_lists
+
+# Bounds the plan model calls made by batch jobs: at most BATCH_CONCURRENCY
+# in flight and BATCH_CALLS_PER_MINUTE started, across all jobs. New calls
+# also wait while the upstream is throttling us. Only used on the model I/O
+# loop, so no locking is needed.
+class PlanCallLimiter:
+    def __init__(self, concurrency, calls_per_minute):
+        self.concurrency = concurrency
+        self.interval = 60.0 / calls_per_minute if calls_per_minute > 0 else 0.0
+        self._semaphore = None
+        self._next_start = 0.0
+        self.in_flight = 0
+        self.waited = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            while True:
+                now = time.time()
+                start_at = max(now, self._next_start, model_client.throttled_until)
+                if start_at <= now:
+                    break
+                self.waited += start_at - now
+                await asyncio.sleep(start_at - now)
+            self._next_start = time.time() + self.interval
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "seconds_waited": round(self.waited, 2)
+        }
+
+plan_call_limiter = PlanCallLimiter(BATCH_CONCURRENCY, BATCH_CALLS_PER_MINUTE)
+
+# A batch plan job. Results are kept per input position; events are the NDJSON
+# records in the order things happened, so a stream can be replayed from the
+# start by anyone who fetches the job later.
+class BatchJob:
+    def __init__(self, job_id, total, unique):
+        self.id = job_id
+        self.total = total
+        self.unique = unique
+        self.state = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.results = [None] * total
+        self.completed = 0
+        self.failed = 0
+        self.events = []
+        self._cond = threading.Condition()
+        with self._cond:
+            self._emit({"type": "job", **self.summary()})
+
+    def summary(self):
+        # Caller holds the condition's lock, or the job isn't shared yet
+        return {
+            "jobId": self.id,
+            "state": self.state,
+            "total": self.total,
+            "unique": self.unique,
+            "completed": self.completed,
+            "failed": self.failed,
+            "pending": self.total - self.completed - self.failed,
+            "elapsedSeconds": round((self.finished_at or time.time()) - self.created_at, 2)
+        }
+
+    def _emit(self, event):
+        self.events.append(event)
+        self._cond.notify_all()
+
+    def start(self):
+        with self._cond:
+            self.state = "running"
+
+    def add_result(self, index, result):
+        with self._cond:
+            self.results[index] = result
+            if result["success"]:
+                self.completed += 1
+            else:
+                self.failed += 1
+            summary = self.summary()
+            self._emit({"type": "result", **result, "progress": {
+                key: summary[key] for key in ("completed", "failed", "pending", "total")
+            }})
+
+    def finish(self, error=None):
+        with self._cond:
+            self.state = "failed" if error else "done"
+            self.error = error
+            self.finished_at = time.time()
+            self._emit({"type": "done", **self.summary(), **({"error": error} if error else {})})
+
+    def is_finished(self):
+        return self.finished_at is not None
+
+    def snapshot(self):
+        with self._cond:
+            snapshot = self.summary()
+            snapshot["results"] = [result for result in self.results if result is not None]
+            if self.error:
+                snapshot["error"] = self.error
+            return snapshot
+
+    def iter_events(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.events) and not self.is_finished():
+                    self._cond.wait()
+                events = self.events[position:]
+                finished = self.is_finished()
+            position += len(events)
+            yield from events
+            if finished and position >= len(self.events):
+                return
+
+# Batch jobs live in memory, newest last. Finished jobs are dropped after
+# BATCH_JOB_TTL, and the oldest finished ones once there are BATCH_MAX_JOBS.
+# In multi-process mode a job only exists in the worker that accepted it, so
+# clients there should read the results from the NDJSON stream.
+class BatchJobStore:
+    def __init__(self, max_jobs, ttl):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+
+    def create(self, total, unique):
+        job = BatchJob(uuid.uuid4().hex, total, unique)
+        with self._lock:
+            now = time.time()
+            for job_id, old in list(self._jobs.items()):
+                expired = old.is_finished() and now - old.finished_at > self.ttl
+                if expired or (len(self._jobs) >= self.max_jobs and old.is_finished()):
+                    del self._jobs[job_id]
+                    self.evictions += 1
+            self._jobs[job.id] = job
+            self.created += 1
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": len(jobs),
+            "running": sum(1 for job in jobs if not job.is_finished()),
+            "created": self.created,
+            "evictions": self.evictions
+        }
+
+batch_jobs = BatchJobStore(BATCH_MAX_JOBS, BATCH_JOB_TTL)
+
+# Identical profiles (e.g. family members entered twice) share one prompt and
+# one model call; every input position still gets its own result and session
+def group_profiles(profiles):
+    groups = OrderedDict()
+    for index, user_data in enumerate(profiles):
+        groups.setdefault(json.dumps(user_data, sort_keys=True), []).append(index)
+    return list(groups.values())
+
+async def arun_batch_job(job, profiles, groups, vector_store):
+    job.start()
+    unique_profiles = [profiles[indices[0]] for indices in groups]
+    loop = asyncio.get_running_loop()
+    try:
+        with span("batch_retrieval"):
+            message_lists = await loop.run_in_executor(
+                retrieval_executor, build_plan_messages_batch, unique_profiles, vector_store
+            )
+    except Exception as e:
+        print(f"Batch job {job.id} failed during retrieval: {e}")
+        for index in range(job.total):
+            job.add_result(index, {"index": index, "success": False, "error": f"Retrieval failed: {e}"})
+        job.finish(error=str(e))
+        return
+    
+    async def generate(user_data, messages, indices):
+        error = None
+        if isinstance(messages, Exception):
+            error = str(messages)
+        else:
+            try:
+                answered_locally.set(False)
+                async with plan_call_limiter.slot():
+                    lifestyle_plan = await acall_github_model(
+                        messages=messages, model_name=PLAN_MODEL, temperature=0.7, max_tokens=PLAN_MAX_TOKENS
+                    )
+                if lifestyle_plan == MODEL_ERROR_RESPONSE:
+                    error = "The plan model is unavailable"
+                elif answered_locally.get():
+                    # A canned offline plan is not a personalised one
+                    error = "The plan model is unavailable (offline fallback plan)"
+                else:
+                    # One trip to a worker thread for the whole group; every
+                    # input position still gets its own session
+                    session_ids = await in_thread(
+                        lambda: [session_store.create(user_data, lifestyle_plan) for _ in indices],
+                        executor=light_executor
+                    )
+            except Exception as e:
+                error = str(e)
+        for position, index in enumerate(indices):
+            result = {"index": index, "success": error is None}
+            if index != indices[0]:
+                result["duplicateOf"] = indices[0]
+            if error is None:
+                result["lifestylePlan"] = lifestyle_plan
+                result["sessionId"] = session_ids[position]
+            else:
+                result["error"] = error
+            job.add_result(index, result)
+    
+    await asyncio.gather(*(
+        generate(user_data, messages, indices)
+        for user_data, messages, indices in zip(unique_profiles, message_lists, groups)
+    ))
+    job.finish()
+    print(f"Batch job {job.id}: {job.completed} plans, {job.failed} failed, "
+          f"{job.total - job.unique} duplicates, {job.summary()['elapsedSeconds']}s")
+
+def start_batch_job(profiles, vector_store):
+    groups = group_profiles(profiles)
+    job = batch_jobs.create(len(profiles), len(groups))
+    asyncio.run_coroutine_threadsafe(arun_batch_job(job, profiles, groups, vector_store), get_async_loop())
+    return job
+
+# Per-user profiles in SQLite (WAL mode, so reads don't block on the writer).
+# Saves go into the read-through cache straight away and are written to disk by
+# a single background thread, a batch per transaction.
+class ProfileStore:
+    def __init__(self, path, cache_size=1000, write_batch=256):
+        self.path = path
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.write_batch = write_batch
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.write_batches = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _start(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            conn = self._connect()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS profiles "
+                "(user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.commit()
+            conn.close()
+            self._writer = threading.Thread(target=self._write_loop, name="profile-writer", daemon=True)
+            self._writer.start()
+
+    def _reader(self):
+        # One read connection per thread; SQLite connections aren't shared
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.write_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO profiles (user_id, data, updated_at) VALUES (?, ?, ?)", batch
+                    )
+                self.writes += len(batch)
+                self.write_batches += 1
+            except sqlite3.Error as e:
+                print(f"Error saving {len(batch)} profiles: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _cache_set(self, user_id, user_data):
+        # Caller holds the lock
+        self.cache[user_id] = user_data
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def save(self, user_id, user_data):
+        self._start()
+        with self._lock:
+            self._cache_set(user_id, user_data)
+        self._queue.put((user_id, json.dumps(user_data, separators=(',', ':')), time.time()))
+
+    def get(self, user_id):
+        self._start()
+        with self._lock:
+            if user_id in self.cache:
+                self.cache.move_to_end(user_id)
+                self.hits += 1
+                return self.cache[user_id]
+            self.misses += 1
+        row = self._reader().execute("SELECT data FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        user_data = json.loads(row[0])
+        with self._lock:
+            # A save may have raced with the read; keep the newer cached copy
+            if user_id not in self.cache:
+                self._cache_set(user_id, user_data)
+            return self.cache[user_id]
+
+    def flush(self):
+        self._queue.join()
+
+    # (user_id, profile JSON, updated_at) rows after after_id, in id order.
+    # Pages rather than a generator so query workers can page through the
+    # sidecar's store as well.
+    def export_page(self, after_id="", page_size=1000):
+        self._start()
+        self.flush()
+        return self._reader().execute(
+            "SELECT user_id, data, updated_at FROM profiles WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_id, page_size)
+        ).fetchall()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "pending_writes": self._queue.qsize(),
+                "writes": self.writes,
+                "write_batches": self.write_batches
+            }
+
+profile_store = ProfileStore(PROFILE_DB, PROFILE_CACHE_SIZE, PROFILE_WRITE_BATCH)
+
+# Profile ids are always generated by the server. Each comes with a user token,
+# an HMAC of the id, that the client sends back to update or read its profile,
+# so nobody can overwrite or read a profile by guessing or reusing an id.
+_profile_token_key = PROFILE_TOKEN_SECRET.encode("utf-8") if PROFILE_TOKEN_SECRET else os.urandom(32)
+
+def profile_user_token(user_id):
+    return hmac.new(_profile_token_key, user_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def valid_user_token(user_id, token):
+    if not isinstance(user_id, str) or not isinstance(token, str):
+        return False
+    return hmac.compare_digest(profile_user_token(user_id), token)
+
+def valid_api_token(token):
+    return bool(PROFILE_API_TOKEN) and isinstance(token, str) and hmac.compare_digest(PROFILE_API_TOKEN, token)
+
+# Server-side chat sessions, so follow-up questions only need to send the
+# session id. Each session keeps the pruned profile cut down to its token
+# budget, the whole plan (each question gets the plan sections relevant to
+# it, see select_plan_sections), the last few turns, and a rolling summary of
+# older ones.
+class SessionStore:
+    def __init__(self, maxsize, ttl, db_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db_path = db_path
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self):
+        # Caller holds the lock. Opened on first use in each process, like
+        # SQLiteCache; None when sessions are only kept in memory.
+        if self.db_path and self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _store(self, session_id, session):
+        # Caller holds the lock
+        self._data[session_id] = session
+        self._data.move_to_end(session_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        conn = self._db()
+        if conn is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(session), session["updated_at"])
+            )
+            conn.commit()
+
+    def create(self, user_data, lifestyle_plan=""):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        session = {
+            "profile": truncate_to_tokens(compact_profile(prune_profile(user_data)), SESSION_PROFILE_TOKENS),
+            "plan": lifestyle_plan,
+            "summary": [],
+            "recent": [],
+            "created_at": now,
+            "updated_at": now
+        }
+        with self._lock:
+            self._store(session_id, session)
+        return session_id
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self._data.get(session_id)
+            if session is None and self._db() is not None:
+                row = self._db().execute(
+                    "SELECT data FROM sessions WHERE id = ? AND updated_at > ?", (session_id, now - self.ttl)
+                ).fetchone()
+                if row:
+                    session = json.loads(row[0])
+                    self._store(session_id, session)
+            if session is None or now - session["updated_at"] > self.ttl:
+                self._data.pop(session_id, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(session_id)
+            self.hits += 1
+            return session
+
+    def set_plan(self, session_id, lifestyle_plan):
+        with self._lock:
+            session = self._data.get(session_id)
+            if session is not None:
+                session["plan"] = lifestyle_plan
+                session["updated_at"] = time.time()
+                self._store(session_id, session)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._data.pop(session_id, None)
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                conn.commit()
+
+    def add_turn(self, session_id, question, answer):
+        with self._lock:
+            session = self._data.get(session_id)
+            if session is None:
+                return
+            session["recent"].append([question, answer])
+            # Fold the oldest turns into one-line summaries once the recent
+            # turns outgrow their budget, then drop the oldest summary lines
+            while len(session["recent"]) > 1 and estimate_tokens(
+                    "".join(q + a for q, a in session["recent"])) > SESSION_RECENT_TOKENS:
+                old_question, old_answer = session["recent"].pop(0)
+                first_sentence = old_answer.strip().split("\n")[0].split(". ")[0]
+                session["summary"].append(
+                    f"Q: {truncate_to_tokens(old_question, 40)} A: {truncate_to_tokens(first_sentence, 60)}"
+                )
+            while session["summary"] and estimate_tokens("\n".join(session["summary"])) > SESSION_SUMMARY_TOKENS:
+                session["summary"].pop(0)
+            session["updated_at"] = time.time()
+            self._store(session_id, session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "persistent": bool(self.db_path)
+            }
+
+session_store = SessionStore(SESSION_CACHE_SIZE, SESSION_TTL, db_path=SESSION_DB)
+
+# Markdown headings, bold lines and numbered bold items start a plan section
+PLAN_HEADING = re.compile(r"^\s*(#{1,6}\s|\*\*[^*]+\*\*:?\s*$|\d+\.\s+\*\*)")
+
+def split_plan_sections(plan):
+    sections = []
+    for line in plan.split("\n"):
+        if not PLAN_HEADING.match(line):
+            if sections:
+                sections[-1][1].append(line)
+            else:
+                sections.append(["", [line]])
+        elif sections and not "".join(sections[-1][1]).strip():
+            # A heading straight after another one, e.g. under the title
+            sections[-1][0] = f"{sections[-1][0]}\n{line}".strip()
+        else:
+            sections.append([line, []])
+    return [(heading, "\n".join(body).strip()) for heading, body in sections]
+
+def summarize_plan_section(heading, body):
+    first_sentence = body.split("\n")[0].split(". ")[0]
+    return truncate_to_tokens(f"{heading.strip()}\n{first_sentence}".strip(), 60)
+
+# The plan sections for one question within the token budget. Sections sharing
+# the most words with the question (heading words count double) are kept
+# whole; the rest are cut to their heading and first sentence, so the model
+# still sees the whole outline. Sections stay in plan order.
+def select_plan_sections(plan, question, budget):
+    if estimate_tokens(plan) <= budget:
+        return plan
+    sections = split_plan_sections(plan)
+    full = [f"{heading}\n{body}".strip() for heading, body in sections]
+    chosen = [summarize_plan_section(heading, body) for heading, body in sections]
+    words = set(tokenize(question))
+    
+    def score(i):
+        heading, body = sections[i]
+        return 2 * len(words & set(tokenize(heading))) + len(words & set(tokenize(body)))
+    
+    remaining = budget - estimate_tokens("\n\n".join(chosen))
+    for i in sorted(range(len(sections)), key=lambda i: (-score(i), i)):
+        extra = estimate_tokens(full[i]) - estimate_tokens(chosen[i])
+        if extra <= remaining:
+            chosen[i] = full[i]
+            remaining -= extra
+    return truncate_to_tokens("\n\n".join(chosen), budget)
+
+def build_question_messages(session, user_question):
+    sections = [
+        f"User Profile: {session['profile']}",
+        f"Lifestyle Plan: {select_plan_sections(session['plan'], user_question, SESSION_PLAN_TOKENS)}"
+    ]
+    if session["summary"]:
+        sections.append("Earlier in this conversation:\n" + "\n".join(session["summary"]))
+    if session["recent"]:
+        sections.append("Recent questions and answers:\n" + "\n\n".join(
+            f"Q: {question}\nA: {answer}" for question, answer in session["recent"]
+        ))
+    sections.append(f"User Question: {user_question}")
+    
+    prompt = "\n\n".join(sections) + "\n\nPlease provide a helpful response to the user's question about their AYUSH lifestyle plan."
+    return [
+        {"role": "system", "content": "You are an AYUSH lifestyle coach assistant. Answer questions about the user's lifestyle plan based on Ayurveda, Yoga, Unani, Siddha, and Homeopathy principles."},
+        {"role": "user", "content": prompt}
+    ]
+
+def embed_question(question):
+    key = normalize_query(question)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = get_embedding_service().encode([question])[0]
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
+# Answers to earlier questions, indexed by question embedding. Entries are
+# scoped to a hash of the profile and plan the model saw, so an answer is only
+# reused for the same person and plan. Each scope holds a small normalized
+# matrix searched by brute force (exact, and fast at SEMANTIC_CACHE_PER_SCOPE
+# rows). Scopes are kept in LRU order and the least recently used ones go first
+# once there are SEMANTIC_CACHE_SIZE entries; entries expire after the TTL.
+class SemanticAnswerCache:
+    def __init__(self, maxsize, per_scope, ttl, threshold):
+        self.maxsize = maxsize
+        self.per_scope = per_scope
+        self.ttl = ttl
+        self.threshold = threshold
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+        self.lookup_seconds = 0.0
+
+    @staticmethod
+    def scope_key(session):
+        return hashlib.sha256(f"{session['profile']}\0{session['plan']}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cacheable(question):
+        return len(question.split()) >= SEMANTIC_CACHE_MIN_WORDS
+
+    # Returns (cached answer or None, question embedding for add())
+    def lookup(self, scope, question):
+        import numpy as np
+        start = time.time()
+        vector = np.asarray(embed_question(question), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        answer = None
+        with self._lock:
+            self.lookups += 1
+            entries = self._scopes.get(scope)
+            if entries:
+                self._scopes.move_to_end(scope)
+                self._expire(scope, entries)
+            if entries:
+                similarities = np.stack([entry["vector"] for entry in entries]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = entries[best]
+                    entry["used_at"] = time.time()
+                    entry["hits"] += 1
+                    self.hits += 1
+                    self.seconds_saved += entry["seconds"]
+                    answer = entry["answer"]
+            self.lookup_seconds += time.time() - start
+        return answer, vector
+
+    def add(self, scope, question, vector, answer, seconds):
+        now = time.time()
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            self._scopes.move_to_end(scope)
+            entries.append({
+                "question": question,
+                "vector": vector,
+                "answer": answer,
+                "seconds": seconds,
+                "hits": 0,
+                "created_at": now,
+                "used_at": now
+            })
+            self.size += 1
+            if len(entries) > self.per_scope:
+                entries.remove(min(entries, key=lambda entry: entry["used_at"]))
+                self.size -= 1
+                self.evictions += 1
+            while self.size > self.maxsize:
+                _, evicted = self._scopes.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += len(evicted)
+
+    def _expire(self, scope, entries):
+        # Caller holds the lock
+        cutoff = time.time() - self.ttl
+        live = [entry for entry in entries if entry["created_at"] > cutoff]
+        if len(live) != len(entries):
+            self.size -= len(entries) - len(live)
+            self.evictions += len(entries) - len(live)
+            entries[:] = live
+            if not live:
+                del self._scopes[scope]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SEMANTIC_CACHE,
+                "threshold": self.threshold,
+                "entries": self.size,
+                "scopes": len(self._scopes),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "seconds_saved": round(self.seconds_saved, 2),
+                "avg_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 2) if self.lookups else 0.0
+            }
+
+semantic_cache = SemanticAnswerCache(
+    SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_PER_SCOPE, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD
+)
+
+# Passes tokens through and hands the full text to on_complete (blocking, so
+# it runs in a thread) at the end
+async def acollect_stream(tokens, on_complete):
+    parts = []
+    async with contextlib.aclosing(tokens):
+        async for token in tokens:
+            parts.append(token)
+            yield token
+    await in_thread(on_complete, "".join(parts))
+
+# The vector store is built by a background ingestion worker. Requests keep
+# using the current store until a new ingestion run finishes and swaps it in.
 vector_store = None
+retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+hybrid_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="keyword-search")
+# Short in-memory work from the ASGI routes (health, sessions, profile saves),
+# kept off the loop's default executor so it never queues behind embeddings
+light_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="light")
+_ingestion_worker = None
+_ingestion_worker_lock = threading.Lock()
+
+def knowledge_base_signature():
+    try:
+        pdf_files = [f for f in os.listdir(PDF_DIR) if f.endswith('.pdf')]
+    except FileNotFoundError:
+        return ()
+    signature = []
+    for pdf in sorted(pdf_files):
+        stat = os.stat(os.path.join(PDF_DIR, pdf))
+        signature.append((pdf, stat.st_size, stat.st_mtime))
+    return tuple(signature)
+
+def run_ingestion():
+    global vector_store, vector_store_generation
+    ingest_status.update(state="running", started_at=time.time(), finished_at=None, last_error=None)
+    ingest_status.increment("runs")
+    try:
+        new_store = create_vector_db()
+    except Exception as e:
+        print(f"Ingestion failed: {e}")
+        ingest_status.update(state="failed", finished_at=time.time(), last_error=str(e))
+        return False
+    # Plain assignment, so requests see either the old or the new store. None
+    # means the knowledge base was emptied, so the old store stops serving too.
+    vector_store = new_store
+    vector_store_generation += 1
+    retrieval_cache.clear()
+    ingest_status.update(state="ready" if new_store is not None else "empty", finished_at=time.time())
+    return True
+
+def ingestion_worker():
+    # Poll the knowledge base and re-ingest whenever a PDF is added, changed or removed
+    last_signature = None
+    while True:
+        signature = knowledge_base_signature()
+        if signature != last_signature:
+            if run_ingestion():
+                last_signature = signature
+        time.sleep(INGEST_POLL_INTERVAL)
+
+class WarmUpStatus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "idle"
+        self.steps = {}
+        self.errors = {}
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def record(self, step, seconds, error=None):
+        with self._lock:
+            self.steps[step] = round(seconds, 3)
+            if error is not None:
+                self.errors[step] = error
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "steps": dict(self.steps), "errors": dict(self.errors)}
+
+warm_up_status = WarmUpStatus()
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+async def _warm_async_client():
+    get_async_github_client()
+
+# Load everything the first requests would otherwise wait on. Steps are timed
+# and a failing step is recorded without stopping the rest.
+def warm_up():
+    steps = [
+        ("imports", import_dependencies),
+        ("model_clients", lambda: run_async(_warm_async_client()))
+    ]
+    # Query workers leave embeddings to the retrieval sidecar
+    if SERVING_ROLE != "worker":
+        steps.append(("embedding_model", lambda: get_embedding_service().encode(["warm up"])))
+    warm_up_status.update(state="running")
+    for name, step in steps:
+        start = time.time()
+        try:
+            step()
+            warm_up_status.record(name, time.time() - start)
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            warm_up_status.record(name, time.time() - start, error=str(e))
+    snapshot = warm_up_status.snapshot()
+    warm_up_status.update(state="failed" if snapshot["errors"] else "done")
+    print(f"Warm-up finished: {snapshot['steps']}")
+
+def start_warm_up():
+    global _warm_up_thread
+    if _warm_up_thread is None:
+        with _warm_up_lock:
+            if _warm_up_thread is None:
+                _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+                _warm_up_thread.start()
+
+def is_ready():
+    if warm_up_status.snapshot()["state"] != "done":
+        return False
+    if SERVING_ROLE == "worker":
+        return bool(sidecar_status.get("ready"))
+    return vector_store is not None
+
+def start_ingestion_worker():
+    global _ingestion_worker
+    if _ingestion_worker is None:
+        with _ingestion_worker_lock:
+            if _ingestion_worker is None:
+                # Query workers never ingest; they follow the sidecar's store instead
+                target = sidecar_status_worker if SERVING_ROLE == "worker" else ingestion_worker
+                _ingestion_worker = threading.Thread(target=target, name="ingestion", daemon=True)
+                _ingestion_worker.start()
+
+# Multi-process serving. One retrieval sidecar process owns the Chroma client,
+# the keyword index, the embedding model and the ingestion worker (the only
+# writer). Pre-forked query workers serve HTTP and send their searches to the
+# sidecar over a Unix socket, so the model and index are loaded once per host.
+class RetrievalClient:
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._pool = queue.LifoQueue()
+
+    def call(self, method, *args):
+        from multiprocessing.connection import Client
+        for attempt in range(2):
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                conn = None
+            try:
+                if conn is None:
+                    conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+                conn.send((method, args))
+                status, result = conn.recv()
+            except (OSError, EOFError):
+                # The sidecar restarted or dropped the connection; retry once on a new one
+                if conn is not None:
+                    conn.close()
+                if attempt:
+                    raise
+                continue
+            self._pool.put(conn)
+            if status == "error":
+                raise RuntimeError(f"Retrieval sidecar error: {result}")
+            return result
+
+# Read-only stand-in for ChromaWrapper in query workers. Results are cached
+# locally too, and the cache is cleared whenever the sidecar swaps stores.
+class RemoteVectorStore(ChromaWrapper):
+    def __init__(self, client):
+        self.client = client
+        self.keyword_index = None
+
+    def add_documents(self, documents):
+        raise NotImplementedError("Query workers are read-only; add PDFs to the knowledge base instead")
+
+    add_texts = add_documents
+
+    def search(self, query, k):
+        key = (normalize_query(query), k)
+        cached = retrieval_cache.get(key)
+        if cached is None:
+            cached = self.client.call("search", query, k)
+            retrieval_cache.set(key, cached)
+        return cached
+
+    def multi_search(self, queries, k, k_per_query):
+        key = (tuple(normalize_query(query) for query in queries), k, k_per_query)
+        cached = retrieval_cache.get(key)
+        if cached is None:
+            cached = self.client.call("multi_search", list(queries), k, k_per_query)
+            retrieval_cache.set(key, cached)
+        return cached
+
+    def batch_multi_search(self, query_groups, k, k_per_query):
+        keys = [(tuple(normalize_query(query) for query in queries), k, k_per_query) for queries in query_groups]
+        results = [retrieval_cache.get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            fetched = self.client.call("batch_multi_search", [list(query_groups[i]) for i in missing], k, k_per_query)
+            for i, cached in zip(missing, fetched):
+                results[i] = cached
+                retrieval_cache.set(keys[i], cached)
+        return results
+
+# Stand-in for a store owned by the sidecar (see SHARED_STORE_METHODS)
+class RemoteStore:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
 
-@app.before_first_request
-def initialize():
-    global vector_store
-    vector_store = create_vector_db()
+    def __getattr__(self, method):
+        if method not in SHARED_STORE_METHODS[self.name]:
+            raise AttributeError(method)
+        return functools.partial(self.client.call, f"{self.name}.{method}")
+
+SERVING_ROLE = "standalone"  # or "sidecar" / "worker" in multi-process mode
+vector_store_generation = 0
+retrieval_client = None
+sidecar_status = {}
+
+def retrieval_status():
+    return {
+        "ready": is_ready(),
+        "vector_store": vector_store is not None,
+        "generation": vector_store_generation,
+        "ingest": ingest_status.snapshot(),
+        "warm_up": warm_up_status.snapshot(),
+        "embeddings": get_embedding_service().stats(),
+        "retrieval_latency": retrieval_latency.stats(),
+        "pid": os.getpid()
+    }
+
+# State that must be the same for every query worker lives in the sidecar:
+# a follow-up question can land on any worker. Workers call these methods as
+# "<store>.<method>" through RemoteStore.
+SHARED_STORE_METHODS = {
+    "sessions": ("create", "get", "set_plan", "delete", "add_turn", "stats"),
+    "profiles": ("save", "get", "export_page", "stats"),
+    "semantic_cache": ("lookup", "add", "stats")
+}
+
+def call_shared_store(method, args):
+    store_name, name = method.split(".", 1)
+    if name not in SHARED_STORE_METHODS.get(store_name, ()):
+        raise ValueError(f"unknown method {method}")
+    store = {"sessions": session_store, "profiles": profile_store, "semantic_cache": semantic_cache}[store_name]
+    return getattr(store, name)(*args)
+
+def handle_retrieval_connection(conn):
+    handlers = {
+        "search": lambda query, k: vector_store.search(query, k),
+        "multi_search": lambda queries, k, k_per_query: vector_store.multi_search(queries, k, k_per_query),
+        "batch_multi_search": lambda groups, k, k_per_query: vector_store.batch_multi_search(groups, k, k_per_query),
+        "status": retrieval_status
+    }
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (OSError, EOFError):
+                return
+            try:
+                if "." in method:
+                    conn.send(("ok", call_shared_store(method, args)))
+                    continue
+                if method != "status" and vector_store is None:
+                    raise RuntimeError("vector store is not ready")
+                conn.send(("ok", handlers[method](*args)))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+def run_retrieval_sidecar(address, authkey):
+    global SERVING_ROLE
+    from multiprocessing.connection import Listener
+    SERVING_ROLE = "sidecar"
+    start_warm_up()
+    start_ingestion_worker()
+    if os.path.exists(address):
+        os.unlink(address)
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        print(f"Retrieval sidecar (pid {os.getpid()}) listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError) as e:
+                print(f"Retrieval sidecar rejected a connection: {e}")
+                continue
+            threading.Thread(target=handle_retrieval_connection, args=(conn,), daemon=True).start()
+
+# Query workers poll the sidecar: its status drives readiness, generate-plan's
+# "still loading" answer and the local retrieval cache
+def sidecar_status_worker():
+    global vector_store, sidecar_status
+    generation = None
+    while True:
+        try:
+            status = retrieval_client.call("status")
+        except (OSError, EOFError, RuntimeError) as e:
+            status = {"ready": False, "vector_store": False, "error": str(e)}
+        if status.get("generation") != generation:
+            generation = status.get("generation")
+            retrieval_cache.clear()
+        vector_store = RemoteVectorStore(retrieval_client) if status["vector_store"] else None
+        if "ingest" in status:
+            ingest_status.update(**status["ingest"])
+        sidecar_status = status
+        time.sleep(RETRIEVAL_STATUS_INTERVAL)
+
+@app.before_request
+def ensure_ingestion_worker():
+    # WSGI servers import the app without running __main__, so start it here too
+    start_warm_up()
+    start_ingestion_worker()
+
+@app.before_request
+def start_request_trace():
+    trace = Trace(request.method, request.path)
+    request.environ["ayush.trace"] = trace
+    current_trace.set(trace)
+    if PROFILE_SLOW_REQUESTS:
+        sampling_profiler.start_request(trace)
+
+# Streamed bodies are still being sent after the view returns, so requests
+# are timed when the response is closed
+def finish_trace(trace, route, method, status):
+    duration = time.time() - trace.start
+    request_duration.observe(duration, route, method, status)
+    sampling_profiler.finish_request(trace)
+    current_trace.set(None)
+    if duration >= SLOW_REQUEST_SECONDS:
+        for hook in slow_request_hooks:
+            try:
+                hook(trace, duration)
+            except Exception as e:
+                print(f"Slow request hook {hook.__name__} failed: {e}")
+
+@app.after_request
+def finish_request_trace(response):
+    trace = request.environ.get("ayush.trace")
+    if trace is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    response.call_on_close(functools.partial(finish_trace, trace, route, request.method, response.status_code))
+    return response
+
+# Per-route concurrency limits. A request waits at most ROUTE_QUEUE_TIMEOUT
+# for a slot and is otherwise rejected with 429, so slow plan generations
+# can't starve quick routes like /api/health.
+class RouteLimiter:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        return self._admit(self._semaphore.acquire(timeout=ROUTE_QUEUE_TIMEOUT))
+
+    # Same limit for the ASGI routes. Polls for a slot instead of blocking, so
+    # the event loop keeps serving other requests while this one waits.
+    async def acquire_async(self):
+        deadline = time.monotonic() + ROUTE_QUEUE_TIMEOUT
+        acquired = self._semaphore.acquire(blocking=False)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+            acquired = self._semaphore.acquire(blocking=False)
+        return self._admit(acquired)
+
+    def _admit(self, acquired):
+        with self._lock:
+            if acquired:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
+
+route_limiters = {name: RouteLimiter(name, limit) for name, limit in ROUTE_CONCURRENCY.items()}
+
+BUSY_RESPONSE = {
+    "success": False,
+    "error": "The server is busy. Please try again shortly."
+}
+
+def limit_concurrency(name):
+    limiter = route_limiters[name]
+    
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not limiter.acquire():
+                response = jsonify(BUSY_RESPONSE)
+                response.status_code = 429
+                response.headers["Retry-After"] = "1"
+                return response
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                limiter.release()
+                raise
+            # Streamed responses keep their slot until the stream is finished
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(limiter.release)
+            else:
+                limiter.release()
+            return response
+        return wrapper
+    return decorator
+
+# The /api/* handlers below are written once, as coroutines that take the
+# request's JSON and return either (body, status) or a TokenStream to send
+# as server-sent events. Flask runs them on the model loop with run_async;
+# the ASGI app (SERVE_ASGI=1) awaits them directly, so a slow completion
+# holds no thread. Anything blocking inside them goes through in_thread.
+class TokenStream:
+    def __init__(self, tokens, done=None):
+        self.tokens = tokens
+        self.done = done
+
+def json_response(body, status=200):
+    response = jsonify(body)
+    response.status_code = status
+    return response
+
+def flask_response(result):
+    if isinstance(result, TokenStream):
+        return sse_response(iterate_on_model_loop(result.tokens), done=result.done)
+    return json_response(*result)
+
+def health_payload():
+    return {
+        "status": "healthy",
+        "ready": is_ready(),
+        "warm_up": warm_up_status.snapshot(),
+        "vector_store": vector_store is not None,
+        "routes": {name: limiter.stats() for name, limiter in route_limiters.items()},
+        "embeddings": get_embedding_service().stats(),
+        "cache": {
+            "query_embeddings": query_embedding_cache.stats(),
+            "retrieval": retrieval_cache.stats(),
+            "completions": completion_cache.stats()
+        },
+        "retrieval_latency": retrieval_latency.stats(),
+        "plan_context": context_stats.stats(),
+        "sessions": session_store.stats(),
+        "profiles": profile_store.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "models": model_client.stats(),
+        "batch": dict(batch_jobs.stats(), plan_calls=plan_call_limiter.stats()),
+        "serving": {
+            "role": SERVING_ROLE,
+            "server": "asgi" if SERVE_ASGI else "wsgi",
+            "pid": os.getpid(),
+            "sidecar": sidecar_status or None
+        }
+    }
 
 # API Routes
 @app.route('/api/health', methods=['GET'])
+@limit_concurrency("health")
 def health_check():
-    return jsonify({"status": "healthy", "vector_store": vector_store is not None})
+    return jsonify(health_payload())
 
-@app.route('/api/collect-info', methods=['POST'])
-def collect_info():
-    data = request.json
+# Liveness: the process is up and serving. Never touches heavy dependencies.
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    return jsonify({"status": "alive"})
+
+# Readiness: warmed up and the vector store is loaded, so load balancers
+# only route traffic to workers that can answer without cold-start delays
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    ready = is_ready()
+    response = jsonify({
+        "ready": ready,
+        "warm_up": warm_up_status.snapshot(),
+        "vector_store": vector_store is not None,
+        "ingest": ingest_status.snapshot()
+    })
+    response.status_code = 200 if ready else 503
+    return response
+
+def metric_lines(name, metric_type, help_text, samples, label_names=()):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(label_names, labels)} {value}")
+    return lines
+
+# Counters and gauges taken from the components' own stats at scrape time
+def collect_component_metrics():
+    caches = {
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "completions": completion_cache.stats(),
+        "sessions": session_store.stats(),
+        "profiles": profile_store.stats(),
+        "semantic_answers": semantic_cache.stats()
+    }
+    models = model_client.stats()
+    embeddings = get_embedding_service().stats()
+    context = context_stats.stats()
+    routes = {name: limiter.stats() for name, limiter in route_limiters.items()}
+    breaker_states = {"closed": 0, "half_open": 1, "open": 2}
+    
+    lines = []
+    lines += metric_lines("ayush_cache_hits_total", "counter", "Cache hits",
+                          [((name,), stats["hits"]) for name, stats in caches.items()], ("cache",))
+    lines += metric_lines("ayush_cache_misses_total", "counter", "Cache misses",
+                          [((name,), stats["misses"]) for name, stats in caches.items()], ("cache",))
+    lines += metric_lines("ayush_cache_hit_ratio", "gauge", "Cache hits / lookups",
+                          [((name,), round(stats["hits"] / ((stats["hits"] + stats["misses"]) or 1), 4))
+                           for name, stats in caches.items()], ("cache",))
+    lines += metric_lines("ayush_completions_coalesced_total", "counter", "Completions served by an identical in-flight call",
+                          [((), caches["completions"]["coalesced"])])
+    lines += metric_lines("ayush_model_calls_total", "counter", "Upstream model call attempts", [((), models["calls"])])
+    lines += metric_lines("ayush_model_retries_total", "counter", "Upstream model retries", [((), models["retries"])])
+    lines += metric_lines("ayush_model_timeouts_total", "counter", "Upstream model timeouts", [((), models["timeouts"])])
+    lines += metric_lines("ayush_model_throttled_total", "counter", "Upstream 429 responses", [((), models["throttled"])])
+    lines += metric_lines("ayush_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                          [((name,), breaker_states[stats["state"]]) for name, stats in models["breakers"].items()], ("model",))
+    lines += metric_lines("ayush_route_in_flight", "gauge", "Requests in flight per route",
+                          [((name,), stats["in_flight"]) for name, stats in routes.items()], ("route",))
+    lines += metric_lines("ayush_route_rejected_total", "counter", "Requests rejected with 429 per route",
+                          [((name,), stats["rejected"]) for name, stats in routes.items()], ("route",))
+    lines += metric_lines("ayush_embeddings_total", "counter", "Texts embedded", [((), embeddings["embeddings"])])
+    lines += metric_lines("ayush_embedding_batches_total", "counter", "Embedding batches", [((), embeddings["batches"])])
+    lines += metric_lines("ayush_plan_context_tokens_total", "counter", "Estimated plan context tokens before and after budgeting",
+                          [(("before",), context["tokens_before"]), (("after",), context["tokens_after"])], ("kind",))
+    lines += metric_lines("ayush_semantic_cache_entries", "gauge", "Answers held by the semantic cache",
+                          [((), caches["semantic_answers"]["entries"])])
+    lines += metric_lines("ayush_semantic_cache_evictions_total", "counter", "Semantic cache entries evicted or expired",
+                          [((), caches["semantic_answers"]["evictions"])])
+    lines += metric_lines("ayush_semantic_cache_saved_seconds_total", "counter",
+                          "Model latency avoided by semantic cache hits",
+                          [((), caches["semantic_answers"]["seconds_saved"])])
+    lines += metric_lines("ayush_batch_jobs_running", "gauge", "Batch plan jobs still running",
+                          [((), batch_jobs.stats()["running"])])
+    lines += metric_lines("ayush_batch_plan_calls_in_flight", "gauge", "Plan model calls in flight for batch jobs",
+                          [((), plan_call_limiter.in_flight)])
+    lines += metric_lines("ayush_ready", "gauge", "1 when warmed up and the vector store is loaded", [((), int(is_ready()))])
+    return lines
+
+# Prometheus text format
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    lines = []
+    for metric in (request_duration, stage_duration, model_call_duration, model_first_token, model_tokens, fallback_count):
+        lines += metric.render()
+    lines += collect_component_metrics()
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+# Span breakdowns (and stack samples when profiling is on) of recent slow requests
+@app.route('/api/debug/slow-requests', methods=['GET'])
+def slow_requests():
+    return jsonify({
+        "threshold_seconds": SLOW_REQUEST_SECONDS,
+        "profiling": PROFILE_SLOW_REQUESTS,
+        "requests": list(recent_slow_requests)
+    })
+
+@app.route('/api/ingest/status', methods=['GET'])
+def ingest_status_check():
+    return jsonify(dict(ingest_status.snapshot(), vector_store=vector_store is not None))
+
+async def acollect_info(data):
     basic_info = data.get('basicInfo', {})
     
     # Generate follow-up questions based on basic info
@@ -381,7 +3556,7 @@ Format your response as a JSON array of questions only."""
 Generate personalized follow-up questions to better understand this individual from an AYUSH perspective."""
     
     # Get personalized questions
-    follow_up_questions_json = call_github_model(
+    follow_up_questions_json = await acall_github_model(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
@@ -398,14 +3573,17 @@ Generate personalized follow-up questions to better understand this individual f
         # Fallback to a simple string response if JSON parsing fails
         follow_up_questions = follow_up_questions_json
     
-    return jsonify({
+    return {
         "success": True,
         "followUpQuestions": follow_up_questions
-    })
+    }, 200
 
-@app.route('/api/submit-responses', methods=['POST'])
-def submit_responses():
-    data = request.json
+@app.route('/api/collect-info', methods=['POST'])
+@limit_concurrency("collect-info")
+def collect_info():
+    return flask_response(run_async(acollect_info(request.json)))
+
+async def asubmit_responses(data):
     responses = data.get('responses', [])
     
     # Process responses to create structured user profile
@@ -415,7 +3593,7 @@ def submit_responses():
     prompt += "Create a detailed JSON structure with relevant fields extracted from these responses, including prakriti assessment, dosha imbalances, and lifestyle factors."
     
     # Use model to analyze responses
-    structured_data_response = call_github_model(
+    structured_data_response = await acall_github_model(
         messages=[
             {"role": "system", "content": "You are an expert AYUSH practitioner who can analyze user information and create structured profiles based on Ayurvedic, Yoga, Unani, Siddha, and Homeopathy principles."},
             {"role": "user", "content": prompt}
@@ -429,95 +3607,271 @@ def submit_responses():
     try:
         # Try to extract JSON if it's embedded in text
         if not structured_data_response.strip().startswith('{'):
-            import re
             json_match = re.search(r'(\{.*\})', structured_data_response, re.DOTALL)
             if json_match:
                 structured_data_response = json_match.group(1)
         
         user_data = json.loads(structured_data_response)
         
-        # Save user data to file
-        with open(USER_DATA_FILE, 'w') as f:
-            json.dump(user_data, f, indent=2)
+        # Save user data in the background. An existing profile is only updated
+        # when the caller proves it owns the id; otherwise it gets a new one.
+        user_id = data.get('userId')
+        if not valid_user_token(user_id, data.get('userToken')):
+            user_id = uuid.uuid4().hex
+        await in_thread(profile_store.save, user_id, user_data, executor=light_executor)
         
-        return jsonify({
+        return {
             "success": True,
-            "userProfile": user_data
-        })
+            "userProfile": user_data,
+            "userId": user_id,
+            "userToken": profile_user_token(user_id)
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             "success": False,
             "error": str(e),
             "rawResponse": structured_data_response
-        })
+        }, 200
 
-@app.route('/api/generate-plan', methods=['POST'])
-def generate_plan():
-    global vector_store
+@app.route('/api/submit-responses', methods=['POST'])
+@limit_concurrency("submit-responses")
+def submit_responses():
+    return flask_response(run_async(asubmit_responses(request.json)))
+
+def request_bearer_token():
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+def unauthorized():
+    response = jsonify({"success": False, "error": "Missing or invalid token"})
+    response.status_code = 401
+    response.headers["WWW-Authenticate"] = "Bearer"
+    return response
+
+# Readable with the profile's own user token or with PROFILE_API_TOKEN
+@app.route('/api/profiles/<user_id>', methods=['GET'])
+def get_profile(user_id):
+    token = request_bearer_token()
+    if not (valid_user_token(user_id, token) or valid_api_token(token)):
+        return unauthorized()
+    user_data = profile_store.get(user_id)
+    if user_data is None:
+        response = jsonify({"success": False, "error": "Profile not found"})
+        response.status_code = 404
+        return response
+    return jsonify({"success": True, "userId": user_id, "userProfile": user_data})
+
+# Bulk export of every saved profile as newline-delimited JSON. Needs
+# PROFILE_API_TOKEN.
+@app.route('/api/profiles/export', methods=['GET'])
+def export_profiles():
+    if not valid_api_token(request_bearer_token()):
+        return unauthorized()
     
-    data = request.json
+    def lines():
+        last_id = ""
+        while True:
+            rows = profile_store.export_page(last_id)
+            if not rows:
+                break
+            for user_id, data, updated_at in rows:
+                yield json.dumps({"userId": user_id, "updatedAt": updated_at, "userProfile": json.loads(data)}) + "\n"
+            last_id = rows[-1][0]
+    
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+def vector_store_unavailable():
+    status = ingest_status.snapshot()
+    if status["state"] in ("idle", "running"):
+        error = "The knowledge base is still loading. Please try again in a moment."
+    else:
+        error = "Could not initialize vector database. Please add PDF files to the knowledge_base directory."
+    return {"success": False, "error": error, "ingest": status}, 503
+
+async def agenerate_plan(data, stream):
     user_data = data.get('userProfile', {})
     
     if not vector_store:
-        vector_store = create_vector_db()
-        if not vector_store:
-            return jsonify({
-                "success": False,
-                "error": "Could not initialize vector database. Please add PDF files to the knowledge_base directory."
-            })
+        return vector_store_unavailable()
     
     try:
+        if stream:
+            messages = await in_thread(build_plan_messages, user_data, vector_store, executor=retrieval_executor)
+            session_id = await in_thread(session_store.create, user_data, executor=light_executor)
+            tokens = astream_github_model(
+                messages, PLAN_MODEL, temperature=0.7, max_tokens=PLAN_MAX_TOKENS, label="generate-plan"
+            )
+            return TokenStream(
+                acollect_stream(tokens, lambda plan: session_store.set_plan(session_id, plan)),
+                done={"sessionId": session_id}
+            )
+        
         # Generate lifestyle plan
-        lifestyle_plan = generate_lifestyle_plan(user_data, vector_store)
+        lifestyle_plan = await agenerate_lifestyle_plan(user_data, vector_store)
+        session_id = await in_thread(session_store.create, user_data, lifestyle_plan, executor=light_executor)
         
-        return jsonify({
+        return {
             "success": True,
-            "lifestylePlan": lifestyle_plan
-        })
+            "lifestylePlan": lifestyle_plan,
+            "sessionId": session_id
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             "success": False,
             "error": str(e)
-        })
+        }, 200
 
-@app.route('/api/ask-question', methods=['POST'])
-def ask_question():
+@app.route('/api/generate-plan', methods=['POST'])
+@limit_concurrency("generate-plan")
+def generate_plan():
     data = request.json
-    user_question = data.get('question', '')
-    user_data = data.get('userProfile', {})
-    lifestyle_plan = data.get('lifestylePlan', '')
-    
-    # Process follow-up questions
-    prompt = f"""
-User Profile: {json.dumps(user_data)}
+    return flask_response(run_async(agenerate_plan(data, wants_stream(data))))
+
+def ndjson_response(events):
+    return Response(
+        stream_with_context(json.dumps(event) + "\n" for event in events),
+        mimetype='application/x-ndjson',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def wants_ndjson(data):
+    stream = data.get('stream')
+    if isinstance(stream, str):
+        # Query string flag, e.g. ?stream=1
+        stream = stream.lower() not in ("", "0", "false")
+    return bool(stream) or request.accept_mimetypes.best == 'application/x-ndjson'
 
-Lifestyle Plan: {lifestyle_plan}
+# Plans for a group of profiles (clinic cohorts, wellness camps). Returns a
+# job id straight away, or with "stream": true the job's NDJSON events: a
+# "job" record, one "result" per profile as it finishes (with progress), and
+# a final "done" summary.
+@app.route('/api/generate-plans/batch', methods=['POST'])
+@limit_concurrency("generate-plans-batch")
+def generate_plans_batch():
+    data = request.json or {}
+    profiles = data.get('profiles')
+    if not isinstance(profiles, list) or not profiles or not all(isinstance(p, dict) for p in profiles):
+        response = jsonify({"success": False, "error": "profiles must be a non-empty list of profile objects"})
+        response.status_code = 400
+        return response
+    if len(profiles) > BATCH_MAX_PROFILES:
+        response = jsonify({
+            "success": False,
+            "error": f"A batch can hold at most {BATCH_MAX_PROFILES} profiles"
+        })
+        response.status_code = 413
+        return response
+    if not vector_store:
+        return json_response(*vector_store_unavailable())
+    
+    job = start_batch_job(profiles, vector_store)
+    if wants_ndjson(data):
+        return ndjson_response(job.iter_events())
+    response = jsonify({"success": True, **job.snapshot()})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/generate-plans/batch/{job.id}"
+    return response
 
-User Question: {user_question}
+# Progress and the results so far; ?stream=1 replays the job's NDJSON events
+# and follows it until it is done
+@app.route('/api/generate-plans/batch/<job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        response = jsonify({"success": False, "error": "Unknown or expired job"})
+        response.status_code = 404
+        return response
+    if wants_ndjson(request.args):
+        return ndjson_response(job.iter_events())
+    return jsonify({"success": True, **job.snapshot()})
 
-Please provide a helpful response to the user's question about their AYUSH lifestyle plan.
-"""
+async def aask_question(data, stream):
+    user_question = data.get('question', '')
+    session_id = data.get('sessionId')
+    
+    # Follow-up questions normally send just the session id. A full profile and
+    # plan are still accepted and start a new session, e.g. after expiry.
+    session = await in_thread(session_store.get, session_id, executor=light_executor) if session_id else None
+    if session is None:
+        if 'lifestylePlan' not in data:
+            return {
+                "success": False,
+                "sessionExpired": True,
+                "error": "Session not found or expired. Please resend your profile and plan."
+            }, 200
+        session_id = await in_thread(
+            session_store.create, data.get('userProfile', {}), data.get('lifestylePlan', ''), executor=light_executor
+        )
+        session = await in_thread(session_store.get, session_id, executor=light_executor)
     
     try:
-        response = call_github_model(
-            messages=[
-                {"role": "system", "content": "You are an AYUSH lifestyle coach assistant. Answer questions about the user's lifestyle plan based on Ayurveda, Yoga, Unani, Siddha, and Homeopathy principles."},
-                {"role": "user", "content": prompt}
-            ],
+        # Paraphrases of an earlier question about the same profile and plan
+        # are answered from the semantic cache
+        scope = vector = None
+        if SEMANTIC_CACHE and SemanticAnswerCache.cacheable(user_question):
+            scope = SemanticAnswerCache.scope_key(session)
+            try:
+                with span("semantic_cache"):
+                    cached_answer, vector = await in_thread(semantic_cache.lookup, scope, user_question)
+            except Exception as e:
+                # e.g. the retrieval sidecar is still starting; answer without the cache
+                print(f"Semantic cache lookup failed: {e}")
+                cached_answer = vector = None
+            if cached_answer is not None:
+                await in_thread(session_store.add_turn, session_id, user_question, cached_answer, executor=light_executor)
+                if stream:
+                    return TokenStream(single_token(cached_answer), done={"sessionId": session_id, "cached": True})
+                return {
+                    "success": True,
+                    "response": cached_answer,
+                    "sessionId": session_id,
+                    "cached": True
+                }, 200
+        
+        messages = build_question_messages(session, user_question)
+        start = time.time()
+        local_fallbacks = model_client.local_fallbacks
+        
+        def finish(answer):
+            session_store.add_turn(session_id, user_question, answer)
+            # Don't keep error or offline answers around for later paraphrases
+            answered = answer and answer != MODEL_ERROR_RESPONSE and model_client.local_fallbacks == local_fallbacks
+            if vector is not None and answered:
+                semantic_cache.add(scope, user_question, vector, answer, time.time() - start)
+        
+        if stream:
+            tokens = astream_github_model(
+                messages, "gpt-4o-mini", temperature=0.7, max_tokens=1000, label="ask-question"
+            )
+            return TokenStream(acollect_stream(tokens, finish), done={"sessionId": session_id})
+        
+        response = await acall_github_model(
+            messages=messages,
             model_name="gpt-4o-mini",
             temperature=0.7,
             max_tokens=1000
         )
+        await in_thread(finish, response)
         
-        return jsonify({
+        return {
             "success": True,
-            "response": response
-        })
+            "response": response,
+            "sessionId": session_id
+        }, 200
     except Exception as e:
-        return jsonify({
+        return {
             "success": False,
             "error": str(e)
-        })
+        }, 200
+
+async def single_token(text):
+    yield text
+
+@app.route('/api/ask-question', methods=['POST'])
+@limit_concurrency("ask-question")
+def ask_question():
+    data = request.json
+    return flask_response(run_async(aask_question(data, wants_stream(data))))
 
 # Serve React frontend
 @app.route('/', defaults={'path': ''})
@@ -528,5 +3882,216 @@ def serve(path):
     else:
         return send_from_directory(app.static_folder, 'index.html')
 
+# ASGI app for SERVE_ASGI=1. The /api/* routes that wait on the model run as
+# coroutines on the server's event loop, sharing the same route limits, traces
+# and metrics as the Flask views; everything else goes to the Flask app on a
+# small thread pool.
+def create_asgi_app():
+    from a2wsgi import WSGIMiddleware
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Mount, Route
+    from werkzeug.datastructures import MIMEAccept
+    from werkzeug.http import parse_accept_header
+    
+    async def health(request, data):
+        return await in_thread(health_payload, executor=light_executor), 200
+    
+    async def ask_question(request, data):
+        return await aask_question(data, wants_stream(data, accept_header(request)))
+    
+    async def generate_plan(request, data):
+        return await agenerate_plan(data, wants_stream(data, accept_header(request)))
+    
+    def accept_header(request):
+        return parse_accept_header(request.headers.get("accept"), MIMEAccept)
+    
+    # What flask-cors adds to the Flask routes. Preflight requests don't match
+    # these POST routes and fall through to Flask, which answers them.
+    CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+    
+    def route(path, name, handler, method="POST"):
+        limiter = route_limiters[name]
+        
+        async def endpoint(request):
+            # Stack sampling follows threads, so these traces get spans only
+            trace = Trace(request.method, path)
+            current_trace.set(trace)
+            if not await limiter.acquire_async():
+                finish_trace(trace, path, request.method, 429)
+                return JSONResponse(BUSY_RESPONSE, status_code=429, headers=dict(CORS_HEADERS, **{"Retry-After": "1"}))
+            status = 500
+            try:
+                if method == "POST":
+                    try:
+                        data = await request.json()
+                    except ValueError:
+                        status = 400
+                        return JSONResponse(
+                            {"success": False, "error": "Request body must be JSON"}, status_code=400, headers=CORS_HEADERS
+                        )
+                else:
+                    data = {}
+                result = await handler(request, data)
+                if isinstance(result, TokenStream):
+                    # The slot and the trace are held until the stream is finished
+                    status = None
+                    return ClosingStreamingResponse(
+                        asse_events(result.tokens, result.done),
+                        on_close=functools.partial(finish, trace, request.method, 200),
+                        media_type="text/event-stream",
+                        headers=dict(SSE_HEADERS, **CORS_HEADERS)
+                    )
+                body, status = result
+                return JSONResponse(body, status_code=status, headers=CORS_HEADERS)
+            finally:
+                if status is not None:
+                    finish(trace, request.method, status)
+        
+        def finish(trace, method, status):
+            limiter.release()
+            finish_trace(trace, path, method, status)
+        
+        return Route(path, endpoint, methods=[method])
+    
+    # Starlette leaves a body iterator open if the client disconnects. Close
+    # it here so the model stream is cancelled and the route slot freed now.
+    class ClosingStreamingResponse(StreamingResponse):
+        def __init__(self, content, on_close, **kwargs):
+            super().__init__(content, **kwargs)
+            self.on_close = on_close
+        
+        async def __call__(self, scope, receive, send):
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                try:
+                    await self.body_iterator.aclose()
+                finally:
+                    self.on_close()
+    
+    @contextlib.asynccontextmanager
+    async def lifespan(asgi_app):
+        use_async_loop(asyncio.get_running_loop())
+        start_warm_up()
+        start_ingestion_worker()
+        yield
+    
+    return Starlette(
+        routes=[
+            route('/api/health', "health", health, method="GET"),
+            route('/api/collect-info', "collect-info", lambda request, data: acollect_info(data)),
+            route('/api/submit-responses', "submit-responses", lambda request, data: asubmit_responses(data)),
+            route('/api/generate-plan', "generate-plan", generate_plan),
+            route('/api/ask-question', "ask-question", ask_question),
+            Mount('/', app=WSGIMiddleware(app, workers=SERVE_WSGI_THREADS))
+        ],
+        lifespan=lifespan
+    )
+
+def serve_asgi(listen_socket=None):
+    import uvicorn
+    config = uvicorn.Config(create_asgi_app(), host=SERVE_HOST, port=SERVE_PORT, lifespan="on", log_level="warning")
+    uvicorn.Server(config).run(sockets=[listen_socket] if listen_socket is not None else None)
+
+def run_query_worker(listen_socket, address, authkey, index):
+    global SERVING_ROLE, retrieval_client, session_store, profile_store, semantic_cache
+    from werkzeug.serving import make_server
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    SERVING_ROLE = "worker"
+    retrieval_client = RetrievalClient(address, authkey)
+    session_store = RemoteStore(retrieval_client, "sessions")
+    profile_store = RemoteStore(retrieval_client, "profiles")
+    semantic_cache = RemoteStore(retrieval_client, "semantic_cache")
+    if SERVE_ASGI:
+        print(f"Query worker {index} (pid {os.getpid()}) serving ASGI on http://{SERVE_HOST}:{SERVE_PORT}")
+        serve_asgi(listen_socket)
+        return
+    server = make_server(SERVE_HOST, SERVE_PORT, app, threaded=True, fd=listen_socket.fileno())
+    start_warm_up()
+    start_ingestion_worker()
+    print(f"Query worker {index} (pid {os.getpid()}) serving on http://{SERVE_HOST}:{SERVE_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# Production mode: bind once, start the retrieval sidecar, then pre-fork
+# query workers that all accept on the shared socket. Workers or the sidecar
+# are restarted if they die. Forking happens before this process starts any
+# threads or opens any SQLite connection (those are opened per process on
+# first use), which is why app.py keeps module import free of side effects.
+# Sessions, profiles and the semantic cache live in the sidecar, so every
+# worker sees the same ones.
+def serve_production(workers):
+    authkey = os.urandom(32)
+    context = multiprocessing.get_context("spawn")
+    
+    def start_sidecar():
+        sidecar = context.Process(
+            target=run_retrieval_sidecar, args=(RETRIEVAL_SOCKET, authkey), name="retrieval-sidecar"
+        )
+        sidecar.start()
+        return sidecar.pid
+    
+    def fork_worker(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_query_worker(listen_socket, RETRIEVAL_SOCKET, authkey, index)
+            finally:
+                os._exit(0)
+        return pid
+    
+    listen_socket = socket.create_server((SERVE_HOST, SERVE_PORT), backlog=128)
+    sidecar_pid = start_sidecar()
+    children = {fork_worker(index): index for index in range(workers)}
+    stopping = False
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children) + [sidecar_pid]:
+            if pid is None:
+                continue
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving with {workers} query workers and a retrieval sidecar (pid {sidecar_pid})")
+    # Other children (e.g. multiprocessing's resource tracker) are ignored
+    while children or sidecar_pid:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        if pid == sidecar_pid:
+            sidecar_pid = None
+            if not stopping:
+                print("Retrieval sidecar exited, restarting it")
+                sidecar_pid = start_sidecar()
+        elif pid in children:
+            index = children.pop(pid)
+            if not stopping:
+                print(f"Query worker {index} exited, restarting it")
+                children[fork_worker(index)] = index
+    listen_socket.close()
+    if os.path.exists(RETRIEVAL_SOCKET):
+        os.unlink(RETRIEVAL_SOCKET)
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    if SERVE_WORKERS > 0:
+        serve_production(SERVE_WORKERS)
+    elif SERVE_ASGI:
+        print(f"Serving ASGI on http://{SERVE_HOST}:{SERVE_PORT}")
+        serve_asgi()
+    else:
+        # With the reloader on, only the child process that serves requests ingests
+        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_warm_up()
+            start_ingestion_worker()
+        app.run(debug=True, port=5000)
\ No newline at end of file
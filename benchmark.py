@@ -0,0 +1,847 @@
+# Benchmarks for the AYUSH lifestyle coach backend.
+#
+# loadtest: starts a fake chat-completions server with configurable latency,
+# points app.py at it and fires concurrent requests at the /api/* routes, with
+# a scratch synthetic knowledge base ingested before measuring. Request bodies
+# vary and the answer caches are off unless --caches is given.
+# Prints throughput, p50/p99 latency and rejected (429) counts per route as JSON.
+# With --asgi the app is served by the ASGI app under uvicorn (SERVE_ASGI=1)
+# instead of Flask's threaded server.
+#
+#   python benchmark.py loadtest --concurrency 32 --requests 400 --latency 0.5
+#
+# ingest: writes a synthetic corpus of generated PDFs to a temporary
+# knowledge base and runs a full ingestion into a temporary chroma_db.
+# Prints pages/sec, chunks/sec and peak RSS as JSON.
+#
+#   python benchmark.py ingest --pdfs 20 --pages 40
+#
+# profiles: concurrent clients saving and reading back per-user profiles through
+# the SQLite profile store, next to the old single JSON file rewrite.
+# Prints writes/sec (accepted and durable) and read latency as JSON.
+#
+#   python benchmark.py profiles --clients 32 --writes 200
+#
+# embeddings: compares embedding backends (torch, onnx, onnx-int8) on the chunks
+# already in chroma_db. Reports load time, encode throughput and recall@k
+# against the reference backend, both for queries against the stored vectors
+# and with the chunks re-embedded by each backend.
+#
+#   python benchmark.py embeddings --backends torch,onnx,onnx-int8 --k 5
+#
+# startup: imports app.py in a fresh interpreter under -X importtime and
+# prints the slowest imports (cumulative), then times warm-up and ingestion
+# until the app reports ready.
+#
+#   python benchmark.py startup --top 15
+#
+# suite: the reproducible end-to-end run for CI. For each corpus size it
+# generates a seeded synthetic knowledge base, times the create_vector_db
+# stages and similarity_search at each k, then drives all five /api/* routes
+# against the fake model server using the largest collection. Prints one
+# JSON document (throughput, p50/p95/p99, peak RSS) with sorted keys so two
+# runs can be diffed directly.
+#
+#   python benchmark.py suite --sizes 5,20 --pages 20 --ks 1,4,10 --output bench.json
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_PROFILE = {
+    "personalInformation": {"name": "Asha", "age": 34, "gender": "female"},
+    "dietaryHabits": {"typicalDiet": "rice, dal, vegetables", "mealsPerDay": 3},
+    "sleepPatterns": {"averageSleepHours": 6, "restedUponWaking": False},
+    "stressManagement": {"currentStressors": "work deadlines"},
+    "physicalActivity": {"activityLevel": "sedentary"},
+    "prakritiAssessment": {"dominantDosha": "vata", "doshaImbalances": {"vata": "elevated"}}
+}
+
+SAMPLE_PLAN = "# Personalized AYUSH Lifestyle Plan\n\n" + "\n".join(
+    f"- Recommendation {i}: warm, grounding routine for vata balance." for i in range(60)
+)
+
+ROUTES = {
+    "health": ("GET", "/api/health", None),
+    "collect-info": ("POST", "/api/collect-info", {
+        "basicInfo": {"name": "Asha", "age": "34", "gender": "female", "category": "lifestyle"}
+    }),
+    "submit-responses": ("POST", "/api/submit-responses", {
+        "responses": [
+            {"question": "How is your sleep?", "answer": "Light, around 6 hours"},
+            {"question": "What is your typical diet?", "answer": "Rice, dal and vegetables"},
+            {"question": "How would you describe your stress levels?", "answer": "Moderate"}
+        ]
+    }),
+    "generate-plan": ("POST", "/api/generate-plan", {"userProfile": SAMPLE_PROFILE}),
+    "ask-question": ("POST", "/api/ask-question", {
+        "question": "What should I eat for breakfast?",
+        "userProfile": SAMPLE_PROFILE,
+        "lifestylePlan": SAMPLE_PLAN
+    }),
+}
+
+
+# Fake chat-completions endpoint compatible with the Azure AI Inference SDK
+class FakeChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    model_latency = {}
+    # Answer streaming requests with a 503 before any token, e.g. to exercise
+    # the fallback to a regular completion
+    fail_streams = False
+    requests_served = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "gpt-4o-mini")
+        with FakeChatHandler.lock:
+            FakeChatHandler.requests_served += 1
+        content = self.fake_content(body.get("messages", []))
+        delay = self.model_latency.get(model, self.latency)
+
+        if body.get("stream") and self.fail_streams:
+            payload = json.dumps({"error": {"code": "ServiceUnavailable", "message": "fake stream failure"}}).encode("utf-8")
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            words = content.split(" ")
+            for i, word in enumerate(words):
+                time.sleep(delay / len(words))
+                chunk = {
+                    "id": "fake", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}]
+                }
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+            self.write_chunk("")
+            return
+
+        time.sleep(delay)
+        payload = json.dumps({
+            "id": "fake", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def fake_content(messages):
+        prompt = " ".join(m.get("content", "") for m in messages).lower()
+        if "follow-up questions" in prompt:
+            return json.dumps(["How is your sleep?", "What is your typical diet?", "How stressed are you?"])
+        if "structured profile" in prompt:
+            return json.dumps(SAMPLE_PROFILE)
+        return "Favour warm, cooked meals and a regular routine. " * 20
+
+
+VOCABULARY = (
+    "vata pitta kapha dosha prakriti vikriti agni ama ojas dinacharya ritucharya "
+    "abhyanga ghee turmeric ashwagandha triphala brahmi tulsi ginger cumin fennel "
+    "pranayama asana surya namaskar shavasana vajrasana meditation sleep digestion "
+    "warm cooked meals seasonal fruits vegetables routine stress balance herbs "
+    "yoga unani siddha homeopathy nasya oil massage spices lentils rice millet"
+).split()
+
+
+# Minimal PDF writer so the benchmark needs nothing beyond the standard library
+def write_synthetic_pdf(path, pages, rng, lines_per_page=48, words_per_line=12):
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        lines = [" ".join(rng.choice(VOCABULARY) for _ in range(words_per_line)) + "."
+                 for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 40 800 Td 15 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_corpus(directory, pdfs, pages, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(pdfs):
+        write_synthetic_pdf(os.path.join(directory, f"synthetic_{i:04d}.pdf"), pages, rng)
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(self_rss, 1), round(children_rss, 1)
+
+
+def import_backend(workdir):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    use_workdir(backend, workdir)
+    return backend
+
+
+def use_workdir(backend, workdir):
+    # Point the app at a scratch knowledge base and chroma_db before ingesting
+    backend.PDF_DIR = os.path.join(workdir, "knowledge_base")
+    backend.CHROMA_DIR = os.path.join(workdir, "chroma_db")
+    backend.INGEST_MANIFEST_FILE = os.path.join(backend.CHROMA_DIR, "ingest_manifest.json")
+    backend.KEYWORD_INDEX_FILE = os.path.join(backend.CHROMA_DIR, "keyword_index.json")
+    backend.INGEST_LOCK_FILE = os.path.join(backend.CHROMA_DIR, "ingest.lock")
+
+
+def start_fake_model_server(latency, model_latency=None):
+    FakeChatHandler.latency = latency
+    FakeChatHandler.model_latency = model_latency or {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app_server(flask_app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# uvicorn on a background thread, with the same server_port / shutdown()
+# interface as start_app_server's werkzeug server
+class AsgiServer:
+    def __init__(self, asgi_app):
+        import socket
+        import uvicorn
+        self.socket = socket.create_server(("127.0.0.1", 0))
+        self.server_port = self.socket.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(asgi_app, lifespan="on", log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("ASGI server failed to start")
+            time.sleep(0.05)
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+    }
+
+
+# A distinct payload per request, so a load run measures the request path
+# rather than the completion, retrieval and semantic answer caches
+def varied_body(route, i):
+    body = json.loads(json.dumps(ROUTES[route][2]))
+    tag = f"{VOCABULARY[i % len(VOCABULARY)]} {i}"
+    if route == "collect-info":
+        body["basicInfo"]["name"] = f"Client {i}"
+    elif route == "submit-responses":
+        body["responses"][0]["answer"] = f"Light, around 6 hours ({tag})"
+    elif route == "generate-plan":
+        body["userProfile"]["stressManagement"] = {"currentStressors": tag}
+    elif route == "ask-question":
+        body["question"] = f"What should I eat for breakfast with {tag}?"
+    return body
+
+
+def send_request(base_url, route, body=None):
+    method, path, template = ROUTES[route]
+    body = template if body is None else body
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return route, status, time.perf_counter() - start
+
+
+def run_load(base_url, routes, total_requests, concurrency, vary=False):
+    schedule = []
+    for i in range(total_requests):
+        route = routes[i % len(routes)]
+        schedule.append((route, varied_body(route, i) if vary and ROUTES[route][2] is not None else None))
+    results = {route: {"latencies": [], "statuses": {}} for route in routes}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for route, status, elapsed in pool.map(lambda item: send_request(base_url, *item), schedule):
+            results[route]["statuses"][status] = results[route]["statuses"].get(status, 0) + 1
+            if status == 200:
+                results[route]["latencies"].append(elapsed)
+    wall = time.perf_counter() - start
+
+    report = {"wall_seconds": round(wall, 2), "requests": total_requests, "routes": {}}
+    ok = 0
+    for route, result in results.items():
+        ok += len(result["latencies"])
+        report["routes"][route] = dict(summarize(result["latencies"]), statuses=result["statuses"])
+    report["throughput_rps"] = round(ok / wall, 1) if wall else None
+    return report
+
+
+def wait_until_settled(backend, timeout):
+    # Until warm-up is done and the ingestion worker's first run has finished,
+    # which swaps in vector_store
+    deadline = time.time() + timeout
+    while not (backend.is_ready() and backend.ingest_status.snapshot()["runs"]
+               and backend.ingest_status.snapshot()["state"] != "running"):
+        if time.time() > deadline:
+            sys.exit("Timed out waiting for warm-up and the first ingestion run")
+        time.sleep(0.1)
+
+
+def cmd_loadtest(args):
+    model_server = start_fake_model_server(args.latency, {"deepseek-r1": args.plan_latency})
+    os.environ["MODEL_ENDPOINT"] = f"http://127.0.0.1:{model_server.server_port}"
+    os.environ.setdefault("GITHUB_TOKEN", "fake-token")
+    # A scratch knowledge base, chroma_db and profile database, so the load
+    # test never touches the real ones
+    workdir = tempfile.mkdtemp(prefix="ayush_loadtest_")
+    backend = import_backend(workdir)
+    backend.profile_store = backend.ProfileStore(os.path.join(workdir, "user_profiles.sqlite3"))
+    generate_corpus(backend.PDF_DIR, args.pdfs, args.pages, args.seed)
+    routes = args.routes.split(",")
+
+    # Unless asked to keep them, turn off the answer caches, so every model
+    # route makes its upstream call. Payloads vary per request either way.
+    if not args.caches:
+        backend.SEMANTIC_CACHE = False
+        backend.COMPLETION_CACHE_MAX_TEMPERATURE = -1.0
+    # The first request would start warm-up and the ingestion worker; start
+    # them now and wait until they settle. The ASGI app's lifespan starts them
+    # itself, as its loop must become the model loop first.
+    if args.asgi:
+        app_server = AsgiServer(backend.create_asgi_app())
+    else:
+        backend.start_warm_up()
+        backend.start_ingestion_worker()
+        app_server = start_app_server(backend.app)
+    wait_until_settled(backend, args.timeout)
+
+    base_url = f"http://127.0.0.1:{app_server.server_port}"
+    upstream_before = FakeChatHandler.requests_served
+    report = run_load(base_url, routes, args.requests, args.concurrency, vary=True)
+    report["config"] = {
+        "server": "asgi" if args.asgi else "wsgi",
+        "concurrency": args.concurrency,
+        "model_latency_s": args.latency,
+        "plan_latency_s": args.plan_latency,
+        "caches": args.caches,
+        "upstream_calls": FakeChatHandler.requests_served - upstream_before
+    }
+    print(json.dumps(report, indent=2))
+    app_server.shutdown()
+    model_server.shutdown()
+
+
+def cmd_ingest(args):
+    workdir = tempfile.mkdtemp(prefix="ayush_bench_")
+    backend = import_backend(workdir)
+    generate_corpus(backend.PDF_DIR, args.pdfs, args.pages, args.seed)
+    if args.workers:
+        backend.INGEST_WORKERS = args.workers
+
+    start = time.perf_counter()
+    backend.create_vector_db()
+    elapsed = time.perf_counter() - start
+    status = backend.ingest_status.snapshot()
+    self_rss, children_rss = peak_rss_mb()
+    print(json.dumps({
+        "pdfs": args.pdfs,
+        "pages": status["pages_done"],
+        "chunks": status["chunks_added"],
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(status["pages_done"] / elapsed, 1),
+        "chunks_per_second": round(status["chunks_added"] / elapsed, 1),
+        "peak_rss_mb": self_rss,
+        "peak_rss_workers_mb": children_rss,
+        "workers": backend.INGEST_WORKERS,
+        "embeddings": backend.get_embedding_service().stats()
+    }, indent=2))
+
+
+def run_clients(clients, work):
+    # Runs work(client) on each client thread; returns wall seconds
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(work, range(clients)))
+    return time.perf_counter() - start
+
+
+def cmd_profiles(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    workdir = tempfile.mkdtemp(prefix="ayush_profiles_")
+    store = backend.ProfileStore(os.path.join(workdir, "user_profiles.sqlite3"), cache_size=args.cache_size)
+    total = args.clients * args.writes
+
+    def write(client):
+        for i in range(args.writes):
+            store.save(f"user-{client}-{i}", dict(SAMPLE_PROFILE, revision=i))
+
+    start = time.perf_counter()
+    accepted = run_clients(args.clients, write)
+    store.flush()
+    durable = time.perf_counter() - start
+    read_latencies = []
+    read_lock = threading.Lock()
+
+    def read(client):
+        rng = random.Random(client)
+        for _ in range(args.writes):
+            user_id = f"user-{rng.randrange(args.clients)}-{rng.randrange(args.writes)}"
+            start = time.perf_counter()
+            assert store.get(user_id) is not None
+            with read_lock:
+                read_latencies.append(time.perf_counter() - start)
+
+    read_seconds = run_clients(args.clients, read)
+
+    # The previous behaviour: every save rewrites one shared JSON file
+    legacy_file = os.path.join(workdir, "user_profile.json")
+    legacy_lock = threading.Lock()
+
+    def legacy_write(client):
+        for i in range(args.writes):
+            with legacy_lock:
+                with open(legacy_file, 'w') as f:
+                    json.dump(dict(SAMPLE_PROFILE, revision=i), f, indent=2)
+
+    legacy = run_clients(args.clients, legacy_write)
+    print(json.dumps({
+        "clients": args.clients,
+        "writes": total,
+        "accepted_writes_per_second": round(total / accepted, 1),
+        "durable_writes_per_second": round(total / durable, 1),
+        "profile_store": store.stats(),
+        "read_seconds": round(read_seconds, 2),
+        "reads": summarize(read_latencies),
+        "legacy_json_file": {"seconds": round(legacy, 2), "writes_per_second": round(total / legacy, 1)}
+    }, indent=2))
+
+
+def top_k(query_vectors, doc_vectors, k):
+    import numpy as np
+    scores = query_vectors @ doc_vectors.T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :k]]
+
+
+def recall(results, reference):
+    return round(sum(len(a & b) for a, b in zip(results, reference)) / sum(len(b) for b in reference), 4)
+
+
+def cmd_embeddings(args):
+    import numpy as np
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    import chromadb
+
+    missing = f"No chunks in {backend.CHROMA_DIR}; run the app or `benchmark.py ingest` first"
+    # The manifest names no collection once the knowledge base has been emptied
+    name = backend.live_collection_name()
+    client = chromadb.PersistentClient(path=backend.CHROMA_DIR)
+    if name is None or name not in [collection.name for collection in client.list_collections()]:
+        sys.exit(missing)
+    stored = client.get_collection(name).get(include=["documents", "embeddings"])
+    if not stored["ids"]:
+        sys.exit(missing)
+    documents = stored["documents"]
+    stored_vectors = np.array(stored["embeddings"], dtype=np.float32)
+    stored_vectors /= np.linalg.norm(stored_vectors, axis=1, keepdims=True)
+
+    # Queries: the profile sub-queries plus the opening words of sampled chunks
+    rng = random.Random(args.seed)
+    queries = backend.profile_sub_queries(SAMPLE_PROFILE)
+    for text in rng.sample(documents, min(args.queries, len(documents))):
+        queries.append(" ".join(text.split()[:12]))
+
+    backends = args.backends.split(",")
+    if args.reference not in backends:
+        backends.insert(0, args.reference)
+    results = {}
+    for name in backends:
+        start = time.perf_counter()
+        model = backend.load_embedding_backend(name, backend.EMBEDDING_MODEL)
+        load_seconds = time.perf_counter() - start
+        model.encode(documents[:args.batch_size], args.batch_size)  # warm up
+
+        start = time.perf_counter()
+        doc_vectors = np.asarray(model.encode(documents, args.batch_size), dtype=np.float32)
+        encode_seconds = time.perf_counter() - start
+
+        latencies = []
+        query_vectors = []
+        for query in queries:
+            start = time.perf_counter()
+            query_vectors.append(model.encode([query], 1)[0])
+            latencies.append(time.perf_counter() - start)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+        results[name] = {
+            "load_seconds": round(load_seconds, 2),
+            "docs_per_second": round(len(documents) / encode_seconds, 1),
+            "query_latency": summarize(latencies),
+            "stored": top_k(query_vectors, stored_vectors, args.k),
+            "reembedded": top_k(query_vectors, doc_vectors, args.k),
+            "peak_rss_mb": peak_rss_mb()[0]
+        }
+
+    reference = results[args.reference]["stored"]
+    for name, result in results.items():
+        result[f"recall@{args.k}_stored"] = recall(result.pop("stored"), reference)
+        result[f"recall@{args.k}_reembedded"] = recall(result.pop("reembedded"), reference)
+    print(json.dumps({
+        "chunks": len(documents),
+        "queries": len(queries),
+        "reference": args.reference,
+        "backends": results
+    }, indent=2))
+
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.start_warm_up()
+app.start_ingestion_worker()
+while not app.is_ready() and time.perf_counter() - imported < float(sys.argv[1]):
+    time.sleep(0.05)
+print(json.dumps({
+    "import_seconds": round(imported - start, 3),
+    "ready_seconds": round(time.perf_counter() - start, 3) if app.is_ready() else None,
+    "warm_up": app.warm_up_status.snapshot(),
+    "ingest_state": app.ingest_status.snapshot()["state"]
+}))
+"""
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.rstrip(), int(cumulative)))
+    return modules
+
+
+def cmd_startup(args):
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT, str(args.timeout)],
+        cwd=root, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr[-2000:])
+    modules = parse_importtime(result.stderr)
+    # Children are printed before their parent, two spaces deeper. The
+    # modules app.py imports itself are the depth 1 lines just before "app".
+    direct = []
+    children = []
+    for name, us in modules:
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == "app":
+                direct = children
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), us))
+    slowest = sorted(modules, key=lambda item: item[1], reverse=True)[:args.top]
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["imports"] = {
+        "app_direct_ms": {name: round(us / 1000, 1) for name, us in sorted(direct, key=lambda item: -item[1])},
+        "slowest_cumulative_ms": {name.strip(): round(us / 1000, 1) for name, us in slowest}
+    }
+    print(json.dumps(report, indent=2))
+
+
+def synthetic_queries(count, rng, words=6):
+    # Distinct queries, so every search misses the embedding and retrieval caches
+    queries = set()
+    while len(queries) < count:
+        queries.add(" ".join(rng.choice(VOCABULARY) for _ in range(words)))
+    return sorted(queries)
+
+
+def stage_totals(trace):
+    totals = {}
+    for stage, _, seconds in trace.spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return {stage: round(seconds, 3) for stage, seconds in totals.items()}
+
+
+def bench_create_vector_db(backend, workdir, pdfs, pages, seed):
+    use_workdir(backend, workdir)
+    generate_corpus(backend.PDF_DIR, pdfs, pages, seed)
+    trace = backend.Trace("BENCH", "create_vector_db")
+    token = backend.current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        store = backend.create_vector_db()
+    finally:
+        backend.current_trace.reset(token)
+    elapsed = time.perf_counter() - start
+    stages = stage_totals(trace)
+    # Parsing and splitting run in worker processes, overlapped with embedding
+    stages["parse_wait"] = round(max(0.0, stages.get("ingest_chunks", 0.0)
+                                     - stages.get("ingest_encode", 0.0) - stages.get("ingest_upsert", 0.0)), 3)
+    status = backend.ingest_status.snapshot()
+    return store, {
+        "seconds": round(elapsed, 3),
+        "pages": status["pages_done"],
+        "chunks": status["chunks_added"],
+        "chunks_per_second": round(status["chunks_added"] / elapsed, 1) if elapsed else None,
+        "stages_seconds": stages,
+        "peak_rss_mb": peak_rss_mb()[0]
+    }
+
+
+def bench_similarity_search(backend, store, ks, queries):
+    report = {}
+    for k in ks:
+        backend.retrieval_cache.clear()
+        backend.query_embedding_cache.clear()
+        latencies = []
+        start = time.perf_counter()
+        for query in queries:
+            query_start = time.perf_counter()
+            store.similarity_search(query, k=k)
+            latencies.append(time.perf_counter() - query_start)
+        wall = time.perf_counter() - start
+        report[f"k={k}"] = dict(summarize(latencies), queries_per_second=round(len(queries) / wall, 1))
+    return report
+
+
+def cmd_suite(args):
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    ks = [int(k) for k in args.ks.split(",")]
+    model_server = start_fake_model_server(args.latency, {"deepseek-r1": args.plan_latency})
+    os.environ["MODEL_ENDPOINT"] = f"http://127.0.0.1:{model_server.server_port}"
+    os.environ.setdefault("GITHUB_TOKEN", "fake-token")
+    root = tempfile.mkdtemp(prefix="ayush_suite_")
+    backend = import_backend(os.path.join(root, f"pdfs_{sizes[0]}"))
+    backend.profile_store = backend.ProfileStore(os.path.join(root, "user_profiles.sqlite3"))
+
+    # Import chromadb and load the embedding model up front (encoding once, as
+    # the model loads on first use) so the first size isn't charged for them
+    start = time.perf_counter()
+    backend.import_dependencies()
+    import chromadb  # noqa: F401
+    backend.get_embedding_service().encode(["warm up"])
+    warm_up = time.perf_counter() - start
+
+    queries = synthetic_queries(args.queries, random.Random(args.seed))
+    report = {
+        "config": {
+            "sizes_pdfs": sizes,
+            "pages_per_pdf": args.pages,
+            "ks": ks,
+            "queries": args.queries,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "model_latency_s": args.latency,
+            "plan_latency_s": args.plan_latency,
+            "embedding_backend": backend.EMBEDDING_BACKEND,
+            "hybrid_search": backend.HYBRID_SEARCH,
+            "ingest_workers": backend.INGEST_WORKERS,
+            "caches": args.caches
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "warm_up_seconds": round(warm_up, 3),
+        "collections": {}
+    }
+
+    store = None
+    for pdfs in sizes:
+        workdir = os.path.join(root, f"pdfs_{pdfs}")
+        store, ingest = bench_create_vector_db(backend, workdir, pdfs, args.pages, args.seed)
+        report["collections"][f"pdfs={pdfs}"] = {
+            "create_vector_db": ingest,
+            "similarity_search": bench_similarity_search(backend, store, ks, queries),
+            "peak_rss_mb": peak_rss_mb()[0]
+        }
+
+    # Unless asked to keep them, turn off the answer caches, so every model
+    # route makes its upstream call. Payloads vary per request either way.
+    if not args.caches:
+        backend.SEMANTIC_CACHE = False
+        backend.COMPLETION_CACHE_MAX_TEMPERATURE = -1.0
+    # The first request would start warm-up and the ingestion worker, whose
+    # first run swaps vector_store; start them now and wait until they settle
+    backend.vector_store = store
+    backend.start_warm_up()
+    backend.start_ingestion_worker()
+    wait_until_settled(backend, args.timeout)
+
+    app_server = start_app_server(backend.app)
+    upstream_before = FakeChatHandler.requests_served
+    load = run_load(f"http://127.0.0.1:{app_server.server_port}", list(ROUTES), args.requests, args.concurrency,
+                    vary=True)
+    load["upstream_calls"] = FakeChatHandler.requests_served - upstream_before
+    load["peak_rss_mb"] = peak_rss_mb()[0]
+    report["load"] = load
+    report["peak_rss_mb"], report["peak_rss_workers_mb"] = peak_rss_mb()
+    app_server.shutdown()
+    model_server.shutdown()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the AYUSH backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    loadtest = subparsers.add_parser("loadtest", help="Concurrent load against the /api/* routes")
+    loadtest.add_argument("--concurrency", type=int, default=32)
+    loadtest.add_argument("--requests", type=int, default=400)
+    loadtest.add_argument("--latency", type=float, default=0.5, help="Fake model latency in seconds")
+    loadtest.add_argument("--plan-latency", type=float, default=5.0, help="Fake deepseek-r1 latency in seconds")
+    loadtest.add_argument("--routes", default=",".join(ROUTES), help="Comma separated routes to exercise")
+    loadtest.add_argument("--asgi", action="store_true", help="Serve with the ASGI app under uvicorn")
+    loadtest.add_argument("--pdfs", type=int, default=5, help="PDFs in the scratch knowledge base")
+    loadtest.add_argument("--pages", type=int, default=10, help="Pages per PDF")
+    loadtest.add_argument("--seed", type=int, default=0)
+    loadtest.add_argument("--caches", action="store_true",
+                          help="Keep the completion and semantic caches on (off by default)")
+    loadtest.add_argument("--timeout", type=float, default=300, help="Seconds to wait for warm-up before the load run")
+    loadtest.set_defaults(func=cmd_loadtest)
+
+    ingest = subparsers.add_parser("ingest", help="Ingest a synthetic PDF corpus")
+    ingest.add_argument("--pdfs", type=int, default=20)
+    ingest.add_argument("--pages", type=int, default=40, help="Pages per PDF")
+    ingest.add_argument("--workers", type=int, default=0, help="Parser processes (default: INGEST_WORKERS)")
+    ingest.add_argument("--seed", type=int, default=0)
+    ingest.set_defaults(func=cmd_ingest)
+
+    profiles = subparsers.add_parser("profiles", help="Concurrent profile writes and reads")
+    profiles.add_argument("--clients", type=int, default=32)
+    profiles.add_argument("--writes", type=int, default=200, help="Profiles saved per client")
+    profiles.add_argument("--cache-size", type=int, default=1000, help="Profile store read-through cache size")
+    profiles.set_defaults(func=cmd_profiles)
+
+    embeddings = subparsers.add_parser("embeddings", help="Compare embedding backends on the existing collection")
+    embeddings.add_argument("--backends", default="torch,onnx,onnx-int8")
+    embeddings.add_argument("--reference", default="torch", help="Backend whose results count as ground truth")
+    embeddings.add_argument("--k", type=int, default=5)
+    embeddings.add_argument("--queries", type=int, default=50, help="Chunk-derived queries to sample")
+    embeddings.add_argument("--batch-size", type=int, default=64)
+    embeddings.add_argument("--seed", type=int, default=0)
+    embeddings.set_defaults(func=cmd_embeddings)
+
+    startup = subparsers.add_parser("startup", help="Import-time breakdown and time to ready")
+    startup.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    startup.add_argument("--timeout", type=float, default=120, help="Seconds to wait for readiness")
+    startup.set_defaults(func=cmd_startup)
+
+    suite = subparsers.add_parser("suite", help="Reproducible ingestion, retrieval and load benchmark as JSON")
+    suite.add_argument("--sizes", default="5,20", help="Comma separated corpus sizes in PDFs")
+    suite.add_argument("--pages", type=int, default=20, help="Pages per PDF")
+    suite.add_argument("--ks", default="1,4,10", help="Comma separated k values for similarity_search")
+    suite.add_argument("--queries", type=int, default=100, help="Distinct queries per k")
+    suite.add_argument("--requests", type=int, default=200)
+    suite.add_argument("--concurrency", type=int, default=16)
+    suite.add_argument("--latency", type=float, default=0.2, help="Fake model latency in seconds")
+    suite.add_argument("--plan-latency", type=float, default=1.0, help="Fake deepseek-r1 latency in seconds")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--caches", action="store_true",
+                       help="Keep the completion and semantic answer caches on during the load run")
+    suite.add_argument("--timeout", type=float, default=300, help="Seconds to wait for warm-up before the load run")
+    suite.add_argument("--output", help="Also write the JSON report to this file")
+    suite.set_defaults(func=cmd_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 import { useState, useRef, useEffect } from 'react';
 import { FaPaperPlane, FaSpinner } from 'react-icons/fa';
 import { useUserData } from '../contexts/UserDataContext';
-import { askQuestion } from '../services/api';
+import { askQuestionStream } from '../services/api';
 
 const ChatInterface = () => {
   const [userInput, setUserInput] = useState('');
   const [isProcessing, setIsProcessing] = useState(false);
+  const [streamingText, setStreamingText] = useState('');
   const messagesEndRef = useRef(null);
   
   const { 
     userProfile, 
     lifestylePlan, 
+    sessionId,
+    setSessionId,
     chatHistory, 
     addChatMessage 
   } = useUserData();
@@ -18,7 +21,7 @@ const ChatInterface = () => {
   // Scroll to bottom of chat when messages change
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [chatHistory]);
+  }, [chatHistory, streamingText]);
   
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -33,8 +36,14 @@ const ChatInterface = () => {
     setIsProcessing(true);
     
     try {
-      // Get response from API
-      const result = await askQuestion(userInput, userProfile, lifestylePlan);
+      // Stream the response from the API, showing tokens as they arrive
+      const result = await askQuestionStream(userInput, sessionId, userProfile, lifestylePlan, (token, text) => {
+        setStreamingText(text);
+      });
+      
+      if (result.sessionId) {
+        setSessionId(result.sessionId);
+      }
       
       if (result.success) {
         addChatMessage('assistant', result.response);
@@ -43,8 +52,9 @@ const ChatInterface = () => {
       }
     } catch (error) {
       console.error("Error asking question:", error);
-      addChatMessage('assistant', "I'm sorry, I encountered an error. Please check your connection and try again.");
+      addChatMessage('assistant', error.data?.error || "I'm sorry, I encountered an error. Please check your connection and try again.");
     } finally {
+      setStreamingText('');
       setIsProcessing(false);
     }
   };
@@ -72,8 +82,8 @@ const ChatInterface = () => {
         
         {isProcessing && (
           <div className="flex justify-start">
-            <div className="bg-gray-100 text-gray-800 rounded-lg px-4 py-2">
-              <FaSpinner className="animate-spin" />
+            <div className="max-w-[80%] bg-gray-100 text-gray-800 rounded-lg px-4 py-2">
+              {streamingText || <FaSpinner className="animate-spin" />}
             </div>
           </div>
         )}
@@ -6,8 +6,11 @@ export const useUserData = () => useContext(UserDataContext);
 
 export const UserDataProvider = ({ children }) => {
   const [userProfile, setUserProfile] = useState(null);
+  const [userId, setUserId] = useState(null);
+  const [userToken, setUserToken] = useState(null);
   const [responses, setResponses] = useState([]);
   const [lifestylePlan, setLifestylePlan] = useState(null);
+  const [sessionId, setSessionId] = useState(null);
   const [category, setCategory] = useState(null);
   const [chatHistory, setChatHistory] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
@@ -22,19 +25,28 @@ export const UserDataProvider = ({ children }) => {
 
   const resetData = () => {
     setUserProfile(null);
+    setUserId(null);
+    setUserToken(null);
     setResponses([]);
     setLifestylePlan(null);
+    setSessionId(null);
     setChatHistory([]);
   };
 
   const value = {
     userProfile,
     setUserProfile,
+    userId,
+    setUserId,
+    userToken,
+    setUserToken,
     responses,
     setResponses,
     addResponse,
     lifestylePlan,
     setLifestylePlan,
+    sessionId,
+    setSessionId,
     category,
     setCategory,
     chatHistory,
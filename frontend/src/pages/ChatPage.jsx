@@ -2,7 +2,7 @@ import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { motion, AnimatePresence } from 'framer-motion';
 import { useUserData } from '../contexts/UserDataContext';
-import { collectInfo, submitResponses, generatePlan } from '../services/api';
+import { collectInfo, submitResponses, generatePlanStream } from '../services/api';
 import { FaArrowLeft, FaPaperPlane, FaSpinner, FaUser, FaRobot } from 'react-icons/fa';
 
 const fadeIn = {
@@ -23,10 +23,15 @@ const ChatPage = () => {
   const navigate = useNavigate();
   const { 
     setUserProfile, 
+    userId,
+    setUserId,
+    userToken,
+    setUserToken,
     responses, 
     setResponses, 
     addResponse, 
     setLifestylePlan,
+    setSessionId,
     chatHistory,
     setChatHistory,
     addChatMessage,
@@ -43,6 +48,7 @@ const ChatPage = () => {
   const [age, setAge] = useState('');
   const [gender, setGender] = useState('');
   const [progress, setProgress] = useState(0);
+  const [streamingText, setStreamingText] = useState('');
   
   const messagesEndRef = useRef(null);
   
@@ -83,7 +89,7 @@ const ChatPage = () => {
   // Scroll to bottom of chat
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [chatHistory]);
+  }, [chatHistory, streamingText]);
   
   // Handle user input submission
   const handleSubmit = async (e) => {
@@ -160,18 +166,25 @@ const ChatPage = () => {
           addChatMessage('assistant', "Thank you for all this information! I'm now creating your personalized AYUSH profile and lifestyle plan. This will take a moment...");
           
           // Submit all responses to generate user profile
-          const result = await submitResponses(responses);
+          const result = await submitResponses(responses, userId, userToken);
           
           if (result.success && result.userProfile) {
             setUserProfile(result.userProfile);
+            setUserId(result.userId);
+            setUserToken(result.userToken);
             
             // Generate lifestyle plan
             addChatMessage('assistant', "Your profile has been created. Now generating your personalized lifestyle plan...");
             
-            const planResult = await generatePlan(result.userProfile);
+            // Stream the plan, showing it as it is written
+            const planResult = await generatePlanStream(result.userProfile, (token, text) => {
+              setStreamingText(text);
+            });
+            setStreamingText('');
             
             if (planResult.success && planResult.lifestylePlan) {
               setLifestylePlan(planResult.lifestylePlan);
+              setSessionId(planResult.sessionId);
               
               addChatMessage('assistant', "Your personalized AYUSH lifestyle plan is ready!");
               addChatMessage('assistant', "Would you like to view your complete plan now?");
@@ -193,8 +206,9 @@ const ChatPage = () => {
       }
     } catch (error) {
       console.error("Error in chat flow:", error);
-      addChatMessage('assistant', "I'm sorry, I encountered an error. Please try again.");
+      addChatMessage('assistant', error.data?.error || "I'm sorry, I encountered an error. Please try again.");
     } finally {
+      setStreamingText('');
       setIsLoading(false);
     }
   };
@@ -259,17 +273,21 @@ const ChatPage = () => {
                 animate={{ opacity: 1 }}
                 className="flex justify-start"
               >
-                <div className="p-4 rounded-2xl bg-white/5 border border-emerald-800/30 backdrop-blur-lg">
-                  <div className="flex space-x-2">
-                    {[...Array(3)].map((_, i) => (
-                      <motion.div
-                        key={i}
-                        className="w-2 h-2 bg-emerald-400 rounded-full"
-                        animate={{ opacity: [0.2, 1, 0.2] }}
-                        transition={{ repeat: Infinity, duration: 1.2, delay: i * 0.2 }}
-                      />
-                    ))}
-                  </div>
+                <div className="max-w-[85%] p-4 rounded-2xl bg-white/5 border border-emerald-800/30 backdrop-blur-lg">
+                  {streamingText ? (
+                    <p className="text-emerald-200 whitespace-pre-wrap">{streamingText}</p>
+                  ) : (
+                    <div className="flex space-x-2">
+                      {[...Array(3)].map((_, i) => (
+                        <motion.div
+                          key={i}
+                          className="w-2 h-2 bg-emerald-400 rounded-full"
+                          animate={{ opacity: [0.2, 1, 0.2] }}
+                          transition={{ repeat: Infinity, duration: 1.2, delay: i * 0.2 }}
+                        />
+                      ))}
+                    </div>
+                  )}
                 </div>
               </motion.div>
             )}
@@ -12,9 +12,11 @@ export const collectInfo = async (basicInfo) => {
   }
 };
 
-export const submitResponses = async (responses) => {
+// userId and userToken come from an earlier response; without a matching
+// token the server saves the answers under a new id
+export const submitResponses = async (responses, userId, userToken) => {
   try {
-    const response = await axios.post(`${API_URL}/submit-responses`, { responses });
+    const response = await axios.post(`${API_URL}/submit-responses`, { responses, userId, userToken });
     return response.data;
   } catch (error) {
     console.error('Error submitting responses:', error);
@@ -22,26 +24,79 @@ export const submitResponses = async (responses) => {
   }
 };
 
-export const generatePlan = async (userProfile) => {
+// POSTs with stream=true and reads the server-sent events, calling onToken with
+// each new token and the text so far. Resolves with the full text, or with the
+// JSON body when the server answers without streaming (e.g. an early error).
+// The payload of the final done event is returned as well. Error statuses
+// throw with the server's message, e.g. while the knowledge base is loading;
+// the parsed body is on error.data.
+const streamRequest = async (path, body, onToken) => {
+  const response = await fetch(`${API_URL}/${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify({ ...body, stream: true })
+  });
+  if (!response.ok) {
+    const data = await response.json().catch(() => null);
+    const error = new Error(data?.error || `Request failed with status ${response.status}`);
+    error.status = response.status;
+    error.data = data;
+    throw error;
+  }
+  if (!response.headers.get('Content-Type')?.includes('text/event-stream')) {
+    return { json: await response.json() };
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+  let done = {};
+  for (;;) {
+    const { done: finished, value } = await reader.read();
+    if (finished) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    for (const rawEvent of events) {
+      let eventName = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event: ')) eventName = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (eventName === 'error') throw new Error(payload.error);
+      if (eventName === 'done') done = payload;
+      if (eventName === 'message' && payload.token) {
+        text += payload.token;
+        onToken?.(payload.token, text);
+      }
+    }
+  }
+  return { text, done };
+};
+
+export const generatePlanStream = async (userProfile, onToken) => {
   try {
-    const response = await axios.post(`${API_URL}/generate-plan`, { userProfile });
-    return response.data;
+    const { json, text, done } = await streamRequest('generate-plan', { userProfile }, onToken);
+    return json || { success: true, lifestylePlan: text, sessionId: done.sessionId };
   } catch (error) {
     console.error('Error generating plan:', error);
     throw error;
   }
 };
 
-export const askQuestion = async (question, userProfile, lifestylePlan) => {
+export const askQuestionStream = async (question, sessionId, userProfile, lifestylePlan, onToken) => {
   try {
-    const response = await axios.post(`${API_URL}/ask-question`, {
-      question,
-      userProfile,
-      lifestylePlan
-    });
-    return response.data;
+    let { json, text, done } = await streamRequest('ask-question', { question, sessionId }, onToken);
+    if (json?.sessionExpired) {
+      ({ json, text, done } = await streamRequest('ask-question', { question, userProfile, lifestylePlan }, onToken));
+    }
+    return json || { success: true, response: text, sessionId: done.sessionId };
   } catch (error) {
     console.error('Error asking question:', error);
     throw error;
   }
-};
\ No newline at end of file
+};
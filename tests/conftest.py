@@ -0,0 +1,70 @@
+# Shared setup for the backend tests. app.py reads the model endpoint when it
+# is imported, so the fake chat-completions server from benchmark.py is
+# started first and the app is imported once for the whole run.
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+model_server = benchmark.start_fake_model_server(0.01)
+os.environ["MODEL_ENDPOINT"] = f"http://127.0.0.1:{model_server.server_port}"
+os.environ["GITHUB_TOKEN"] = "fake-token"
+os.environ["PROFILE_DB"] = os.path.join(tempfile.mkdtemp(prefix="ayush_tests_"), "user_profiles.sqlite3")
+
+import app  # noqa: E402
+
+
+# Fresh breakers, caches and sessions for every test. Warm-up and ingestion
+# are skipped: these tests only exercise the model paths, not retrieval.
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(app, "start_warm_up", lambda: None)
+    monkeypatch.setattr(app, "start_ingestion_worker", lambda: None)
+    monkeypatch.setattr(app, "MODEL_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(app, "SEMANTIC_CACHE", False)
+    monkeypatch.setattr(app, "model_client", app.ModelClient())
+    monkeypatch.setattr(app, "completion_cache", app.CompletionCache(64, 3600))
+    monkeypatch.setattr(app, "session_store", app.SessionStore(100, 3600))
+    monkeypatch.setattr(benchmark.FakeChatHandler, "latency", 0.01)
+    monkeypatch.setattr(benchmark.FakeChatHandler, "model_latency", {})
+    monkeypatch.setattr(benchmark.FakeChatHandler, "fail_streams", False)
+    monkeypatch.setattr(benchmark.FakeChatHandler, "requests_served", 0)
+    return app
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+QUESTION = "How can I sleep better at night?"
+
+
+# Posts to /api/ask-question, starting a new session unless one is given
+def ask(client, stream=False, **body):
+    body.setdefault("question", QUESTION)
+    if "sessionId" not in body:
+        body = dict({"userProfile": {"name": "Asha"}, "lifestylePlan": "Go to bed by 10pm."}, **body)
+    return client.post("/api/ask-question", json=dict(body, stream=stream))
+
+
+# (event name, payload) pairs from a server-sent events body
+def parse_sse(data):
+    events = []
+    for frame in data.decode("utf-8").split("\n\n"):
+        if not frame:
+            continue
+        name, payload = "message", ""
+        for line in frame.split("\n"):
+            if line.startswith("event: "):
+                name = line[len("event: "):]
+            elif line.startswith("data: "):
+                payload += line[len("data: "):]
+        events.append((name, json.loads(payload)))
+    return events
@@ -0,0 +1,64 @@
+# Batch plan generation: duplicate grouping, per-position results and sessions,
+# and how unavailable or offline plans are reported
+import pytest
+
+from benchmark import FakeChatHandler
+
+ANSWER = FakeChatHandler.fake_content([])
+PROFILE = {"name": "Asha", "diet": "vegetarian", "sleep": "wakes up at night"}
+OTHER_PROFILE = {"name": "Ravi", "exercise": "walks daily"}
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.query_groups = []
+
+    def batch_multi_search(self, query_groups, k, k_per_query):
+        self.query_groups.extend(query_groups)
+        return [
+            [(f"Advice about {queries[0]}", {"source": "guide.pdf", "page": 1}, 0.9)]
+            for queries in query_groups
+        ]
+
+
+@pytest.fixture
+def batch(backend, monkeypatch):
+    monkeypatch.setattr(backend, "plan_call_limiter", backend.PlanCallLimiter(4, 0))
+    monkeypatch.setattr(backend, "batch_jobs", backend.BatchJobStore(16, 3600))
+    return backend
+
+
+def run_job(backend, profiles):
+    job = backend.start_batch_job(profiles, FakeVectorStore())
+    events = list(job.iter_events())
+    return job.snapshot(), events
+
+
+def test_duplicates_share_one_model_call_but_get_their_own_sessions(batch):
+    snapshot, events = run_job(batch, [PROFILE, OTHER_PROFILE, dict(PROFILE)])
+
+    assert snapshot["state"] == "done"
+    assert (snapshot["total"], snapshot["unique"]) == (3, 2)
+    assert (snapshot["completed"], snapshot["failed"]) == (3, 0)
+    assert FakeChatHandler.requests_served == 2
+    results = sorted(snapshot["results"], key=lambda result: result["index"])
+    assert [result["lifestylePlan"] for result in results] == [ANSWER] * 3
+    assert results[2]["duplicateOf"] == 0
+    session_ids = [result["sessionId"] for result in results]
+    assert len(set(session_ids)) == 3
+    assert all(batch.session_store.get(session_id) for session_id in session_ids)
+    assert events[-1]["type"] == "done"
+
+
+def test_offline_fallback_plans_count_as_failures(batch):
+    for model in batch.model_fallback_chain(batch.PLAN_MODEL):
+        breaker = batch.model_client.breaker(model)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+    snapshot, _ = run_job(batch, [PROFILE, OTHER_PROFILE])
+
+    assert (snapshot["completed"], snapshot["failed"]) == (0, 2)
+    assert all("offline" in result["error"] for result in snapshot["results"])
+    assert all("sessionId" not in result for result in snapshot["results"])
+    assert FakeChatHandler.requests_served == 0
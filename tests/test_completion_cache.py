@@ -0,0 +1,30 @@
+# Completion cache: identical deterministic calls share one upstream request
+import asyncio
+
+from benchmark import FakeChatHandler
+
+ANSWER = FakeChatHandler.fake_content([])
+MESSAGES = [{"role": "user", "content": "Suggest a calming evening routine"}]
+
+
+def test_completion_cache_coalesces_identical_calls(backend, monkeypatch):
+    monkeypatch.setattr(FakeChatHandler, "latency", 0.3)
+
+    async def identical_calls():
+        return await asyncio.gather(*(
+            backend.acall_github_model(MESSAGES, "gpt-4o-mini", temperature=0.2) for _ in range(4)
+        ))
+
+    answers = backend.run_async(identical_calls(), timeout=10)
+    assert answers == [ANSWER] * 4
+    assert FakeChatHandler.requests_served == 1
+
+    assert backend.call_github_model(MESSAGES, "gpt-4o-mini", temperature=0.2) == ANSWER
+    assert FakeChatHandler.requests_served == 1
+
+
+def test_completion_cache_skips_high_temperature(backend):
+    backend.call_github_model(MESSAGES, "gpt-4o-mini", temperature=0.7)
+    backend.call_github_model(MESSAGES, "gpt-4o-mini", temperature=0.7)
+
+    assert FakeChatHandler.requests_served == 2
@@ -0,0 +1,90 @@
+# The plan prompt's knowledge section: near-duplicate and overlap removal,
+# the token budget, and the before/after report
+import random
+
+import pytest
+
+from benchmark import VOCABULARY
+
+
+class Doc:
+    def __init__(self, page_content):
+        self.page_content = page_content
+
+
+def passage(seed, lines=6, words=12):
+    rng = random.Random(seed)
+    return "\n".join(" ".join(rng.choice(VOCABULARY) for _ in range(words)) for _ in range(lines))
+
+
+@pytest.fixture
+def user_prompt(backend, monkeypatch):
+    monkeypatch.setattr(backend, "context_stats", backend.ContextStats())
+
+    def build(user_data, scored_docs):
+        messages = backend.build_plan_messages(user_data, None, scored_docs=scored_docs)
+        return messages[1]["content"]
+    return build
+
+
+def test_near_duplicates_are_dropped(backend):
+    text = passage(1)
+    scored = [(Doc(text), 0.9), (Doc(text.replace("\n", " \n ") + " ok"), 0.8), (Doc(passage(2)), 0.7)]
+
+    context, dropped = backend.build_knowledge_context(scored, 1000)
+
+    assert dropped == 1
+    assert context == text + "\n\n" + passage(2)
+
+
+def test_lines_repeated_through_overlap_are_cut(backend):
+    first, second = passage(1).split("\n"), passage(2).split("\n")
+    # The second chunk starts with the last two lines of the first
+    overlapping = "\n".join(first[-2:] + second)
+
+    context, dropped = backend.build_knowledge_context([(Doc(passage(1)), 0.9), (Doc(overlapping), 0.8)], 1000)
+
+    assert dropped == 0
+    assert context == passage(1) + "\n\n" + passage(2)
+
+
+def test_chunks_are_added_by_relevance_within_the_budget(backend):
+    scored = [(Doc(passage(seed, lines=10)), score) for seed, score in ((1, 0.2), (2, 0.9), (3, 0.5))]
+
+    for budget in (60, 150, 250, 400):
+        context, _ = backend.build_knowledge_context(scored, budget)
+        assert backend.estimate_tokens(context) <= budget
+    context, _ = backend.build_knowledge_context(scored, 250)
+    assert context.startswith(passage(2, lines=10))
+
+
+def test_truncation_stays_within_the_budget(backend):
+    text = passage(1, lines=20)
+    for budget in range(1, 100):
+        assert backend.estimate_tokens(backend.truncate_to_tokens(text, budget)) <= budget
+
+
+def test_report_compares_the_same_candidates(backend, user_prompt):
+    user_data = {"name": "Asha", "diet": "vegetarian", "notes": "", "history": []}
+    scored = [(Doc(passage(seed)), 1.0 - seed / 10) for seed in range(backend.CONTEXT_CANDIDATES)]
+
+    user_prompt(user_data, scored)
+
+    stats = backend.context_stats.stats()
+    verbatim = "\n\n".join(doc.page_content for doc, _ in scored)
+    assert stats["tokens_before"] == (
+        backend.estimate_tokens(backend.json.dumps(user_data, indent=2)) + backend.estimate_tokens(verbatim)
+    )
+    assert stats["tokens_saved"] >= 0
+
+
+def test_new_prompt_is_never_larger_than_the_old_one(backend, user_prompt):
+    # Short, distinct chunks: nothing to deduplicate, so only the cap helps
+    user_data = {"name": "Asha"}
+    scored = [(Doc(passage(seed, lines=1, words=4)), 1.0 - seed / 10) for seed in range(backend.CONTEXT_CANDIDATES)]
+
+    prompt = user_prompt(user_data, scored)
+
+    stats = backend.context_stats.stats()
+    assert stats["tokens_after"] <= stats["tokens_before"]
+    assert backend.compact_profile(user_data) in prompt
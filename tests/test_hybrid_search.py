@@ -0,0 +1,72 @@
+# BM25 keyword index and reciprocal rank fusion for hybrid retrieval
+CHUNKS = {
+    "ashwagandha": "Ashwagandha root powder with warm milk supports restful sleep.",
+    "triphala": "Triphala churna taken at bedtime eases digestion and constipation.",
+    "abhyanga": "Abhyanga, a daily warm sesame oil massage, calms vata and the nervous system.",
+    "walk": "A gentle walk after meals helps digestion and keeps the mind calm.",
+}
+
+
+def keyword_index(backend, tmp_path):
+    index = backend.KeywordIndex(str(tmp_path / "keyword_index.json"))
+    index.add(list(CHUNKS), list(CHUNKS.values()), [{"source": f"{chunk_id}.pdf"} for chunk_id in CHUNKS])
+    return index
+
+
+def test_exact_terms_rank_first(backend, tmp_path):
+    index = keyword_index(backend, tmp_path)
+
+    results = index.search("Which herb is triphala?", 2)
+
+    assert [chunk_id for chunk_id, _, _, _ in results] == ["triphala"]
+    chunk_id, text, metadata, score = results[0]
+    assert text == CHUNKS["triphala"] and metadata == {"source": "triphala.pdf"} and score > 0
+
+
+def test_rarer_terms_weigh_more(backend, tmp_path):
+    index = keyword_index(backend, tmp_path)
+
+    # "digestion" is in two chunks, "constipation" only in one
+    results = index.search("digestion constipation", 3)
+
+    assert [chunk_id for chunk_id, _, _, _ in results] == ["triphala", "walk"]
+
+
+def test_stopwords_match_nothing(backend, tmp_path):
+    assert keyword_index(backend, tmp_path).search("what is the and with", 3) == []
+
+
+def test_removed_and_replaced_chunks_leave_the_index(backend, tmp_path):
+    index = keyword_index(backend, tmp_path)
+
+    index.remove(["triphala"])
+    index.add(["walk"], ["Brisk walking in the morning sun."], [{}])
+
+    assert index.search("triphala", 3) == []
+    assert index.search("digestion", 3) == []
+    assert [chunk_id for chunk_id, _, _, _ in index.search("morning walking", 3)] == ["walk"]
+    assert len(index) == 3
+
+
+def test_saved_index_loads_with_the_same_results(backend, tmp_path):
+    index = keyword_index(backend, tmp_path)
+    index.save()
+
+    loaded = backend.KeywordIndex.load(index.path)
+
+    assert len(loaded) == len(index)
+    assert loaded.search("warm sesame oil", 4) == index.search("warm sesame oil", 4)
+    assert len(backend.KeywordIndex.load(str(tmp_path / "missing.json"))) == 0
+
+
+def test_fusion_favours_chunks_ranked_by_both_lists(backend):
+    dense = [("a", "A", {}, 0.9), ("b", "B", {}, 0.8), ("c", "C", {}, 0.7)]
+    keyword = [("b", "B", {}, 12.0), ("d", "D", {}, 3.0)]
+
+    fused = backend.reciprocal_rank_fusion([dense, keyword], 3)
+
+    # Only ranks count, not the lists' own scores
+    assert [chunk_id for chunk_id, _, _, _ in fused] == ["b", "a", "d"]
+    rrf_k = backend.RRF_K
+    assert fused[0][3] == 1.0 / (rrf_k + 2) + 1.0 / (rrf_k + 1)
+    assert fused[1][1:] == ("A", {}, 1.0 / (rrf_k + 1))
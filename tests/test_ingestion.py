@@ -0,0 +1,107 @@
+# Incremental ingestion: the manifest, staging collections and the
+# cross-process ingestion lock, on a scratch knowledge base of synthetic PDFs
+import fcntl
+import hashlib
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import benchmark
+
+
+# Bag-of-words stand-in for the embedding service that counts what it embeds
+class FakeEmbeddingService:
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts):
+        self.encoded += len(texts)
+        vectors = []
+        for text in texts:
+            vector = [0.0] * 32
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 32] += 1.0
+            vectors.append(vector)
+        return vectors
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def ingestion(backend, tmp_path, monkeypatch):
+    chroma_dir = str(tmp_path / "chroma_db")
+    monkeypatch.setattr(backend, "PDF_DIR", str(tmp_path / "knowledge_base"))
+    monkeypatch.setattr(backend, "CHROMA_DIR", chroma_dir)
+    monkeypatch.setattr(backend, "INGEST_MANIFEST_FILE", os.path.join(chroma_dir, "ingest_manifest.json"))
+    monkeypatch.setattr(backend, "KEYWORD_INDEX_FILE", os.path.join(chroma_dir, "keyword_index.json"))
+    monkeypatch.setattr(backend, "INGEST_LOCK_FILE", os.path.join(chroma_dir, "ingest.lock"))
+    monkeypatch.setattr(backend, "_embedding_service", FakeEmbeddingService())
+    os.makedirs(backend.PDF_DIR)
+    return backend
+
+
+def add_pdf(backend, name, seed):
+    benchmark.write_synthetic_pdf(os.path.join(backend.PDF_DIR, name), 2, random.Random(seed))
+
+
+def manifest(backend):
+    with open(backend.INGEST_MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def test_unchanged_pdfs_are_not_embedded_again(ingestion):
+    add_pdf(ingestion, "a.pdf", 1)
+    add_pdf(ingestion, "b.pdf", 2)
+    first = ingestion.create_vector_db()
+    embedded = ingestion._embedding_service.encoded
+    chunks = first.collection.count()
+
+    second = ingestion.create_vector_db()
+
+    assert embedded == chunks > 0
+    assert ingestion._embedding_service.encoded == embedded
+    assert second.collection_name == first.collection_name == manifest(ingestion)["collection"]
+    assert sorted(manifest(ingestion)["files"]) == ["a.pdf", "b.pdf"]
+
+
+def test_changes_are_built_into_a_new_collection(ingestion):
+    add_pdf(ingestion, "a.pdf", 1)
+    add_pdf(ingestion, "b.pdf", 2)
+    first = ingestion.create_vector_db()
+    a_chunks = len(manifest(ingestion)["files"]["a.pdf"]["chunk_ids"])
+    embedded = ingestion._embedding_service.encoded
+
+    os.remove(os.path.join(ingestion.PDF_DIR, "b.pdf"))
+    add_pdf(ingestion, "c.pdf", 3)
+    second = ingestion.create_vector_db()
+
+    c_chunks = len(manifest(ingestion)["files"]["c.pdf"]["chunk_ids"])
+    # Only the new PDF was embedded; a.pdf's chunks were copied over
+    assert ingestion._embedding_service.encoded == embedded + c_chunks
+    assert second.collection_name != first.collection_name
+    assert second.collection.count() == a_chunks + c_chunks
+    assert sorted(manifest(ingestion)["files"]) == ["a.pdf", "c.pdf"]
+    assert ingestion.live_collection_name() == second.collection_name
+    # The replaced collection keeps serving until the next run drops it
+    assert first.collection.count() > 0
+
+
+def test_runs_wait_for_the_ingestion_lock(ingestion):
+    add_pdf(ingestion, "a.pdf", 1)
+    os.makedirs(ingestion.CHROMA_DIR)
+    stores = []
+    with open(ingestion.INGEST_LOCK_FILE, "a") as lock_file:
+        # Another process's run holds the lock
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        run = threading.Thread(target=lambda: stores.append(ingestion.create_vector_db()))
+        run.start()
+        run.join(1.0)
+        assert run.is_alive()
+        assert not os.path.exists(ingestion.INGEST_MANIFEST_FILE)
+    run.join(60)
+
+    assert stores and stores[0].collection.count() > 0
@@ -0,0 +1,140 @@
+# ModelClient: the circuit breaker and local fallback, the per-call time
+# budget, and streams going through the same breaker, call and timeout
+# bookkeeping as regular completions
+import asyncio
+import time
+
+import pytest
+
+from benchmark import FakeChatHandler
+
+ANSWER = FakeChatHandler.fake_content([])
+MESSAGES = [{"role": "user", "content": "Suggest a calming evening routine"}]
+
+
+def open_to_half_open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def collect_stream(backend, model_name="gpt-4o-mini"):
+    async def collect():
+        tokens = []
+        async for token in backend.astream_github_model(MESSAGES, model_name):
+            tokens.append(token)
+        return tokens
+    return backend.run_async(collect(), timeout=30)
+
+
+def test_retries_stop_at_the_call_budget(backend, monkeypatch):
+    monkeypatch.setattr(FakeChatHandler, "latency", 5)
+    monkeypatch.setitem(backend.MODEL_TIMEOUTS, "gpt-4o-mini", 0.3)
+    monkeypatch.setitem(backend.MODEL_CALL_BUDGETS, "gpt-4o-mini", 0.5)
+    # Import the SDK first, so the timing only covers the calls
+    backend.import_dependencies()
+
+    start = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        backend.run_async(backend.model_client.complete(MESSAGES, "gpt-4o-mini", 0.7, 100), timeout=30)
+
+    # Two attempts fit in the budget, the second cut short; a third never starts
+    assert time.time() - start < 1.0
+    assert backend.model_client.calls == 2
+    assert backend.model_client.timeouts == 2
+    assert backend.model_client.breaker("gpt-4o-mini").failures == 1
+
+
+def test_streams_are_counted_like_completions(backend):
+    assert "".join(collect_stream(backend)) == ANSWER
+
+    stats = backend.model_client.stats()
+    assert stats["calls"] == 1
+    assert stats["timeouts"] == 0
+    assert stats["breakers"]["gpt-4o-mini"]["state"] == "closed"
+
+
+def test_failed_stream_counts_against_the_breaker(backend, monkeypatch):
+    monkeypatch.setattr(FakeChatHandler, "fail_streams", True)
+
+    assert collect_stream(backend) == [ANSWER]
+
+    # The failed stream and the completion that replaced it
+    assert backend.model_client.calls == 2
+    assert backend.model_client.breaker("gpt-4o-mini").failures == 0
+
+
+def test_stream_past_its_budget_is_cut_off(backend, monkeypatch):
+    # Tokens keep arriving, but the whole answer would take three seconds
+    monkeypatch.setattr(FakeChatHandler, "latency", 3)
+    monkeypatch.setitem(backend.MODEL_CALL_BUDGETS, "gpt-4o-mini", 0.5)
+    tokens = []
+
+    async def collect():
+        async for token in backend.astream_github_model(MESSAGES, "gpt-4o-mini"):
+            tokens.append(token)
+
+    start = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        backend.run_async(collect(), timeout=30)
+
+    assert time.time() - start < 1.0
+    assert 0 < len(tokens) < len(ANSWER.split(" "))
+    assert backend.model_client.timeouts == 1
+    assert backend.model_client.breaker("gpt-4o-mini").failures == 1
+
+
+def test_stream_skips_an_open_circuit(backend):
+    breaker = backend.model_client.breaker("gpt-4o-mini")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    answer = collect_stream(backend)
+
+    assert len(answer) == 1 and answer[0] != backend.MODEL_ERROR_RESPONSE
+    assert backend.model_client.calls == 0
+    assert backend.model_client.local_fallbacks == 1
+    assert FakeChatHandler.requests_served == 0
+
+
+def test_open_circuit_answers_locally(backend):
+    breaker = backend.model_client.breaker("gpt-4o-mini")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    answer = backend.call_github_model(MESSAGES, "gpt-4o-mini")
+
+    assert answer != backend.MODEL_ERROR_RESPONSE
+    assert backend.model_client.local_fallbacks == 1
+    assert FakeChatHandler.requests_served == 0
+
+
+def test_cancelled_stream_releases_half_open_probe(backend, monkeypatch):
+    # Slow enough that the stream is cancelled before its first token
+    monkeypatch.setattr(FakeChatHandler, "latency", 60)
+    breaker = backend.model_client.breaker("gpt-4o-mini")
+    open_to_half_open(breaker)
+
+    async def cancel_before_first_token():
+        tokens = backend.astream_github_model(MESSAGES, "gpt-4o-mini")
+        first = asyncio.ensure_future(tokens.__anext__())
+        await asyncio.sleep(0.2)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await tokens.aclose()
+
+    backend.run_async(cancel_before_first_token(), timeout=10)
+
+    assert breaker.state == "half_open"
+    assert breaker.allow() == "probe"
+
+
+def test_cache_hit_does_not_take_half_open_probe(backend):
+    first = backend.call_github_model(MESSAGES, "gpt-4o-mini", temperature=0.2)
+    breaker = backend.model_client.breaker("gpt-4o-mini")
+    open_to_half_open(breaker)
+
+    assert backend.call_github_model(MESSAGES, "gpt-4o-mini", temperature=0.2) == first
+    assert FakeChatHandler.requests_served == 1
+    assert breaker.allow() == "probe"
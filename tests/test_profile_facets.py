@@ -0,0 +1,61 @@
+# Routing profile fields to per-facet retrieval sub-queries
+from benchmark import SAMPLE_PROFILE
+
+
+def queries_by_facet(backend, user_data):
+    prefixes = {prefix: facet for facet, prefix in backend.FACET_QUERIES.items()}
+    routed = {}
+    for query in backend.profile_sub_queries(user_data):
+        prefix, facts = query.split(": ", 1)
+        routed[prefixes[prefix]] = facts
+    return routed
+
+
+def test_sample_profile_is_split_by_facet(backend):
+    routed = queries_by_facet(backend, SAMPLE_PROFILE)
+
+    assert set(routed) == {"dosha", "diet", "sleep", "stress", "exercise", "general"}
+    assert "typicalDiet: rice, dal, vegetables" in routed["diet"]
+    assert "averageSleepHours: 6" in routed["sleep"]
+    assert "currentStressors: work deadlines" in routed["stress"]
+    assert "dominantDosha: vata" in routed["dosha"]
+
+
+def test_keywords_match_whole_words_of_the_key_path(backend):
+    routed = queries_by_facet(backend, {
+        "dietary_restrictions": "no onion",
+        "bodyHeat": "runs hot",
+    })
+
+    # "rest" is not in dietary_restrictions and "eat" is not in bodyHeat
+    assert "sleep" not in routed
+    assert routed["diet"] == "dietary_restrictions: no onion"
+    assert routed["general"] == "bodyHeat: runs hot"
+
+
+def test_unmatched_fields_reach_the_catch_all_query(backend):
+    routed = queries_by_facet(backend, {
+        "personalInformation": {"name": "Asha", "age": 34, "email": "asha@example.com"},
+        "healthConcerns": ["joint pain", "acidity"],
+        "conditions": "hypothyroidism",
+        "userId": "u-1",
+    })
+
+    assert list(routed) == ["general"]
+    general = routed["general"]
+    assert "personalInformation age: 34" in general
+    assert "healthConcerns: joint pain; healthConcerns: acidity" in general
+    assert "conditions: hypothyroidism" in general
+    # Identifying fields are never sent to retrieval
+    assert "Asha" not in general and "example.com" not in general and "u-1" not in general
+
+
+def test_sub_queries_stay_within_their_token_budget(backend):
+    queries = backend.profile_sub_queries({"healthConcerns": ["a long description of symptoms"] * 100})
+
+    assert len(queries) == 1
+    assert backend.estimate_tokens(queries[0]) <= backend.SUB_QUERY_TOKENS
+
+
+def test_identity_only_profile_has_no_sub_queries(backend):
+    assert backend.profile_sub_queries({"name": "Asha", "personalInformation": {"phone": "123"}}) == []
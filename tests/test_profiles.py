@@ -0,0 +1,102 @@
+# Per-user profile store and the token checks on the profile routes
+import json
+import threading
+
+import pytest
+
+from benchmark import SAMPLE_PROFILE
+
+RESPONSES = [{"question": "How is your sleep?", "answer": "Light, around 6 hours"}]
+API_TOKEN = "test-api-token"
+
+
+@pytest.fixture
+def profiles(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, "profile_store", backend.ProfileStore(str(tmp_path / "profiles.sqlite3"), cache_size=2))
+    monkeypatch.setattr(backend, "PROFILE_API_TOKEN", API_TOKEN)
+    return backend.profile_store
+
+
+def submit(client, **body):
+    return client.post("/api/submit-responses", json=dict(body, responses=RESPONSES)).get_json()
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_saves_are_readable_before_and_after_the_write(profiles):
+    profiles.save("a", {"n": 1})
+    assert profiles.get("a") == {"n": 1}
+
+    profiles.flush()
+    for user_id in "bcd":
+        profiles.save(user_id, {"n": user_id})
+    profiles.flush()
+
+    # "a" has left the two-entry cache and is read back from SQLite
+    assert profiles.get("a") == {"n": 1}
+    assert profiles.stats()["misses"] == 1
+    assert profiles.stats()["writes"] == 4
+
+
+def test_concurrent_saves_are_all_written(profiles):
+    def write(client):
+        for i in range(50):
+            profiles.save(f"user-{client}-{i}", {"client": client, "i": i})
+
+    threads = [threading.Thread(target=write, args=(client,)) for client in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiles.flush()
+
+    rows = profiles.export_page(page_size=1000)
+    assert len(rows) == 400
+    assert json.loads(dict((user_id, data) for user_id, data, _ in rows)["user-3-7"]) == {"client": 3, "i": 7}
+
+
+def test_submit_returns_a_server_chosen_id_and_its_token(client, backend, profiles):
+    body = submit(client, userId="someone-else")
+
+    assert body["success"] is True
+    assert body["userProfile"] == SAMPLE_PROFILE
+    assert body["userId"] != "someone-else"
+    assert body["userToken"] == backend.profile_user_token(body["userId"])
+    assert profiles.get(body["userId"]) == SAMPLE_PROFILE
+
+
+def test_resubmitting_needs_the_matching_token(client, profiles):
+    first = submit(client)
+
+    updated = submit(client, userId=first["userId"], userToken=first["userToken"])
+    forged = submit(client, userId=first["userId"], userToken="0" * 64)
+
+    assert updated["userId"] == first["userId"]
+    assert forged["userId"] not in (first["userId"], updated["userId"])
+
+
+def test_profile_reads_need_the_user_or_api_token(client, profiles):
+    first = submit(client)
+    other = submit(client)
+    path = f"/api/profiles/{first['userId']}"
+
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=bearer(other["userToken"])).status_code == 401
+    missing = client.get(path, headers=bearer("wrong"))
+    assert missing.status_code == 401 and missing.headers["WWW-Authenticate"] == "Bearer"
+    assert client.get(path, headers=bearer(first["userToken"])).get_json()["userProfile"] == SAMPLE_PROFILE
+    assert client.get(path, headers=bearer(API_TOKEN)).status_code == 200
+
+
+def test_export_needs_the_api_token(client, backend, profiles, monkeypatch):
+    first = submit(client)
+
+    assert client.get("/api/profiles/export", headers=bearer(first["userToken"])).status_code == 401
+    lines = client.get("/api/profiles/export", headers=bearer(API_TOKEN)).data.decode("utf-8").splitlines()
+    assert [json.loads(line)["userId"] for line in lines] == [first["userId"]]
+
+    # Without a configured API token nothing can export
+    monkeypatch.setattr(backend, "PROFILE_API_TOKEN", None)
+    assert client.get("/api/profiles/export", headers=bearer("None")).status_code == 401
@@ -0,0 +1,51 @@
+# Semantic answer cache for ask-question: paraphrases reuse an earlier answer
+# for the same profile and plan
+import hashlib
+import re
+
+import numpy as np
+
+from benchmark import FakeChatHandler
+from conftest import ask, parse_sse
+
+
+# Bag-of-words stand-in for the embedding model: questions with the same
+# words get the same vector
+def fake_embedding(question):
+    vector = np.zeros(64, dtype=np.float32)
+    for word in re.findall(r"[a-z]+", question.lower()):
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % 64] += 1
+    return vector
+
+
+def test_semantic_cache_answers_repeated_question(client, backend, monkeypatch):
+    monkeypatch.setattr(backend, "SEMANTIC_CACHE", True)
+    monkeypatch.setattr(backend, "semantic_cache", backend.SemanticAnswerCache(100, 10, 3600, 0.9))
+    monkeypatch.setattr(backend, "embed_question", fake_embedding)
+
+    first = ask(client).get_json()
+    session_id = first["sessionId"]
+    second = ask(client, sessionId=session_id, question="how can i SLEEP better at night").get_json()
+    streamed = parse_sse(ask(client, stream=True, sessionId=session_id).data)
+
+    assert "cached" not in first
+    assert second["cached"] is True and second["response"] == first["response"]
+    assert streamed == [
+        ("message", {"token": first["response"]}),
+        ("done", {"sessionId": session_id, "cached": True, "success": True})
+    ]
+    assert FakeChatHandler.requests_served == 1
+
+
+def test_answers_are_not_shared_across_plans(client, backend, monkeypatch):
+    monkeypatch.setattr(backend, "SEMANTIC_CACHE", True)
+    monkeypatch.setattr(backend, "semantic_cache", backend.SemanticAnswerCache(100, 10, 3600, 0.9))
+    monkeypatch.setattr(backend, "embed_question", fake_embedding)
+
+    first = ask(client).get_json()
+    other = ask(client, lifestylePlan="Walk for thirty minutes after lunch.").get_json()
+
+    assert "cached" not in other
+    assert other["sessionId"] != first["sessionId"]
+    assert FakeChatHandler.requests_served == 2
+    assert backend.semantic_cache.stats()["scopes"] == 2
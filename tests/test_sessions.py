@@ -0,0 +1,88 @@
+# Chat sessions: what is stored, how turns are folded into the summary, and
+# which parts of the plan a follow-up question gets
+import pytest
+
+SECTIONS = {
+    "Daily Routine": "Wake before sunrise and scrape the tongue. Drink warm water. ",
+    "Diet Plan": "Favour warm cooked meals such as kitchari and ghee. Avoid cold salads at night. ",
+    "Yoga and Exercise": "Practise surya namaskar and a gentle walk after dinner. ",
+    "Sleep Hygiene": "Sleep by 10pm and massage the feet with sesame oil before bed. ",
+}
+
+
+def long_plan(repeat=20):
+    return "# Personalized AYUSH Lifestyle Plan\n\n" + "\n\n".join(
+        f"## {heading}\n" + body * repeat for heading, body in SECTIONS.items()
+    )
+
+
+def plan_prompt(backend, session, question):
+    return backend.build_question_messages(session, question)[1]["content"]
+
+
+def test_create_stores_the_pruned_profile_and_the_whole_plan(backend):
+    plan = long_plan()
+    session_id = backend.session_store.create({"name": "Asha", "notes": "", "conditions": []}, plan)
+
+    session = backend.session_store.get(session_id)
+
+    assert session["profile"] == '{"name":"Asha"}'
+    assert session["plan"] == plan
+
+
+def test_short_plans_are_sent_whole(backend):
+    session_id = backend.session_store.create({"name": "Asha"}, "Go to bed by 10pm.")
+
+    prompt = plan_prompt(backend, backend.session_store.get(session_id), "When should I sleep?")
+
+    assert "Lifestyle Plan: Go to bed by 10pm." in prompt
+
+
+def test_questions_get_the_relevant_plan_sections(backend, monkeypatch):
+    monkeypatch.setattr(backend, "SESSION_PLAN_TOKENS", 600)
+    session = backend.session_store.get(backend.session_store.create({"name": "Asha"}, long_plan()))
+
+    prompt = plan_prompt(backend, session, "Which oil should I use before sleep?")
+
+    plan = prompt.split("Lifestyle Plan: ")[1].split("\n\nUser Question:")[0]
+    assert backend.estimate_tokens(plan) <= 600
+    # The sleep section is whole even though it comes last in the plan
+    assert (SECTIONS["Sleep Hygiene"] * 20).strip() in plan
+    # The other sections are still outlined, in plan order
+    positions = [plan.index(f"## {heading}") for heading in SECTIONS]
+    assert positions == sorted(positions)
+    assert "Favour warm cooked meals such as kitchari and ghee" in plan
+    assert SECTIONS["Diet Plan"] * 2 not in plan
+
+
+def test_split_plan_sections_keeps_the_title_with_the_first_section(backend):
+    sections = backend.split_plan_sections("# Plan\n\n## Diet\nEat warm food.\n**Sleep**\nRest early.")
+
+    assert sections == [("# Plan\n## Diet", "Eat warm food."), ("**Sleep**", "Rest early.")]
+
+
+def test_old_turns_are_folded_into_the_summary(backend, monkeypatch):
+    monkeypatch.setattr(backend, "SESSION_RECENT_TOKENS", 50)
+    session_id = backend.session_store.create({"name": "Asha"}, "Go to bed by 10pm.")
+
+    for i in range(4):
+        backend.session_store.add_turn(session_id, f"Question {i}?", f"Answer {i}. " + "More detail. " * 10)
+
+    session = backend.session_store.get(session_id)
+    assert [question for question, _ in session["recent"]] == ["Question 3?"]
+    assert session["summary"][0] == "Q: Question 0? A: Answer 0"
+    prompt = plan_prompt(backend, session, "And tomorrow?")
+    assert "Earlier in this conversation:\nQ: Question 0? A: Answer 0" in prompt
+
+
+@pytest.mark.parametrize("persistent", [False, True])
+def test_sessions_expire_after_the_ttl(backend, tmp_path, persistent):
+    store = backend.SessionStore(10, 60, db_path=str(tmp_path / "sessions.sqlite3") if persistent else None)
+    session_id = store.create({"name": "Asha"}, "Go to bed by 10pm.")
+    store._data[session_id]["updated_at"] -= 120
+    if persistent:
+        store._store(session_id, store._data.pop(session_id))
+        store._data.clear()
+
+    assert store.get(session_id) is None
+    assert store.stats()["misses"] == 1
@@ -0,0 +1,98 @@
+# Multi-process serving: query workers reach the retrieval sidecar's vector
+# store and shared stores over its Unix socket. The sidecar runs on a thread
+# here; the protocol is the same as across processes.
+import os
+import threading
+import time
+
+import pytest
+
+AUTHKEY = b"test-sidecar-key"
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.calls = []
+
+    def search(self, query, k):
+        self.calls.append(("search", query, k))
+        return [(f"About {query}", {"source": "guide.pdf"}, 0.5)][:k]
+
+    def multi_search(self, queries, k, k_per_query):
+        self.calls.append(("multi_search", tuple(queries), k))
+        return [(f"About {query}", {}, 0.5) for query in queries][:k]
+
+    def batch_multi_search(self, query_groups, k, k_per_query):
+        self.calls.append(("batch_multi_search", len(query_groups), k))
+        return [self.multi_search(queries, k, k_per_query) for queries in query_groups]
+
+
+@pytest.fixture
+def sidecar(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, "SERVING_ROLE", backend.SERVING_ROLE)
+    monkeypatch.setattr(backend, "vector_store", None)
+    monkeypatch.setattr(backend, "retrieval_cache", backend.TTLCache(100, 3600))
+    address = str(tmp_path / "retrieval.sock")
+    threading.Thread(target=backend.run_retrieval_sidecar, args=(address, AUTHKEY), daemon=True).start()
+    deadline = time.time() + 10
+    while not os.path.exists(address):
+        assert time.time() < deadline, "sidecar did not start listening"
+        time.sleep(0.01)
+    return backend.RetrievalClient(address, AUTHKEY)
+
+
+def test_searches_wait_for_the_sidecar_store(backend, sidecar):
+    assert sidecar.call("status")["vector_store"] is False
+    with pytest.raises(RuntimeError, match="not ready"):
+        sidecar.call("search", "sleep", 2)
+
+
+def test_remote_store_searches_through_the_sidecar_and_caches(backend, sidecar, monkeypatch):
+    store = FakeVectorStore()
+    monkeypatch.setattr(backend, "vector_store", store)
+    remote = backend.RemoteVectorStore(sidecar)
+
+    assert remote.search("Warm  milk", 1) == [("About Warm  milk", {"source": "guide.pdf"}, 0.5)]
+    # Normalized repeats are answered from the worker's own cache
+    remote.search("warm milk", 1)
+    assert remote.multi_search(["sleep", "diet"], 2, 2) == [("About sleep", {}, 0.5), ("About diet", {}, 0.5)]
+    batched = remote.batch_multi_search([["sleep", "diet"], ["stress"]], 2, 2)
+
+    assert batched[1] == [("About stress", {}, 0.5)]
+    assert store.calls == [
+        ("search", "Warm  milk", 1),
+        ("multi_search", ("sleep", "diet"), 2),
+        ("batch_multi_search", 1, 2),
+        ("multi_search", ("stress",), 2),
+    ]
+    with pytest.raises(NotImplementedError):
+        remote.add_documents([])
+
+
+def test_sessions_live_in_the_sidecar(backend, sidecar):
+    sessions = backend.RemoteStore(sidecar, "sessions")
+
+    session_id = sessions.create({"name": "Asha"}, "Go to bed by 10pm.")
+    sessions.add_turn(session_id, "When?", "By 10pm.")
+
+    # Any worker sees the same session
+    assert backend.session_store.get(session_id)["recent"] == [["When?", "By 10pm."]]
+    assert backend.RemoteStore(sidecar, "sessions").get(session_id)["plan"] == "Go to bed by 10pm."
+
+
+def test_only_shared_store_methods_can_be_called(backend, sidecar):
+    with pytest.raises(AttributeError):
+        backend.RemoteStore(sidecar, "sessions")._store
+    with pytest.raises(RuntimeError, match="unknown method"):
+        sidecar.call("sessions._store", "id", {})
+    with pytest.raises(RuntimeError, match="unknown method"):
+        sidecar.call("model_client.stats")
+
+
+def test_client_reconnects_after_a_dropped_connection(backend, sidecar):
+    sidecar.call("status")
+    conn = sidecar._pool.get_nowait()
+    conn.close()
+    sidecar._pool.put(conn)
+
+    assert sidecar.call("status")["pid"] == os.getpid()
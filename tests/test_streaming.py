@@ -0,0 +1,45 @@
+# Streaming responses and their fallback, against the fake chat-completions
+# server from benchmark.py
+from benchmark import FakeChatHandler
+from conftest import QUESTION, ask, parse_sse
+
+ANSWER = FakeChatHandler.fake_content([])
+
+
+def test_stream_sends_token_events_then_done(client, backend):
+    response = ask(client, stream=True)
+
+    assert response.mimetype == "text/event-stream"
+    events = parse_sse(response.data)
+    assert len(events) > 2
+    assert all(name == "message" for name, _ in events[:-1])
+    assert "".join(payload["token"] for _, payload in events[:-1]) == ANSWER
+    name, done = events[-1]
+    assert name == "done"
+    assert done["success"] is True
+    # The session id in the done event carries the conversation on
+    followup = ask(client, sessionId=done["sessionId"]).get_json()
+    assert followup["success"] is True
+    assert followup["sessionId"] == done["sessionId"]
+    assert backend.session_store.get(done["sessionId"])["recent"][0] == [QUESTION, ANSWER]
+
+
+def test_json_response_without_stream(client):
+    body = ask(client).get_json()
+
+    assert body["success"] is True
+    assert body["response"] == ANSWER
+    assert body["sessionId"]
+
+
+def test_stream_falls_back_to_completion_before_first_token(client, backend, monkeypatch):
+    monkeypatch.setattr(FakeChatHandler, "fail_streams", True)
+
+    events = parse_sse(ask(client, stream=True).data)
+
+    assert events[0] == ("message", {"token": ANSWER})
+    assert events[1][0] == "done" and events[1][1]["success"] is True
+    assert len(events) == 2
+    # The failed stream and the regular completion that replaced it
+    assert FakeChatHandler.requests_served == 2
+    assert backend.model_client.breaker("gpt-4o-mini").state == "closed"